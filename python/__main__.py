@@ -3,109 +3,231 @@
 import pulumi
 import pulumi_aws as aws
 
+import profiling
+from availability_zones import load_availability_zone_names
 from hub import HubVpc, HubVpcArgs
-from spoke import SpokeVpc, SpokeVpcArgs
-from spoke_workload import SpokeWorkload, SpokeWorkloadArgs
+from cidr_allocator import CidrAllocator
+from fleet import SpokeFleetArgs, allocate_spoke_cidrs, create_spoke_fleet, load_spoke_specs, reserve_spoke_cidrs
+from allowlist import DEFAULT_GROUP_CAPACITY, load_allowlist
+from firewall_logging import load_firewall_log_settings
+from firewall_model import MAX_POLICY_CAPACITY
 from firewall_rules import create_firewall_policy
+from flow_logs import flow_log_destination, load_flow_log_settings
+from hub_reference import HubReference, load_stack_role, read_spoke_cidrs
+from log_bucket import create_log_bucket
+from probe import load_probe_settings
+from vpc_endpoints import load_endpoint_settings
 
 project = pulumi.get_project()
 
 config = pulumi.Config()
+
+# Off unless `profile` is set in config (or PULUMI_PROGRAM_PROFILE in the
+# environment). Started first so it sees every resource.
+profiling.start(config)
 hub_and_spoke_supernet = config.require("hub-and-spoke-supernet")
 
-tgw = aws.ec2transitgateway.TransitGateway(
-    "tgw",
-    aws.ec2transitgateway.TransitGatewayArgs(
-        description=f"Transit Gateway - {project}",
-        default_route_table_association="disable",
-        default_route_table_propagation="disable",
-        tags={
-            "Name": "Pulumi"
-        }
+# `all` deploys everything in this stack; `hub` and `spokes` split it into a
+# hub stack and spoke stacks (see hub_reference.py).
+stack_role = load_stack_role(config)
+
+# Carve the hub and spoke VPCs out of the supernet. Blocks pinned in config are
+# reserved first, so nothing we allocate can collide with them.
+allocator = CidrAllocator(hub_and_spoke_supernet)
+spoke_specs = load_spoke_specs(config) if stack_role != "hub" else []
+hub_cidr = config.get("hub-cidr")
+hub_prefix_length = config.get_int("hub-prefix-length") or 24
+if hub_cidr:
+    allocator.reserve("hub", hub_cidr)
+elif stack_role == "spokes":
+    # Allocated as the hub stack (which has no spokes to reserve) allocates
+    # it, and checked against the hub stack's export:
+    hub_cidr = str(allocator.allocate_stable("hub", hub_prefix_length))
+# Allocation only sees this stack's spokes. With several spoke stacks, give
+# each its own `spokes-cidr` range, and/or list the others in `spoke-stacks`
+# so their blocks are reserved here and any overlap fails the update:
+for other_stack in config.get_object("spoke-stacks") or []:
+    for name, cidr in read_spoke_cidrs(other_stack).items():
+        allocator.reserve(f"{other_stack}: {name}", cidr)
+spoke_allocator = allocator
+spokes_cidr = config.get("spokes-cidr")
+if spokes_cidr:
+    allocator.reserve("spokes-cidr", spokes_cidr)
+    spoke_allocator = CidrAllocator(spokes_cidr)
+elif stack_role == "spokes" and not config.get_object("spoke-stacks"):
+    pulumi.log.warn(
+        "Neither spokes-cidr nor spoke-stacks is set, so spokes allocated here may overlap "
+        "those of other spoke stacks.")
+reserve_spoke_cidrs(spoke_specs, spoke_allocator)
+if not hub_cidr:
+    hub_cidr = str(allocator.allocate_stable("hub", hub_prefix_length))
+# Spokes keep the blocks this stack exported last time, so adding a spoke
+# never moves an existing one:
+spoke_specs = allocate_spoke_cidrs(
+    spoke_specs, spoke_allocator, config.get_int("spoke-prefix-length") or 16,
+    previous=read_spoke_cidrs() if spoke_specs else None)
+
+# Looked up once and shared by the hub and every spoke, so each spoke's TGW
+# attachment lands in AZs that have a firewall endpoint:
+availability_zone_names = load_availability_zone_names(config)
+
+# Interface endpoints per spoke, or once in the hub (see vpc_endpoints.py):
+endpoint_settings = load_endpoint_settings(config)
+
+# VPC flow logs for the hub and every spoke, in one bucket (see flow_logs.py):
+flow_log_settings = load_flow_log_settings(config)
+flow_logs = None
+
+if stack_role == "spokes":
+    hub = HubReference.from_stack(
+        config.require("hub-stack"),
+        supernet_cidr_block=hub_and_spoke_supernet,
+        hub_cidr_block=hub_cidr,
+        availability_zone_names=availability_zone_names,
+        endpoint_services=endpoint_settings.services if endpoint_settings.centralized else None,
+        # Spoke stacks log to the hub stack's bucket unless they name one:
+        flow_log_bucket=flow_log_settings is not None and flow_log_settings.bucket is None,
+    )
+    if flow_log_settings:
+        flow_logs = flow_log_destination(flow_log_settings.bucket or hub.flow_log_bucket, flow_log_settings)
+else:
+    tgw = aws.ec2transitgateway.TransitGateway(
+        "tgw",
+        aws.ec2transitgateway.TransitGatewayArgs(
+            description=f"Transit Gateway - {project}",
+            default_route_table_association="disable",
+            default_route_table_propagation="disable",
+            tags={
+                "Name": "Pulumi"
+            }
+        )
     )
-)
 
 
-inspection_tgw_route_table = aws.ec2transitgateway.RouteTable(
-    "post-inspection-tgw-route-table",
-    aws.ec2transitgateway.RouteTableArgs(
-        transit_gateway_id=tgw.id,
-        tags={
-            "Name": "post-inspection",
-        }
-    ),
-    # Adding the TGW as the parent makes the output of `pulumi up` a little
-    # easier to understand as it groups these resources visually under the TGW
-    # on which they depend.
-    opts=pulumi.ResourceOptions(
-        parent=tgw,
-    ),
-)
+    inspection_tgw_route_table = aws.ec2transitgateway.RouteTable(
+        "post-inspection-tgw-route-table",
+        aws.ec2transitgateway.RouteTableArgs(
+            transit_gateway_id=tgw.id,
+            tags={
+                "Name": "post-inspection",
+            }
+        ),
+        # Adding the TGW as the parent makes the output of `pulumi up` a little
+        # easier to understand as it groups these resources visually under the TGW
+        # on which they depend.
+        opts=pulumi.ResourceOptions(
+            parent=tgw,
+        ),
+    )
 
 
-spoke_tgw_route_table = aws.ec2transitgateway.RouteTable(
-    "spoke-tgw-route-table",
-    aws.ec2transitgateway.RouteTableArgs(
-        transit_gateway_id=tgw.id,
-        tags={
-            "Name": "spoke-tgw",
-        }
-    ),
-    opts=pulumi.ResourceOptions(
-        parent=tgw,
-    ),
-)
+    spoke_tgw_route_table = aws.ec2transitgateway.RouteTable(
+        "spoke-tgw-route-table",
+        aws.ec2transitgateway.RouteTableArgs(
+            transit_gateway_id=tgw.id,
+            tags={
+                "Name": "spoke-tgw",
+            }
+        ),
+        opts=pulumi.ResourceOptions(
+            parent=tgw,
+        ),
+    )
 
-hub_tgw_route_table = aws.ec2transitgateway.RouteTable(
-    "hub-tgw-route-table",
-    aws.ec2transitgateway.RouteTableArgs(
-        transit_gateway_id=tgw.id,
-        tags={
-            "Name": "hub-tgw-route-table",
-        }
-    ),
-    opts=pulumi.ResourceOptions(
-        parent=tgw,
-    ),
-)
+    hub_tgw_route_table = aws.ec2transitgateway.RouteTable(
+        "hub-tgw-route-table",
+        aws.ec2transitgateway.RouteTableArgs(
+            transit_gateway_id=tgw.id,
+            tags={
+                "Name": "hub-tgw-route-table",
+            }
+        ),
+        opts=pulumi.ResourceOptions(
+            parent=tgw,
+        ),
+    )
 
-firewall_policy_arn = create_firewall_policy(hub_and_spoke_supernet)
+    # An egress allowlist file, packed into stateful rule groups (see
+    # allowlist.py). Set firewall-policy-capacity if the account's quota on a
+    # policy's stateful capacity has been raised above the default:
+    allowlist_path = config.get("firewall-allowlist")
+    firewall_policy_arn = create_firewall_policy(
+        hub_and_spoke_supernet,
+        allowlist=load_allowlist(allowlist_path) if allowlist_path else None,
+        allowlist_capacity=config.get_int("firewall-allowlist-capacity") or DEFAULT_GROUP_CAPACITY,
+        policy_capacity=config.get_int("firewall-policy-capacity") or MAX_POLICY_CAPACITY,
+    )
 
-hub_vpc = HubVpc(
-    "hub",
-    HubVpcArgs(
-        supernet_cidr_block=hub_and_spoke_supernet,
-        vpc_cidr_block="10.129.0.0/24",
-        tgw_id=tgw.id,
-        hub_tgw_route_table_id=hub_tgw_route_table.id,
-        spoke_tgw_route_table_id=spoke_tgw_route_table.id,
-        firewall_policy_arn=firewall_policy_arn,
+    if flow_log_settings:
+        flow_log_bucket = flow_log_settings.bucket
+        if flow_log_bucket is None:
+            flow_log_bucket = create_log_bucket(
+                "flow-logs", flow_log_settings.prefix, flow_log_settings.retention_days).bucket
+            pulumi.export("flow-log-bucket", flow_log_bucket)
+        flow_logs = flow_log_destination(flow_log_bucket, flow_log_settings)
+
+    hub_vpc = HubVpc(
+        "hub",
+        HubVpcArgs(
+            supernet_cidr_block=hub_and_spoke_supernet,
+            vpc_cidr_block=hub_cidr,
+            tgw_id=tgw.id,
+            hub_tgw_route_table_id=hub_tgw_route_table.id,
+            spoke_tgw_route_table_id=spoke_tgw_route_table.id,
+            firewall_policy_arn=firewall_policy_arn,
+            availability_zone_names=availability_zone_names,
+            routing_mode=config.get("routing-mode") or "direct",
+            nat_gateway_strategy=config.get("nat-gateway-strategy") or "single",
+            endpoint_services=endpoint_settings.services if endpoint_settings.centralized else None,
+            firewall_logs=load_firewall_log_settings(config),
+            flow_logs=flow_logs,
+        )
     )
-)
 
-pulumi.export("nat-gateway-eip", hub_vpc.eip.public_ip)
+    pulumi.export("nat-gateway-eip", hub_vpc.eip.public_ip)
+    pulumi.export("nat-gateway-eips", [eip.public_ip for eip in hub_vpc.eips])
+    if hub_vpc.firewall_log_bucket is not None:
+        pulumi.export("firewall-log-bucket", hub_vpc.firewall_log_bucket)
 
-spoke1_vpc = SpokeVpc(
-    "spoke1",
-    SpokeVpcArgs(
-        vpc_cidr_block="10.0.0.0/16",
+    hub = HubReference(
         tgw_id=tgw.id,
-        tgw_route_table_id=spoke_tgw_route_table.id,
-    ),
-)
-
-aws.ec2transitgateway.RouteTablePropagation(
-    "hub-to-spoke1",
-    aws.ec2transitgateway.RouteTablePropagationArgs(
-        transit_gateway_attachment_id=spoke1_vpc.tgw_attachment.id,
-        transit_gateway_route_table_id=hub_tgw_route_table.id,
+        spoke_tgw_route_table_id=spoke_tgw_route_table.id,
+        hub_tgw_route_table_id=hub_tgw_route_table.id,
+        endpoint_zone_ids=hub_vpc.endpoint_zone_ids,
     )
-)
 
-spoke1_workload = SpokeWorkload(
-    "spoke1",
-    SpokeWorkloadArgs(
-        spoke_instance_subnet_id=spoke1_vpc.workload_subnet_ids[0],
-        spoke_vpc_id=spoke1_vpc.vpc.vpc_id,
-    )
+spokes = create_spoke_fleet(
+    spoke_specs,
+    SpokeFleetArgs(
+        tgw_id=hub.tgw_id,
+        spoke_tgw_route_table_id=hub.spoke_tgw_route_table_id,
+        hub_tgw_route_table_id=hub.hub_tgw_route_table_id,
+        availability_zone_names=availability_zone_names,
+        probe=load_probe_settings(config),
+        supernet_cidr_block=hub_and_spoke_supernet,
+        endpoint_services=endpoint_settings.services,
+        endpoint_zone_ids=hub.endpoint_zone_ids,
+        flow_logs=flow_logs,
+    ),
 )
+
+pulumi.export("hub-cidr", hub_cidr)
+pulumi.export("spoke-cidrs", {
+    spec.name: spec.vpc_cidr_block for spec in spoke_specs
+})
+# For flow_report.py, which tells which VPC logged a flow by its ID:
+pulumi.export("vpc-ids", {
+    **({"hub": hub_vpc.vpc.vpc_id} if stack_role != "spokes" else {}),
+    **{name: spoke.vpc.vpc.vpc_id for name, spoke in spokes.items()},
+})
+
+if stack_role != "spokes":
+    # What spoke stacks read through their StackReference (along with
+    # hub-cidr):
+    pulumi.export("tgw-id", hub.tgw_id)
+    pulumi.export("spoke-tgw-route-table-id", hub.spoke_tgw_route_table_id)
+    pulumi.export("hub-tgw-route-table-id", hub.hub_tgw_route_table_id)
+    pulumi.export("hub-and-spoke-supernet", hub_and_spoke_supernet)
+    pulumi.export("availability-zones", availability_zone_names)
+    if hub.endpoint_zone_ids is not None:
+        pulumi.export("endpoint-zone-ids", hub.endpoint_zone_ids)
@@ -0,0 +1,195 @@
+'''Loads a large egress allowlist (domains and CIDRs) and packs it into
+stateful rule groups for the firewall policy.
+
+The file has one entry per line. Blank lines and `#` comments are ignored:
+
+    # Domains; a leading dot (or `*.`) also allows subdomains.
+    .amazonaws.com
+    *.github.com
+    pypi.org
+    # CIDRs:
+    203.0.113.0/24
+
+The file is read one line at a time, and only the normalized, deduplicated
+entries are kept. The comments, duplicates and spelling variants of a large
+list never need to fit in memory at once. Domains are lowercased,
+IDNA-encoded and stripped of a trailing dot. CIDRs are normalized to their
+network and collapsed where they overlap or are adjacent.
+
+Each domain becomes a `TlsSniRule`, and each CIDR a rule passing any traffic
+to it. We don't use domain list rule groups: an allowlist domain list also
+generates a rule that drops TLS and HTTP to every other domain. With more
+than one such group, each would drop what the others allow.
+
+Packing is stable. An entry's group is chosen by a hash of the entry
+(extendible hashing): a group covers a range of hashes and splits in two
+when it outgrows its capacity. Adding or removing an entry changes only the
+group whose range it's in, and group names come from their range, so the
+other groups (and their sids, which are derived from rule text) stay as they
+are. The price is that a group is typically between half full and full,
+rather than every group but the last being full.'''
+import hashlib
+import ipaddress
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Sequence, Set, Tuple
+
+from firewall_model import StatefulRule, StatefulRuleGroup, TlsSniRule
+
+# The most a stateful rule group can reserve:
+MAX_STATEFUL_CAPACITY = 30_000
+# What each allowlist group reserves by default. A firewall policy's stateful
+# groups can reserve 30,000 between them (see firewall_model.py), so this
+# leaves room for a few groups next to the policy's own.
+DEFAULT_GROUP_CAPACITY = 5_000
+# Hash bits an entry's group can be chosen by. Far more than needed, since
+# a group only splits when it holds more than its capacity.
+_HASH_BITS = 64
+
+_LABEL = re.compile(r"^[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?$")
+
+
+class AllowlistError(Exception):
+    pass
+
+
+@dataclass
+class Allowlist:
+    domains: Set[str] = field(default_factory=set)
+    cidrs: Set[str] = field(default_factory=set)
+
+    def add(self, entry: str) -> None:
+        '''Adds one line of an allowlist file.'''
+        entry = entry.split("#", 1)[0].strip()
+        if not entry:
+            return
+        if "/" in entry or _is_address(entry):
+            self.cidrs.add(normalize_cidr(entry))
+        else:
+            self.domains.add(normalize_domain(entry))
+
+    def collapse(self) -> "Allowlist":
+        '''Merges overlapping and adjacent CIDRs.'''
+        networks = ipaddress.collapse_addresses(ipaddress.ip_network(cidr) for cidr in self.cidrs)
+        self.cidrs = {str(network) for network in networks}
+        return self
+
+
+def normalize_domain(domain: str) -> str:
+    '''Returns `domain` as `TlsSniRule` expects it: lowercase ASCII, with a
+    leading dot if subdomains are allowed too.'''
+    wildcard = domain.startswith(("*.", "."))
+    name = domain[2:] if domain.startswith("*.") else domain.lstrip(".")
+    try:
+        name = name.rstrip(".").encode("idna").decode("ascii").lower()
+    except UnicodeError as error:
+        raise AllowlistError(f"'{domain}' is not a valid domain: {error}.")
+    labels = name.split(".")
+    if len(name) > 253 or len(labels) < 2 or not all(_LABEL.match(label) for label in labels):
+        raise AllowlistError(f"'{domain}' is not a valid domain.")
+    return f".{name}" if wildcard else name
+
+
+def normalize_cidr(cidr: str) -> str:
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+    except ValueError as error:
+        raise AllowlistError(f"'{cidr}' is not a valid CIDR block: {error}.")
+    if network.version != 4:
+        raise AllowlistError(f"'{cidr}' is not an IPv4 CIDR block.")
+    return str(network)
+
+
+def read_allowlist(lines: Iterable[str], source: str = "allowlist") -> Allowlist:
+    allowlist = Allowlist()
+    for number, line in enumerate(lines, 1):
+        try:
+            allowlist.add(line)
+        except AllowlistError as error:
+            raise AllowlistError(f"{source}, line {number}: {error}")
+    return allowlist.collapse()
+
+
+def load_allowlist(path: str) -> Allowlist:
+    with open(path, encoding="utf-8") as f:
+        return read_allowlist(f, source=path)
+
+
+def pack_entries(entries: Iterable[str], capacity: int) -> List[Tuple[str, List[str]]]:
+    '''Splits `entries` into groups of at most `capacity`, returning each
+    group's hash prefix (a string of bits, "" for everything) and its
+    entries in sorted order.'''
+    if capacity < 1:
+        raise AllowlistError(f"Capacity must be at least 1. Got {capacity}.")
+    hashed = sorted((_hash(entry), entry) for entry in entries)
+    groups: List[Tuple[str, List[str]]] = []
+    _split(hashed, 0, len(hashed), "", capacity, groups)
+    return groups
+
+
+def allowlist_rule_groups(
+    allowlist: Allowlist,
+    name: str = "allowlist",
+    capacity: int = DEFAULT_GROUP_CAPACITY,
+) -> List[StatefulRuleGroup]:
+    '''Returns the stateful rule groups for `allowlist`: `<name>-domains-*`
+    then `<name>-cidrs-*`, each reserving `capacity`.'''
+    if capacity > MAX_STATEFUL_CAPACITY:
+        raise AllowlistError(
+            f"Stateful rule groups can reserve at most {MAX_STATEFUL_CAPACITY}. Got {capacity}.")
+
+    return [
+        *_rule_groups(f"{name}-domains", allowlist.domains, capacity,
+                      lambda domain: TlsSniRule(domain=domain)),
+        *_rule_groups(f"{name}-cidrs", allowlist.cidrs, capacity,
+                      lambda cidr: StatefulRule(action="pass", protocol="ip", destination=cidr,
+                                                msg=f"Allowing traffic to {cidr}")),
+    ]
+
+
+def _rule_groups(name: str, entries: Iterable[str], capacity: int,
+                 rule: Callable[[str], StatefulRule]) -> List[StatefulRuleGroup]:
+    return [
+        StatefulRuleGroup(
+            name=f"{name}-{prefix}" if prefix else name,
+            rules=[rule(entry) for entry in group],
+            capacity=capacity,
+        )
+        for prefix, group in pack_entries(entries, capacity)
+    ]
+
+
+def _split(hashed: Sequence[Tuple[int, str]], start: int, end: int, prefix: str,
+           capacity: int, groups: List[Tuple[str, List[str]]]) -> None:
+    if end - start <= capacity or len(prefix) == _HASH_BITS:
+        if end > start:
+            groups.append((prefix, [entry for _, entry in hashed[start:end]]))
+        return
+    # The first hash whose next bit is 1:
+    depth = len(prefix)
+    boundary = int(prefix + "1", 2) << (_HASH_BITS - depth - 1)
+    middle = _bisect(hashed, start, end, boundary)
+    _split(hashed, start, middle, prefix + "0", capacity, groups)
+    _split(hashed, middle, end, prefix + "1", capacity, groups)
+
+
+def _bisect(hashed: Sequence[Tuple[int, str]], start: int, end: int, value: int) -> int:
+    while start < end:
+        middle = (start + end) // 2
+        if hashed[middle][0] < value:
+            start = middle + 1
+        else:
+            end = middle
+    return start
+
+
+def _hash(entry: str) -> int:
+    return int.from_bytes(hashlib.sha256(entry.encode()).digest()[:_HASH_BITS // 8], "big")
+
+
+def _is_address(entry: str) -> bool:
+    try:
+        ipaddress.ip_address(entry)
+        return True
+    except ValueError:
+        return False
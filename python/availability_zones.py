@@ -0,0 +1,36 @@
+from typing import List, Optional, Sequence
+
+import pulumi
+import pulumi_aws as aws
+
+import invoke_cache
+
+DEFAULT_AVAILABILITY_ZONE_COUNT = 3
+
+
+def get_availability_zone_names(count: int = DEFAULT_AVAILABILITY_ZONE_COUNT) -> List[str]:
+    '''Returns the names of the first `count` available AZs in the region, in
+    the order AWS lists them (the same AZs awsx picks by default).
+
+    AZ names don't follow a fixed pattern in every region, so we look them up
+    (once, through the invoke cache) rather than appending letters to the
+    region name.'''
+    zones = invoke_cache.invoke(aws.get_availability_zones, state="available")
+    if count > len(zones.names):
+        raise Exception(
+            f"Asked for {count} availability zones but only {len(zones.names)} are available: {', '.join(zones.names)}.")
+    return list(zones.names[:count])
+
+
+def load_availability_zone_names(config: pulumi.Config) -> List[str]:
+    '''Reads the AZs to deploy into from stack config: either an explicit
+    `availability-zones` list, or the first `availability-zone-count`
+    (default 3) available AZs.'''
+    names: Optional[Sequence[str]] = config.get_object("availability-zones")
+    if names:
+        if len(set(names)) != len(names):
+            raise Exception(
+                f"availability-zones lists the same AZ more than once: {', '.join(names)}.")
+        return list(names)
+    return get_availability_zone_names(
+        config.get_int("availability-zone-count") or DEFAULT_AVAILABILITY_ZONE_COUNT)
@@ -0,0 +1,81 @@
+'''Measures how fast eve_analyzer.py summarizes firewall logs, on generated
+gzipped EVE files shaped like Network Firewall's alert and flow logs.
+
+    python benchmarks/eve_throughput.py --files 8 --events 200000 --workers 1 4 8
+
+Reports uncompressed MB/s and events per second for each number of workers.'''
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import eve_analyzer  # noqa: E402
+
+SPOKES = 100
+
+
+def spoke_cidrs():
+    return {f"spoke{i + 1}": f"10.{129 + i // 16}.{(i % 16) * 16}.0/20" for i in range(SPOKES)}
+
+
+def write_fixture(path, events, seed):
+    '''One file of `events` lines, a tenth of them alerts.'''
+    rng = random.Random(seed)
+    with gzip.open(path, "wt", compresslevel=6) as f:
+        for _ in range(events):
+            spoke = rng.randrange(SPOKES)
+            source = f"10.{129 + spoke // 16}.{(spoke % 16) * 16 + rng.randrange(4)}.{rng.randrange(256)}"
+            event = {
+                "timestamp": "2024-01-01T00:00:00.000000+0000",
+                "flow_id": rng.getrandbits(48),
+                "src_ip": source,
+                "src_port": rng.randrange(1024, 65536),
+                "dest_ip": f"203.0.113.{rng.randrange(256)}",
+                "dest_port": 443,
+                "proto": "TCP",
+            }
+            if rng.random() < 0.1:
+                sid = rng.randrange(1, 200)
+                event.update(event_type="alert", alert={
+                    "action": "blocked" if sid % 3 == 0 else "allowed",
+                    "signature_id": sid, "rev": 1, "signature": f"rule {sid}",
+                }, flow={"bytes_toserver": rng.randrange(10_000), "bytes_toclient": rng.randrange(10_000)})
+            else:
+                event.update(event_type="netflow", netflow={
+                    "pkts": rng.randrange(1, 100), "bytes": int(rng.paretovariate(1.2) * 1000),
+                })
+            f.write(json.dumps({"firewall_name": "hub-firewall", "availability_zone": "us-east-1a",
+                                "event_timestamp": "1704067200", "event": event}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--events", type=int, default=200_000, help="Events per file.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"{i}.log.gz") for i in range(args.files)]
+        for seed, path in enumerate(paths):
+            write_fixture(path, args.events, seed)
+        compressed = sum(os.path.getsize(path) for path in paths)
+        print(f"{args.files} files, {args.files * args.events} events, {compressed / 1e6:.1f} MB compressed")
+
+        print(f"{'workers':>8} {'seconds':>9} {'MB/s':>8} {'events/s':>10}")
+        for workers in args.workers:
+            started = time.perf_counter()
+            summary = eve_analyzer.analyze(paths, spoke_cidrs(), workers)
+            seconds = time.perf_counter() - started
+            print(f"{workers:>8} {seconds:>9.2f} {summary.bytes_read / 1e6 / seconds:>8.1f} "
+                  f"{summary.events / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+'''Measures how program evaluation time and memory grow with the number of
+spokes, by running `__main__.py` against the mock runtime with a generated
+`spokes` config and fitting a line through the results.
+
+    python benchmarks/fleet_scaling.py --sizes 1 50 100 250 500
+
+See suite.py for the measurements themselves.'''
+import argparse
+
+import suite
+
+
+def linear_fit(xs, ys):
+    '''Least-squares fit of ys = slope * xs + intercept, and its R^2.'''
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    slope = sxy / sxx
+    intercept = mean_y - slope * mean_x
+    ss_res = sum((y - (slope * x + intercept)) ** 2 for x, y in zip(xs, ys))
+    ss_tot = sum((y - mean_y) ** 2 for y in ys)
+    return slope, intercept, 1 - ss_res / ss_tot if ss_tot else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1, 50, 100, 250, 500])
+    parser.add_argument("--workloads", action="store_true",
+                        help="Give every spoke a SpokeWorkload.")
+    args = parser.parse_args()
+
+    scenario = "program_with_workloads" if args.workloads else "program"
+    results = []
+    suite.print_header()
+    for size in args.sizes:
+        results.append(suite.measure_in_subprocess(scenario, size))
+        suite.print_row(results[-1])
+
+    if len(results) > 2:
+        xs = [r["spokes"] for r in results]
+        for label, key in (("time", "seconds"), ("memory", "peak_mib")):
+            slope, intercept, r2 = linear_fit(xs, [r[key] for r in results])
+            print(f"{label}: {slope:.4f} {key} per spoke + {intercept:.2f}, R^2 = {r2:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+'''Cold start benchmark: how long a fresh interpreter takes to import the
+program, and which `pulumi_aws` submodules it loads.
+
+    python benchmarks/import_time.py --output imports.json
+    python benchmarks/import_time.py --output new.json --compare imports.json
+
+`pulumi_aws` registers each of its submodules (`ec2`, `iam`, `s3`, ...) as a
+lazy module that only runs when first used, and each of them takes tens of
+milliseconds to load. Anything that touches one at import time, such as an
+unquoted annotation like `-> aws.ec2.Instance`, loads it for every preview
+and every Automation API worker, whether or not the stack creates one.
+
+Each scenario runs in a fresh interpreter, `--repeat` times, and reports
+the fastest run:
+
+- `import`: importing every program module, with no resources created. It
+  should load no submodule at all.
+- `program`, `program_with_workloads`, `spokes`: importing and evaluating
+  the whole of `__main__.py` against mocks, as the hub stack with and
+  without workloads and as a spokes stack. Each should load only the
+  submodules for the resources it creates.
+
+With `--compare`, the run fails if a scenario got slower by more than
+`--tolerance` against an earlier results file or loaded a submodule it
+didn't before.'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import types
+from typing import List
+
+PROGRAM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Every module __main__.py can import, directly or not:
+PROGRAM_MODULES = (
+    "allowlist",
+    "availability_zones",
+    "cidr_allocator",
+    "firewall_logging",
+    "firewall_model",
+    "firewall_rules",
+    "fleet",
+    "flow_logs",
+    "hub",
+    "hub_reference",
+    "invoke_cache",
+    "log_bucket",
+    "probe",
+    "profiling",
+    "spoke",
+    "spoke_workload",
+    "vpc_endpoints",
+    "vpc_subnets",
+)
+
+SCENARIOS = ("import", "program", "program_with_workloads", "spokes")
+# Ignore differences smaller than timer and disk cache noise:
+NOISE_FLOOR_SECONDS = 0.05
+
+SPOKES = [{"name": "spoke1"}, {"name": "spoke2", "workload": True}]
+HUB_OUTPUTS = {
+    "tgw-id": "tgw-id",
+    "spoke-tgw-route-table-id": "spoke-tgw-route-table-id",
+    "hub-tgw-route-table-id": "hub-tgw-route-table-id",
+    "hub-and-spoke-supernet": "10.0.0.0/8",
+    "hub-cidr": "10.157.75.0/24",
+    "availability-zones": ["us-east-1a", "us-east-1b", "us-east-1c"],
+}
+
+
+def loaded_aws_modules() -> List[str]:
+    '''The `pulumi_aws` submodules that have run. Ones that haven't are still
+    lazy stubs, a subclass of ModuleType.'''
+    return sorted(
+        name.split(".")[1] for name, module in list(sys.modules.items())
+        if name.startswith("pulumi_aws.") and name.count(".") == 1
+        and type(module) is types.ModuleType and hasattr(module, "__path__")
+    )
+
+
+def measure(scenario: str) -> dict:
+    '''Runs one scenario in this (fresh) interpreter and returns its
+    metrics.'''
+    sys.path.insert(0, PROGRAM_DIR)
+    start = time.perf_counter()
+    if scenario == "import":
+        for module in PROGRAM_MODULES:
+            __import__(module)
+    else:
+        import mock_runtime
+        main = os.path.join(PROGRAM_DIR, "__main__.py")
+        if scenario == "spokes":
+            mock_runtime.run_main(
+                main,
+                mocks=mock_runtime.ProgramMocks(stack_outputs={"org/project/hub": HUB_OUTPUTS}),
+                config={"stack-role": "spokes", "hub-stack": "org/project/hub", "spokes": json.dumps(SPOKES)},
+            )
+        else:
+            mock_runtime.run_main(main, config={
+                "spokes": json.dumps([{**spoke, "workload": scenario == "program_with_workloads"}
+                                      for spoke in SPOKES]),
+            })
+    elapsed = time.perf_counter() - start
+
+    return {
+        "scenario": scenario,
+        "seconds": round(elapsed, 4),
+        "aws_modules": loaded_aws_modules(),
+    }
+
+
+def measure_in_subprocess(scenario: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", scenario],
+            check=True, capture_output=True, text=True,
+        )
+        runs.append(json.loads(child.stdout))
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    '''Returns a description of every scenario that got slower than
+    `baseline` by more than `tolerance` (a fraction), or that loads
+    submodules it didn't.'''
+    previous = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        old, new = before["seconds"], result["seconds"]
+        if new > old * (1 + tolerance) and new - old > NOISE_FLOOR_SECONDS:
+            regressions.append(f"{result['scenario']} seconds: {old} -> {new}")
+        added = sorted(set(result["aws_modules"]) - set(before["aws_modules"]))
+        if added:
+            regressions.append(f"{result['scenario']} loads pulumi_aws.{{{', '.join(added)}}}")
+    return regressions
+
+
+def print_row(r: dict) -> None:
+    print(f"{r['scenario']:<24} {r['seconds']:>9.3f}  {', '.join(r['aws_modules'])}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per scenario; the fastest is reported (default: 5).")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Fail if results regressed against this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown as a fraction (default: 0.2).")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    results = []
+    print(f"{'scenario':<24} {'seconds':>9}  pulumi_aws modules loaded")
+    for scenario in args.scenarios:
+        results.append(measure_in_subprocess(scenario, args.repeat))
+        print_row(results[-1])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+'''Offline benchmarks for program evaluation, run against the mock runtime so
+they need neither AWS nor the Pulumi engine.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --output new.json --compare results.json
+
+Each scenario builds part or all of the program (`create_firewall_policy`,
+`HubVpc`, `SpokeVpc`, `SpokeWorkload` or the whole `__main__.py`) for a
+number of spokes and reports wall time, peak memory, the number of
+resources registered and the number of invokes. Every measurement runs in a
+fresh interpreter so memory figures don't include earlier runs.
+
+With `--compare`, the run fails if any metric regressed by more than
+`--tolerance` against an earlier results file, so a slow plan shows up in
+review rather than in production.'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+PROGRAM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+METRICS = ("seconds", "peak_mib", "resources", "invokes")
+# Ignore differences too small to matter, e.g. timer noise on a tiny scenario:
+NOISE_FLOOR = {"seconds": 0.05, "peak_mib": 5, "resources": 0, "invokes": 0}
+
+
+def spoke_config(count: int, workloads: bool = False) -> List[dict]:
+    '''Spokes for a generated topology. CIDRs are left to the allocator.'''
+    return [{"name": f"spoke{i+1}", "workload": workloads} for i in range(count)]
+
+
+def build_firewall_policy(size: int) -> None:
+    from firewall_rules import create_firewall_policy
+    for _ in range(size):
+        create_firewall_policy("10.0.0.0/8")
+
+
+def build_hub(size: int) -> None:
+    from hub import HubVpc, HubVpcArgs
+    for i in range(size):
+        HubVpc(f"hub{i+1}", HubVpcArgs(
+            supernet_cidr_block="10.0.0.0/8",
+            vpc_cidr_block="10.129.0.0/24",
+            tgw_id="tgw-id",
+            spoke_tgw_route_table_id="spoke-tgw-route-table-id",
+            hub_tgw_route_table_id="hub-tgw-route-table-id",
+            firewall_policy_arn="firewall-policy-arn",
+        ))
+
+
+def build_spokes(size: int) -> None:
+    from spoke import SpokeVpc, SpokeVpcArgs
+    for i in range(size):
+        SpokeVpc(f"spoke{i+1}", SpokeVpcArgs(
+            vpc_cidr_block=f"10.{i // 256}.{i % 256}.0/24",
+            tgw_id="tgw-id",
+            tgw_route_table_id="spoke-tgw-route-table-id",
+        ))
+
+
+def build_workloads(size: int) -> None:
+    from spoke_workload import SpokeWorkload, SpokeWorkloadArgs
+    for i in range(size):
+        SpokeWorkload(f"spoke{i+1}", SpokeWorkloadArgs(
+            spoke_vpc_id=f"spoke{i+1}-vpc-id",
+            spoke_instance_subnet_id=f"spoke{i+1}-subnet-id",
+        ))
+
+
+SCENARIOS: Dict[str, Callable[[int], None]] = {
+    "firewall_policy": build_firewall_policy,
+    "hub": build_hub,
+    "spokes": build_spokes,
+    "workloads": build_workloads,
+    "program": None,  # The whole of __main__.py; see measure().
+    "program_with_workloads": None,
+}
+
+DEFAULT_PLAN = {
+    "firewall_policy": [1],
+    "hub": [1],
+    "spokes": DEFAULT_SIZES,
+    "workloads": [1, 10, 100],
+    "program": DEFAULT_SIZES,
+    "program_with_workloads": [1, 10, 100],
+}
+
+
+def measure(scenario: str, size: int) -> dict:
+    '''Runs one scenario in this interpreter and returns its metrics.'''
+    sys.path.insert(0, PROGRAM_DIR)
+    # Import everything up front so that only evaluation is timed:
+    import fleet, firewall_rules, hub, spoke, spoke_workload  # noqa: F401
+    import invoke_cache
+    import mock_runtime
+
+    baseline = _peak_mib()
+    start = time.perf_counter()
+    if scenario.startswith("program"):
+        mocks = mock_runtime.run_main(
+            os.path.join(PROGRAM_DIR, "__main__.py"),
+            config={
+                "spokes": json.dumps(spoke_config(size, scenario == "program_with_workloads")),
+                "spoke-prefix-length": "20",
+            },
+        )
+    else:
+        mocks = mock_runtime.run(lambda: SCENARIOS[scenario](size))
+    elapsed = time.perf_counter() - start
+    invoke_cache.reset()
+
+    return {
+        "scenario": scenario,
+        "spokes": size,
+        "seconds": round(elapsed, 4),
+        "peak_mib": round(_peak_mib(), 1),
+        "baseline_mib": round(baseline, 1),
+        "resources": len(mocks.resources),
+        "invokes": sum(mocks.invokes.values()),
+    }
+
+
+def measure_in_subprocess(scenario: str, size: int) -> dict:
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__),
+         "--child", scenario, str(size)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(child.stdout)
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    '''Returns a description of every metric that got worse than `baseline`
+    by more than `tolerance` (a fraction).'''
+    previous = {(r["scenario"], r["spokes"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["scenario"], result["spokes"]))
+        if before is None:
+            continue
+        for metric in METRICS:
+            old, new = before[metric], result[metric]
+            if new > old * (1 + tolerance) and new - old > NOISE_FLOOR[metric]:
+                regressions.append(
+                    f"{result['scenario']}[{result['spokes']}] {metric}: {old} -> {new}")
+    return regressions
+
+
+def _peak_mib() -> float:
+    # ru_maxrss is in KiB on Linux:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def print_header() -> None:
+    print(f"{'scenario':<24} {'spokes':>7} {'seconds':>9} {'peak MiB':>9} {'resources':>10} {'invokes':>8}")
+
+
+def print_row(r: dict) -> None:
+    print(f"{r['scenario']:<24} {r['spokes']:>7} {r['seconds']:>9.2f} {r['peak_mib']:>9.1f} "
+          f"{r['resources']:>10} {r['invokes']:>8}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS),
+                        default=list(DEFAULT_PLAN))
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        help="Spoke counts to run every scenario with (default: a per-scenario plan).")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Fail if results regressed against this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed regression as a fraction (default: 0.2).")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child[0], int(args.child[1]))))
+        return
+
+    results = []
+    print_header()
+    for scenario in args.scenarios:
+        for size in args.sizes or DEFAULT_PLAN[scenario]:
+            results.append(measure_in_subprocess(scenario, size))
+            print_row(results[-1])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import hashlib
+import ipaddress
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class CidrAllocationError(Exception):
+    pass
+
+
+# Larger than any prefix length: no free block at all.
+_NONE_FREE = 129
+
+
+class CidrAllocator:
+    '''Carves CIDR blocks out of a larger block (e.g. the hub-and-spoke
+    supernet) and rejects overlapping assignments.
+
+    The range is kept as a buddy tree: each block is either free, assigned,
+    or split into its two halves, and each split block records the largest
+    free block below it. Only split and assigned blocks are stored. Finding
+    the first free block at or after an address, reserving a block and
+    finding what a block overlaps each walk one path down from the range,
+    so they take O(log n) steps in the size of the range (at most 32 for
+    IPv4) however many blocks are assigned.'''
+
+    def __init__(self, cidr: str) -> None:
+        self.network = ipaddress.ip_network(cidr)
+        self._root = (self.network.prefixlen, int(self.network.network_address))
+        # Assigned blocks, keyed by (prefix length, start address):
+        self._owners: Dict[Tuple[int, int], str] = {}
+        # For each split block, the prefix length of the largest free block
+        # inside it (_NONE_FREE if there's none):
+        self._largest: Dict[Tuple[int, int], int] = {}
+        self._by_owner: Dict[str, ipaddress.IPv4Network] = {}
+        # The number of addresses in a block, by prefix length:
+        self._sizes = [2 ** (self.network.max_prefixlen - p) for p in range(self.network.max_prefixlen + 2)]
+
+    @property
+    def allocations(self) -> Dict[str, ipaddress.IPv4Network]:
+        return dict(self._by_owner)
+
+    def reserve(self, owner: str, cidr: str) -> ipaddress.IPv4Network:
+        '''Assigns a specific block to `owner`, e.g. a CIDR pinned in config.'''
+        network = ipaddress.ip_network(cidr)
+        if not network.subnet_of(self.network):
+            raise CidrAllocationError(
+                f"{cidr} ({owner}) is not within {self.network}.")
+
+        overlapping = self._overlapping((network.prefixlen, int(network.network_address)))
+        if overlapping is not None:
+            raise CidrAllocationError(
+                f"{cidr} ({owner}) overlaps {self._by_owner[overlapping]} ({overlapping}).")
+
+        self._take(owner, network)
+        return network
+
+    def allocate(self, owner: str, prefix_length: int, hint: Optional[int] = None) -> ipaddress.IPv4Network:
+        '''Assigns the first free block of `prefix_length` at or after the
+        address `hint` (wrapping around to the start of the range).'''
+        if prefix_length < self.network.prefixlen or prefix_length > self.network.max_prefixlen:
+            raise CidrAllocationError(
+                f"Cannot allocate a /{prefix_length} ({owner}) from {self.network}.")
+
+        size = self._sizes[prefix_length]
+        first = int(self.network.network_address)
+        hint = first if hint is None else _align_up(max(first, hint), size)
+
+        start = self._first_free(self._root, prefix_length, hint)
+        if start is None and hint > first:
+            start = self._first_free(self._root, prefix_length, first)
+        if start is None:
+            raise CidrAllocationError(
+                f"No free /{prefix_length} left in {self.network} for {owner}.")
+
+        network = type(self.network)((start, prefix_length))
+        self._take(owner, network)
+        return network
+
+    def allocate_stable(self, owner: str, prefix_length: int) -> ipaddress.IPv4Network:
+        '''Allocates a block whose preferred position is a hash of `owner`'s
+        name. It only lands elsewhere if that block is taken when it's
+        allocated; reserve earlier assignments first (see
+        fleet.allocate_spoke_cidrs) to keep blocks from moving between
+        runs.'''
+        slots = 2 ** (prefix_length - self.network.prefixlen)
+        digest = int(hashlib.sha256(owner.encode()).hexdigest(), 16)
+        size = self._sizes[prefix_length]
+        hint = int(self.network.network_address) + (digest % slots) * size
+        return self.allocate(owner, prefix_length, hint)
+
+    def release(self, owner: str) -> None:
+        network = self._by_owner.pop(owner)
+        node = (network.prefixlen, int(network.network_address))
+        path = self._path(node)
+        del self._owners[node]
+
+        # Merge halves that are both free again on the way back up:
+        for parent in reversed(path):
+            left, right = self._children(parent)
+            if self._is_free(left) and self._is_free(right):
+                del self._largest[parent]
+            else:
+                self._largest[parent] = min(self._largest_free(left), self._largest_free(right))
+
+    def owner_of(self, cidr: str) -> Optional[str]:
+        '''Returns the owner of an assignment that overlaps `cidr`, if any.'''
+        network = ipaddress.ip_network(cidr)
+        if not network.overlaps(self.network):
+            return None
+        if network.prefixlen <= self.network.prefixlen:
+            return self._overlapping(self._root)
+        return self._overlapping((network.prefixlen, int(network.network_address)))
+
+    def _overlapping(self, node: Tuple[int, int]) -> Optional[str]:
+        '''The owner of an assignment that overlaps the block `node`: one that
+        contains it, or else one inside it.'''
+        prefix_length, start = node
+        current = self._root
+        while current[0] < prefix_length:
+            if current in self._owners:
+                return self._owners[current]
+            if current not in self._largest:
+                return None
+            left, right = self._children(current)
+            current = left if start < right[1] else right
+        # Every split block has an assignment somewhere inside it:
+        while current in self._largest:
+            left, right = self._children(current)
+            current = left if not self._is_free(left) else right
+        return self._owners.get(current)
+
+    def _first_free(self, node: Tuple[int, int], prefix_length: int, hint: int) -> Optional[int]:
+        '''The start of the first free /`prefix_length` in `node` at or after
+        `hint` (which is aligned to that size).'''
+        node_prefix_length, start = node
+        if start + self._sizes[node_prefix_length] <= hint or self._largest_free(node) > prefix_length:
+            return None
+        if node not in self._largest:
+            # Free throughout:
+            return max(start, hint)
+        left, right = self._children(node)
+        found = self._first_free(left, prefix_length, hint)
+        if found is None:
+            found = self._first_free(right, prefix_length, hint)
+        return found
+
+    def _take(self, owner: str, network) -> None:
+        if owner in self._by_owner:
+            raise CidrAllocationError(
+                f"{owner} already has {self._by_owner[owner]}.")
+
+        node = (network.prefixlen, int(network.network_address))
+        path = self._path(node)
+        self._owners[node] = owner
+        # Free blocks on the way down are split by this one. Blocks above
+        # one whose largest free block didn't change are unchanged too:
+        for parent in reversed(path):
+            left, right = self._children(parent)
+            largest = min(self._largest_free(left), self._largest_free(right))
+            if self._largest.get(parent) == largest:
+                break
+            self._largest[parent] = largest
+        self._by_owner[owner] = network
+
+    def _path(self, node: Tuple[int, int]) -> List[Tuple[int, int]]:
+        '''The blocks above `node`, from the whole range down.'''
+        prefix_length, start = node
+        path, current = [], self._root
+        while current[0] < prefix_length:
+            path.append(current)
+            left, right = self._children(current)
+            current = left if start < right[1] else right
+        return path
+
+    def _children(self, node: Tuple[int, int]) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        prefix_length, start = node
+        return (prefix_length + 1, start), (prefix_length + 1, start + self._sizes[prefix_length + 1])
+
+    def _is_free(self, node: Tuple[int, int]) -> bool:
+        return node not in self._owners and node not in self._largest
+
+    def _largest_free(self, node: Tuple[int, int]) -> int:
+        if node in self._owners:
+            return _NONE_FREE
+        return self._largest.get(node, node[0])
+
+
+def inspection_cidr_blocks(
+    hub_cidr: str,
+    availability_zone_count: int,
+    awsx_subnet_masks: Sequence[int] = (28, 28),
+    inspection_mask: int = 28,
+) -> List[str]:
+    '''Returns one inspection subnet CIDR per AZ inside the hub VPC that
+    doesn't collide with the subnets awsx creates.
+
+    For a 10.129.0.0/24 hub this reproduces the 10.129.0.32/28,
+    10.129.0.96/28 and 10.129.0.160/28 blocks we used to hardcode.'''
+    return hub_subnet_cidr_blocks(
+        hub_cidr, availability_zone_count, ["inspection"], awsx_subnet_masks, inspection_mask)["inspection"]
+
+
+def hub_subnet_cidr_blocks(
+    hub_cidr: str,
+    availability_zone_count: int,
+    names: Sequence[str],
+    awsx_subnet_masks: Sequence[int] = (28, 28),
+    mask: int = 28,
+) -> Dict[str, List[str]]:
+    '''Returns one CIDR per AZ for each of the hub subnets `names` (which
+    we create ourselves rather than through awsx), keyed by name.
+
+    awsx splits the VPC CIDR into one block per AZ (rounded up to a power of
+    two) and packs each AZ's subnets, in spec order, from the start of its
+    block. We reserve those and take the next free blocks in each AZ, in the
+    order of `names`, so adding a name at the end leaves the others where
+    they are.'''
+    allocator = CidrAllocator(hub_cidr)
+    hub = allocator.network
+    new_prefix = hub.prefixlen + max(availability_zone_count - 1, 0).bit_length()
+    az_blocks = list(hub.subnets(new_prefix=new_prefix))[:availability_zone_count]
+
+    blocks: Dict[str, List[str]] = {name: [] for name in names}
+    for i, az_block in enumerate(az_blocks):
+        address = int(az_block.network_address)
+        for j, awsx_mask in enumerate(awsx_subnet_masks):
+            size = 2 ** (hub.max_prefixlen - awsx_mask)
+            address = _align_up(address, size)
+            allocator.reserve(f"awsx-{i+1}-{j+1}", str(ipaddress.ip_network((address, awsx_mask))))
+            address += size
+
+        for name in names:
+            block = allocator.allocate(f"{name}-{i+1}", mask, int(az_block.network_address))
+            if not block.subnet_of(az_block):
+                raise CidrAllocationError(
+                    f"No room for a /{mask} {name} subnet in {az_block}.")
+            blocks[name].append(str(block))
+
+    return blocks
+
+
+def _align_up(address: int, size: int) -> int:
+    return -(-address // size) * size
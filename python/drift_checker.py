@@ -0,0 +1,333 @@
+'''Finds routes and attachments that were changed outside of Pulumi (e.g. by
+hand in the console), without the cost of a full `pulumi refresh`.
+
+    pulumi stack export > stack.json
+    python drift_checker.py --region us-east-1 stack.json
+
+The expected state comes from the stack's resources, as `HubVpc`,
+`SpokeVpc` and `__main__.py` registered them: VPC routes, route table
+associations, TGW attachments, and TGW routes, associations and
+propagations. Pass one export per stack for sharded stacks.
+
+The actual state is read with a few batched Describe calls scoped to what
+the stack manages, instead of one call per subnet or route table:
+
+- `DescribeRouteTables`, filtered by up to 200 route table IDs per call,
+  for the routes and associations (and once more by subnet ID, to find
+  subnets associated with a table the stack doesn't manage),
+- `DescribeTransitGatewayVpcAttachments`, filtered by Transit Gateway, and
+- per TGW route table (there are three), `SearchTransitGatewayRoutes` for
+  static routes and `GetTransitGatewayRouteTableAssociations` and
+  `...Propagations`.
+
+Every call is paginated, and only read-only calls are made. Should
+`SearchTransitGatewayRoutes` report more routes without a token to page
+through them with, the search is split by destination CIDR. Only the
+differences are reported. Routes AWS manages (`local` and propagated
+routes) aren't compared. Exits 1 if anything drifted.
+
+Needs boto3; `--endpoint-url` points it at e.g. a local moto server.'''
+import argparse
+import ipaddress
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+MISSING = "missing"
+CHANGED = "changed"
+UNEXPECTED = "unexpected"
+
+# The most values a Describe filter takes:
+FILTER_VALUES = 200
+
+# Route targets, as Pulumi records them and as DescribeRouteTables returns
+# them:
+_ROUTE_TARGETS = (
+    ("transitGatewayId", "TransitGatewayId"),
+    ("natGatewayId", "NatGatewayId"),
+    ("vpcEndpointId", "VpcEndpointId"),
+    ("gatewayId", "GatewayId"),
+    ("networkInterfaceId", "NetworkInterfaceId"),
+    ("vpcPeeringConnectionId", "VpcPeeringConnectionId"),
+)
+_BLACKHOLE = "blackhole"
+# The states of a static TGW route that's in place:
+_TGW_ROUTE_STATES = ["active", _BLACKHOLE]
+
+
+@dataclass(frozen=True)
+class Drift:
+    kind: str
+    key: str
+    change: str
+    expected: Optional[str] = None
+    actual: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.change == CHANGED:
+            return f"{self.kind} {self.key}: {self.expected} -> {self.actual}"
+        value = self.expected if self.change == MISSING else self.actual
+        return f"{self.kind} {self.key}: {self.change}" + (f" ({value})" if value else "")
+
+
+@dataclass
+class NetworkState:
+    '''Routes and attachments, keyed the same way whether they come from
+    Pulumi's state or from AWS.'''
+    # (route table, destination) -> target:
+    routes: Dict[Tuple[str, str], str] = field(default_factory=dict)
+    # Subnet -> route table:
+    associations: Dict[str, str] = field(default_factory=dict)
+    # Attachment -> "vpc: subnet,subnet,...":
+    attachments: Dict[str, str] = field(default_factory=dict)
+    # (TGW route table, destination) -> attachment, or "blackhole":
+    tgw_routes: Dict[Tuple[str, str], str] = field(default_factory=dict)
+    # Attachment -> TGW route table:
+    tgw_associations: Dict[str, str] = field(default_factory=dict)
+    tgw_propagations: Set[Tuple[str, str]] = field(default_factory=set)
+    # What the state covers, for scoping the Describe calls:
+    route_table_ids: Set[str] = field(default_factory=set)
+    transit_gateway_ids: Set[str] = field(default_factory=set)
+    tgw_route_table_ids: Set[str] = field(default_factory=set)
+
+    @staticmethod
+    def from_resources(resources: Iterable[Tuple[str, str, str, Mapping]]) -> "NetworkState":
+        '''The state `resources` describe: `(type, name, id, state)` tuples,
+        with each resource's inputs and outputs under camelCase keys, as
+        `route_analyzer.RouteGraph` takes them.'''
+        state = NetworkState()
+        for typ, _, resource_id, values in resources:
+            if typ == "aws:ec2/routeTable:RouteTable":
+                state.route_table_ids.add(resource_id)
+            elif typ == "aws:ec2/route:Route" and values.get("destinationCidrBlock"):
+                state.route_table_ids.add(values["routeTableId"])
+                state.routes[(values["routeTableId"], values["destinationCidrBlock"])] = _target(
+                    values, (key for key, _ in _ROUTE_TARGETS))
+            elif typ == "aws:ec2/routeTableAssociation:RouteTableAssociation" and values.get("subnetId"):
+                state.route_table_ids.add(values["routeTableId"])
+                state.associations[values["subnetId"]] = values["routeTableId"]
+            elif typ == "aws:ec2transitgateway/vpcAttachment:VpcAttachment":
+                state.transit_gateway_ids.add(values["transitGatewayId"])
+                state.attachments[resource_id] = _attachment(values["vpcId"], values.get("subnetIds") or [])
+            elif typ == "aws:ec2transitgateway/routeTable:RouteTable":
+                state.tgw_route_table_ids.add(resource_id)
+            elif typ == "aws:ec2transitgateway/route:Route":
+                state.tgw_route_table_ids.add(values["transitGatewayRouteTableId"])
+                state.tgw_routes[(values["transitGatewayRouteTableId"], values["destinationCidrBlock"])] = (
+                    _BLACKHOLE if values.get("blackhole") else values["transitGatewayAttachmentId"])
+            elif typ == "aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation":
+                state.tgw_route_table_ids.add(values["transitGatewayRouteTableId"])
+                state.tgw_associations[values["transitGatewayAttachmentId"]] = values["transitGatewayRouteTableId"]
+            elif typ == "aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation":
+                state.tgw_route_table_ids.add(values["transitGatewayRouteTableId"])
+                state.tgw_propagations.add((values["transitGatewayRouteTableId"], values["transitGatewayAttachmentId"]))
+        return state
+
+    @staticmethod
+    def from_stack_exports(deployments: Iterable[Mapping]) -> "NetworkState":
+        '''The state recorded by `pulumi stack export` of one or more
+        stacks.'''
+        return NetworkState.from_resources(
+            (resource["type"], resource["urn"].split("::")[-1], resource.get("id"),
+             {**resource.get("inputs", {}), **resource.get("outputs", {})})
+            for deployment in deployments
+            for resource in deployment["deployment"]["resources"]
+        )
+
+
+def fetch_state(ec2, expected: NetworkState) -> NetworkState:
+    '''Reads the actual state of what `expected` covers with the boto3 EC2
+    client `ec2`.'''
+    actual = NetworkState(
+        route_table_ids=set(expected.route_table_ids),
+        transit_gateway_ids=set(expected.transit_gateway_ids),
+        tgw_route_table_ids=set(expected.tgw_route_table_ids),
+    )
+
+    for table in _describe(ec2, "describe_route_tables", "RouteTables", "route-table-id", expected.route_table_ids):
+        _read_route_table(table, actual)
+    # Subnets the stack associates that aren't in one of its tables any
+    # more, to report which table they're in now:
+    moved = sorted(set(expected.associations) - set(actual.associations))
+    for table in _describe(ec2, "describe_route_tables", "RouteTables", "association.subnet-id", moved):
+        for association in table.get("Associations") or []:
+            if association.get("SubnetId") in expected.associations:
+                actual.associations[association["SubnetId"]] = table["RouteTableId"]
+
+    for attachment in _describe(ec2, "describe_transit_gateway_vpc_attachments", "TransitGatewayVpcAttachments",
+                                "transit-gateway-id", expected.transit_gateway_ids):
+        if attachment["State"] not in ("deleted", "deleting", "failed", "rejected"):
+            actual.attachments[attachment["TransitGatewayAttachmentId"]] = _attachment(
+                attachment["VpcId"], attachment.get("SubnetIds") or [])
+
+    for table_id in sorted(expected.tgw_route_table_ids):
+        for route in _search_static_routes(ec2, table_id):
+            key = (table_id, route["DestinationCidrBlock"])
+            attachments = route.get("TransitGatewayAttachments") or []
+            if route.get("State") == _BLACKHOLE:
+                target = _BLACKHOLE
+            elif attachments:
+                target = attachments[0]["TransitGatewayAttachmentId"]
+            else:
+                # An active route whose attachment isn't named (as in moto's
+                # responses): all we can tell is that it's there and active.
+                target = expected.tgw_routes.get(key, "unknown")
+                if target == _BLACKHOLE:
+                    target = "unknown"
+            actual.tgw_routes[key] = target
+        for association in _paginate(ec2, "get_transit_gateway_route_table_associations", "Associations",
+                                     TransitGatewayRouteTableId=table_id):
+            if association.get("State", "associated") == "associated":
+                actual.tgw_associations[association["TransitGatewayAttachmentId"]] = table_id
+        for propagation in _paginate(ec2, "get_transit_gateway_route_table_propagations",
+                                     "TransitGatewayRouteTablePropagations", TransitGatewayRouteTableId=table_id):
+            if propagation.get("State", "enabled") == "enabled":
+                actual.tgw_propagations.add((table_id, propagation["TransitGatewayAttachmentId"]))
+
+    return actual
+
+
+def diff(expected: NetworkState, actual: NetworkState) -> List[Drift]:
+    '''The differences between the two states, within what `expected`
+    covers.'''
+    drift = [
+        *_diff("route", expected.routes, actual.routes),
+        *_diff("route-table-association", expected.associations, actual.associations),
+        *_diff("tgw-attachment", expected.attachments, actual.attachments),
+        *_diff("tgw-route", expected.tgw_routes, actual.tgw_routes),
+        *_diff("tgw-association", expected.tgw_associations, actual.tgw_associations),
+    ]
+    for table_id, attachment_id in sorted(expected.tgw_propagations - actual.tgw_propagations):
+        drift.append(Drift("tgw-propagation", f"{table_id} {attachment_id}", MISSING))
+    for table_id, attachment_id in sorted(actual.tgw_propagations - expected.tgw_propagations):
+        drift.append(Drift("tgw-propagation", f"{table_id} {attachment_id}", UNEXPECTED))
+    return drift
+
+
+def check_drift(ec2, expected: NetworkState) -> List[Drift]:
+    return diff(expected, fetch_state(ec2, expected))
+
+
+def count_calls(ec2) -> Dict[str, int]:
+    '''Counts the API calls `ec2` makes from now on, by operation.'''
+    calls: Dict[str, int] = {}
+
+    def count(model, **kwargs):
+        calls[model.name] = calls.get(model.name, 0) + 1
+
+    ec2.meta.events.register("before-call.ec2", count)
+    return calls
+
+
+def _read_route_table(table: Mapping, state: NetworkState) -> None:
+    table_id = table["RouteTableId"]
+    for route in table.get("Routes") or []:
+        # `local` and propagated routes are AWS's, not the stack's:
+        if route.get("Origin") != "CreateRoute" or not route.get("DestinationCidrBlock"):
+            continue
+        target = _target(route, (key for _, key in _ROUTE_TARGETS))
+        if route.get("State") == _BLACKHOLE:
+            target = f"{target} ({_BLACKHOLE})"
+        state.routes[(table_id, route["DestinationCidrBlock"])] = target
+    for association in table.get("Associations") or []:
+        if association.get("SubnetId"):
+            state.associations[association["SubnetId"]] = table_id
+
+
+def _describe(ec2, operation: str, key: str, filter_name: str, values: Iterable[str]) -> Iterator[Mapping]:
+    '''Runs a Describe call filtered by `values`, as few times as the filter
+    allows, following pagination.'''
+    values = sorted(values)
+    for start in range(0, len(values), FILTER_VALUES):
+        yield from _paginate(ec2, operation, key,
+                             Filters=[{"Name": filter_name, "Values": values[start:start + FILTER_VALUES]}])
+
+
+def _search_static_routes(ec2, table_id: str, cidr: Optional[str] = None) -> List[Mapping]:
+    '''The static routes in `table_id`, or only those to `cidr` or a subnet
+    of it, following pagination. If the last page says there are more routes
+    but has no token to fetch them with, searches each half of the range
+    instead, and the range itself, which is in neither half.'''
+    filters = [{"Name": "type", "Values": ["static"]}, {"Name": "state", "Values": _TGW_ROUTE_STATES}]
+    if cidr is not None:
+        filters.append({"Name": "route-search.subnet-of-match", "Values": [cidr]})
+    routes: List[Mapping] = []
+    truncated = False
+    for page in ec2.get_paginator("search_transit_gateway_routes").paginate(
+            TransitGatewayRouteTableId=table_id, Filters=filters):
+        routes.extend(page.get("Routes") or [])
+        truncated = bool(page.get("AdditionalRoutesAvailable")) and not page.get("NextToken")
+    if not truncated:
+        return routes
+
+    network = ipaddress.ip_network(cidr or "0.0.0.0/0")
+    routes = list(_paginate(ec2, "search_transit_gateway_routes", "Routes", TransitGatewayRouteTableId=table_id,
+                            Filters=[*filters[:2], {"Name": "route-search.exact-match", "Values": [str(network)]}]))
+    for half in network.subnets():
+        routes.extend(_search_static_routes(ec2, table_id, str(half)))
+    return routes
+
+
+def _paginate(ec2, operation: str, key: str, **kwargs) -> Iterator[Mapping]:
+    for page in ec2.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(key) or []
+
+
+def _diff(kind: str, expected: Mapping, actual: Mapping) -> List[Drift]:
+    drift = []
+    for key in sorted(expected.keys() | actual.keys()):
+        label = " ".join(key) if isinstance(key, tuple) else key
+        if key not in actual:
+            drift.append(Drift(kind, label, MISSING, expected=expected[key]))
+        elif key not in expected:
+            drift.append(Drift(kind, label, UNEXPECTED, actual=actual[key]))
+        elif expected[key] != actual[key]:
+            drift.append(Drift(kind, label, CHANGED, expected=expected[key], actual=actual[key]))
+    return drift
+
+
+def _target(values: Mapping, keys: Iterable[str]) -> str:
+    for key in keys:
+        if values.get(key):
+            return values[key]
+    return "unknown"
+
+
+def _attachment(vpc_id: str, subnet_ids: Sequence[str]) -> str:
+    return f"{vpc_id}: {','.join(sorted(subnet_ids))}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("exports", nargs="+", help="Output of `pulumi stack export`, one per stack.")
+    parser.add_argument("--region")
+    parser.add_argument("--endpoint-url", help="e.g. a local moto server.")
+    parser.add_argument("--json", action="store_true", help="Print the drift as JSON.")
+    args = parser.parse_args()
+
+    import boto3
+
+    deployments = []
+    for path in args.exports:
+        with open(path) as f:
+            deployments.append(json.load(f))
+    expected = NetworkState.from_stack_exports(deployments)
+
+    ec2 = boto3.client("ec2", region_name=args.region, endpoint_url=args.endpoint_url)
+    calls = count_calls(ec2)
+    drift = check_drift(ec2, expected)
+
+    if args.json:
+        json.dump([vars(d) for d in drift], sys.stdout, indent=2)
+        print()
+    else:
+        for d in drift:
+            print(d)
+        print(f"{len(drift)} differences in {len(expected.routes)} routes, {len(expected.associations)} associations "
+              f"and {len(expected.attachments)} attachments ({sum(calls.values())} API calls)", file=sys.stderr)
+    sys.exit(1 if drift else 0)
+
+
+if __name__ == "__main__":
+    main()
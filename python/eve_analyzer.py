@@ -0,0 +1,338 @@
+'''Summarizes the firewall's alert and flow logs (see firewall_logging.py)
+offline:
+
+    aws s3 sync s3://<firewall-log-bucket>/network-firewall/ logs/
+    pulumi stack output spoke-cidrs --json > spoke-cidrs.json
+    python eve_analyzer.py --spoke-cidrs spoke-cidrs.json --workers 8 logs/
+
+It reports:
+
+- drops and alerts by sid (alert events, by whether the engine blocked or
+  allowed the packet),
+- bytes per rule, from the flow counters Suricata attaches to each alert
+  (the traffic the flow had carried when the rule matched), and
+- the top talkers (source addresses by bytes) in each spoke, from flow
+  events.
+
+Files are gzipped (`.gz`) or plain Suricata EVE JSON, one event per line,
+either bare or wrapped in Network Firewall's `{"firewall_name": ...,
+"event": {...}}` envelope. Each file is streamed line by line in a worker
+process. Memory use doesn't grow with the logs: counts are kept per sid and
+per spoke, and top talkers with a Space-Saving sketch of a fixed size per
+spoke. A talker's count can overestimate it, by at most the error bound
+reported next to it, but never underestimates it, even after the workers'
+sketches are merged.
+
+Needs only the standard library.'''
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import gzip
+import heapq
+import io
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+OTHER = "other"
+_READ_BUFFER = 1 << 20
+
+
+class TopTalkers:
+    '''A Space-Saving sketch: keeps at most `capacity` keys, replacing the
+    smallest when a new key arrives, so heavy hitters are found in constant
+    memory. Sketches can be merged.'''
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        # How much each key's count may overestimate it by:
+        self.errors: Dict[str, int] = {}
+        # One (count, key) entry per key. Counts only grow, so an entry can
+        # be stale (too low) but never too high; stale entries are fixed up
+        # when they reach the top, instead of on every add.
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, key: str, count: int) -> None:
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+            return
+        heap = self._heap
+        if len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(heap, (count, key))
+            return
+        floor, smallest = heap[0]
+        while counts[smallest] != floor:
+            heapq.heapreplace(heap, (counts[smallest], smallest))
+            floor, smallest = heap[0]
+        del counts[smallest], self.errors[smallest]
+        counts[key] = floor + count
+        self.errors[key] = floor
+        heapq.heapreplace(heap, (floor + count, key))
+
+    @property
+    def floor(self) -> int:
+        '''The most a key the sketch doesn't hold can have been counted:
+        its smallest count once full, 0 until then.'''
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values(), default=0)
+
+    def merge(self, other: "TopTalkers") -> None:
+        '''Merges in `other` as in Agarwal et al., "Mergeable Summaries". A
+        key one sketch doesn't hold may have been counted up to that sketch's
+        floor, so the floor is added to both its count and its error. Keeping
+        the largest `capacity` keys then keeps every dropped key below the
+        new floor.'''
+        floor, other_floor = self.floor, other.floor
+        counts: Dict[str, int] = {}
+        errors: Dict[str, int] = {}
+        for key in self.counts.keys() | other.counts.keys():
+            if key in self.counts:
+                count, error = self.counts[key], self.errors[key]
+            else:
+                count, error = floor, floor
+            if key in other.counts:
+                count, error = count + other.counts[key], error + other.errors[key]
+            else:
+                count, error = count + other_floor, error + other_floor
+            counts[key] = count
+            errors[key] = error
+        if len(counts) > self.capacity:
+            keep = heapq.nlargest(self.capacity, counts, key=counts.__getitem__)
+            counts = {key: counts[key] for key in keep}
+            errors = {key: errors[key] for key in keep}
+        self.counts, self.errors = counts, errors
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        '''The `n` largest keys with their counts and error bounds.'''
+        keys = sorted(self.counts, key=lambda key: (-self.counts[key], key))[:n]
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+
+@dataclass
+class Summary:
+    files: int = 0
+    # Uncompressed bytes of log read:
+    bytes_read: int = 0
+    events: int = 0
+    drops: collections.Counter = field(default_factory=collections.Counter)
+    alerts: collections.Counter = field(default_factory=collections.Counter)
+    signatures: Dict[int, str] = field(default_factory=dict)
+    rule_bytes: collections.Counter = field(default_factory=collections.Counter)
+    spoke_bytes: collections.Counter = field(default_factory=collections.Counter)
+    talkers: Dict[str, TopTalkers] = field(default_factory=dict)
+    malformed: int = 0
+
+    def merge(self, other: "Summary") -> "Summary":
+        self.files += other.files
+        self.bytes_read += other.bytes_read
+        self.events += other.events
+        self.malformed += other.malformed
+        self.drops.update(other.drops)
+        self.alerts.update(other.alerts)
+        self.signatures.update(other.signatures)
+        self.rule_bytes.update(other.rule_bytes)
+        self.spoke_bytes.update(other.spoke_bytes)
+        for spoke, talkers in other.talkers.items():
+            if spoke in self.talkers:
+                self.talkers[spoke].merge(talkers)
+            else:
+                self.talkers[spoke] = talkers
+        return self
+
+    def to_dict(self, top: int = 10) -> Dict:
+        def by_sid(counter: collections.Counter) -> List[Dict]:
+            return [{"sid": sid, "signature": self.signatures.get(sid, ""), "count": count}
+                    for sid, count in counter.most_common(top)]
+
+        return {
+            "files": self.files,
+            "bytes_read": self.bytes_read,
+            "events": self.events,
+            "malformed": self.malformed,
+            "drops": by_sid(self.drops),
+            "alerts": by_sid(self.alerts),
+            "rule_bytes": by_sid(self.rule_bytes),
+            "spokes": {
+                spoke: {
+                    "bytes": self.spoke_bytes[spoke],
+                    "top_talkers": [{"address": address, "bytes": count, "error": error}
+                                    for address, count, error in self.talkers[spoke].top(top)],
+                }
+                for spoke in sorted(self.talkers)
+            },
+        }
+
+
+class SpokeIndex:
+    '''Finds the spoke an IPv4 address belongs to by binary search over the
+    spokes' (non-overlapping) CIDR blocks.'''
+
+    def __init__(self, spoke_cidrs: Mapping[str, str]) -> None:
+        blocks = sorted((ipaddress.ip_network(cidr), name) for name, cidr in spoke_cidrs.items())
+        self._starts = [int(network.network_address) for network, _ in blocks]
+        self._ends = [int(network.broadcast_address) for network, _ in blocks]
+        self._names = [name for _, name in blocks]
+
+    def spoke(self, address: str) -> Optional[str]:
+        try:
+            value = int.from_bytes(socket.inet_aton(address), "big")
+        except (OSError, TypeError):
+            return None
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i >= 0 and value <= self._ends[i]:
+            return self._names[i]
+        return None
+
+
+def read_lines(path: str) -> Iterator[bytes]:
+    '''Streams the lines of a plain or gzipped file.'''
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    with io.BufferedReader(raw, buffer_size=_READ_BUFFER) as lines:
+        yield from lines
+
+
+def analyze_file(path: str, spoke_cidrs: Mapping[str, str], sketch_size: int = 100) -> Summary:
+    summary = Summary(files=1)
+    spokes = SpokeIndex(spoke_cidrs)
+    # Decoding to str up front spares json.loads detecting the encoding of
+    # every line:
+    loads = json.JSONDecoder().decode
+
+    for line in read_lines(path):
+        summary.bytes_read += len(line)
+        # Most events are neither alerts nor flows (e.g. TLS or stats events
+        # in raw Suricata output); skip those without parsing them:
+        if b'alert"' not in line and b'flow"' not in line:
+            continue
+        try:
+            record = loads(line.decode())
+        except ValueError:
+            summary.malformed += 1
+            continue
+        event = record.get("event", record)
+        summary.events += 1
+        event_type = event.get("event_type")
+
+        if event_type == "alert":
+            alert = event.get("alert") or {}
+            sid = alert.get("signature_id")
+            if sid is None:
+                continue
+            if sid not in summary.signatures:
+                summary.signatures[sid] = alert.get("signature", "")
+            if alert.get("action") == "blocked":
+                summary.drops[sid] += 1
+            else:
+                summary.alerts[sid] += 1
+            flow = event.get("flow")
+            if flow:
+                summary.rule_bytes[sid] += flow.get("bytes_toserver", 0) + flow.get("bytes_toclient", 0)
+
+        elif event_type in ("netflow", "flow"):
+            if event_type == "netflow":
+                size = (event.get("netflow") or {}).get("bytes", 0)
+            else:
+                flow = event.get("flow") or {}
+                size = flow.get("bytes_toserver", 0) + flow.get("bytes_toclient", 0)
+            source = event.get("src_ip")
+            spoke = spokes.spoke(source) or OTHER
+            summary.spoke_bytes[spoke] += size
+            talkers = summary.talkers.get(spoke)
+            if talkers is None:
+                talkers = summary.talkers[spoke] = TopTalkers(sketch_size)
+            talkers.add(source, size)
+
+    return summary
+
+
+def find_log_files(paths: Iterable[str]) -> List[str]:
+    '''Expands directories into the log files under them.'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files.extend(os.path.join(directory, name) for name in names
+                             if name.endswith((".gz", ".log", ".json")))
+        else:
+            files.append(path)
+    # Largest first, so one big file doesn't start last and run alone:
+    return sorted(files, key=lambda f: -os.path.getsize(f))
+
+
+def analyze(paths: Sequence[str], spoke_cidrs: Mapping[str, str], workers: int = 1,
+            sketch_size: int = 100) -> Summary:
+    '''Summarizes every file, `workers` at a time.'''
+    summary = Summary()
+    if workers <= 1:
+        for path in paths:
+            summary.merge(analyze_file(path, spoke_cidrs, sketch_size))
+        return summary
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_file, path, spoke_cidrs, sketch_size) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            summary.merge(future.result())
+    return summary
+
+
+def format_summary(summary: Summary, seconds: float, top: int = 10) -> str:
+    report = summary.to_dict(top)
+    lines = [f"{report['files']} files, {report['events']} events, "
+             f"{report['bytes_read'] / 1e6:.1f} MB in {seconds:.2f}s "
+             f"({report['bytes_read'] / 1e6 / max(seconds, 1e-9):.0f} MB/s)"]
+    for title, key, unit in (("drops", "drops", "count"), ("alerts", "alerts", "count"),
+                             ("bytes per rule", "rule_bytes", "bytes")):
+        lines.append(f"\n{title}:")
+        lines.append(f"  {'sid':>10} {unit:>14}  signature")
+        lines += [f"  {row['sid']:>10} {row['count']:>14}  {row['signature']}" for row in report[key]]
+    lines.append("\ntop talkers:")
+    for spoke, row in report["spokes"].items():
+        lines.append(f"  {spoke} ({row['bytes']} bytes)")
+        lines += [f"    {talker['address']:<15} {talker['bytes']:>14}" + (f" (+/- {talker['error']})" if talker["error"] else "")
+                  for talker in row["top_talkers"]]
+    if report["malformed"]:
+        lines.append(f"\n{report['malformed']} malformed lines skipped")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Log files, or directories to search for them.")
+    parser.add_argument("--spoke-cidrs", help="JSON file of spoke name -> CIDR (the spoke-cidrs stack output).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--top", type=int, default=10, help="Rows per table (default: 10).")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args()
+
+    spoke_cidrs = {}
+    if args.spoke_cidrs:
+        with open(args.spoke_cidrs) as f:
+            spoke_cidrs = json.load(f)
+
+    started = time.perf_counter()
+    # Keep enough candidates that the top rows are reliable:
+    summary = analyze(find_log_files(args.paths), spoke_cidrs, args.workers, sketch_size=max(100, args.top * 10))
+    seconds = time.perf_counter() - started
+
+    if args.json:
+        json.dump(summary.to_dict(args.top), sys.stdout, indent=2)
+        print()
+    else:
+        print(format_summary(summary, seconds, args.top))
+
+
+if __name__ == "__main__":
+    main()
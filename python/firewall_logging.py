@@ -0,0 +1,54 @@
+'''Alert and flow logging for the inspection firewall.
+
+Set `firewall-logs` in stack config to deliver the firewall's logs to S3:
+
+    firewall-logs:
+      bucket: my-firewall-logs   # optional; a bucket is created if not set
+      prefix: network-firewall
+      types: [ALERT, FLOW]
+      retention_days: 30         # for a created bucket
+
+Network Firewall partitions what it delivers under the prefix by account,
+log type, region, firewall and hour:
+
+    <prefix>/AWSLogs/<account>/network-firewall/<alert|flow>/<region>/<firewall>/<YYYY>/<MM>/<DD>/<HH>/*.log.gz
+
+Each file is gzipped Suricata EVE JSON, one event per line, which
+`eve_analyzer.py` summarizes offline.'''
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+import pulumi
+
+LOG_TYPES = ("ALERT", "FLOW")
+
+
+@dataclass
+class FirewallLogSettings:
+    # An existing bucket to deliver to. One is created if not set.
+    bucket: Optional[str] = None
+    prefix: str = "network-firewall"
+    types: Sequence[str] = field(default_factory=lambda: list(LOG_TYPES))
+    # How long a created bucket keeps logs:
+    retention_days: int = 30
+
+    @staticmethod
+    def from_config(value: dict) -> "FirewallLogSettings":
+        settings = FirewallLogSettings(**value)
+        unknown = [log_type for log_type in settings.types if log_type not in LOG_TYPES]
+        if unknown or not settings.types:
+            raise Exception(
+                f"Unknown firewall log types: {', '.join(unknown) or 'none given'}. Expected some of: {', '.join(LOG_TYPES)}.")
+        if len(set(settings.types)) != len(settings.types):
+            raise Exception("Firewall log types are listed more than once.")
+        settings.prefix = settings.prefix.strip("/")
+        return settings
+
+
+def load_firewall_log_settings(config: pulumi.Config) -> Optional[FirewallLogSettings]:
+    '''Reads the `firewall-logs` object from stack config. Returns None (no
+    logging) if it's not set.'''
+    value = config.get_object("firewall-logs")
+    if value is None:
+        return None
+    return FirewallLogSettings.from_config(value)
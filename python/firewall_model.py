@@ -0,0 +1,435 @@
+'''A typed model of Network Firewall rules that compiles to `RuleGroup`
+arguments.
+
+Rule groups can't be resized after they're created, so a wrong capacity
+means replacing the group (and the policy referencing it). The compiler works
+out the capacity AWS will charge for the rules and refuses to compile a group
+whose reserved capacity is too small, instead of letting `pulumi up` fail
+half way through.
+
+Stateful rules without an explicit sid get one derived from the rule's own
+text, so sids don't change when rules are added, removed or reordered.
+
+Groups compile to a canonical form, so that cosmetic changes to the rules
+here (whitespace, reordering where order can't matter, duplicates) compile
+to the same arguments. Pulumi then has no diff to apply, and the firewall
+policy has no change to sync to its endpoints. Each group is tagged with a
+hash of its canonical content, which changes exactly when the group does.'''
+import hashlib
+import ipaddress
+import json
+import re
+import zlib
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import pulumi
+import pulumi_aws as aws
+
+# Suricata reserves sids below 1000000 for local rules; we hand out
+# sids derived from rule text above that.
+GENERATED_SID_BASE = 1_000_000
+GENERATED_SID_RANGE = 1_000_000_000
+
+# The tag holding a hash of a rule group's canonical content:
+CONTENT_HASH_TAG = "content-hash"
+
+# Network Firewall's default quotas for a firewall policy. Both can be
+# raised through Service Quotas; the capacity limit is on the sum of what the
+# policy's stateless (or stateful) rule groups reserve.
+MAX_POLICY_RULE_GROUPS = 20
+MAX_POLICY_CAPACITY = 30_000
+
+
+class CapacityError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class PortRange:
+    from_port: int
+    to_port: Optional[int] = None
+
+    @property
+    def end(self) -> int:
+        return self.from_port if self.to_port is None else self.to_port
+
+    def to_args(self) -> dict:
+        return {"from_port": self.from_port, "to_port": self.end}
+
+
+@dataclass(frozen=True)
+class StatelessRule:
+    '''A stateless 5-tuple rule. Empty match settings match everything.'''
+    priority: int
+    actions: Sequence[str]
+    protocols: Sequence[int] = ()
+    sources: Sequence[str] = ()
+    destinations: Sequence[str] = ()
+    source_ports: Sequence[PortRange] = ()
+    destination_ports: Sequence[PortRange] = ()
+
+    @property
+    def capacity(self) -> int:
+        '''AWS charges the product of the number of values in each match
+        setting, counting an unset setting as 1.'''
+        capacity = 1
+        for setting in (self.protocols, self.sources, self.destinations,
+                        self.source_ports, self.destination_ports):
+            capacity *= max(len(setting), 1)
+        return capacity
+
+    def to_args(self) -> dict:
+        match_attributes = {}
+        if self.protocols:
+            match_attributes["protocols"] = list(self.protocols)
+        if self.sources:
+            match_attributes["sources"] = [
+                {"address_definition": source} for source in self.sources]
+        if self.source_ports:
+            match_attributes["source_ports"] = [
+                port.to_args() for port in self.source_ports]
+        if self.destinations:
+            match_attributes["destinations"] = [
+                {"address_definition": destination} for destination in self.destinations]
+        if self.destination_ports:
+            match_attributes["destination_ports"] = [
+                port.to_args() for port in self.destination_ports]
+
+        return {
+            "priority": self.priority,
+            "rule_definition": {
+                "actions": list(self.actions),
+                "match_attributes": match_attributes,
+            },
+        }
+
+
+@dataclass(frozen=True)
+class StatefulRule:
+    '''A Suricata-compatible stateful rule, e.g.
+
+        pass tcp any any <> $EXTERNAL_NET 443 (msg:"..."; flow:not_established; sid:1; rev:1;)
+
+    `options` go between the message and the sid.'''
+    action: str
+    protocol: str
+    msg: str
+    source: str = "any"
+    source_port: str = "any"
+    direction: str = "->"
+    destination: str = "any"
+    destination_port: str = "any"
+    options: Sequence[str] = ()
+    sid: Optional[int] = None
+    rev: int = 1
+
+    capacity = 1
+
+    def normalized(self) -> "StatefulRule":
+        '''Returns the rule with insignificant whitespace removed and its
+        action and protocol lowercased.'''
+        return replace(
+            self,
+            action=self.action.strip().lower(),
+            protocol=self.protocol.strip().lower(),
+            msg=" ".join(self.msg.split()),
+            source=_without_whitespace(self.source),
+            source_port=_without_whitespace(self.source_port),
+            direction=self.direction.strip(),
+            destination=_without_whitespace(self.destination),
+            destination_port=_without_whitespace(self.destination_port),
+            options=tuple(_normalize_option(option) for option in self.options),
+        )
+
+    def header(self) -> str:
+        return (f"{self.action} {self.protocol} {self.source} {self.source_port} "
+                f"{self.direction} {self.destination} {self.destination_port}")
+
+    def body(self) -> List[str]:
+        return [f'msg:"{self.msg}"', *self.options]
+
+    def render(self, sid: int) -> str:
+        options = "; ".join([*self.body(), f"sid:{sid}", f"rev:{self.rev}"])
+        return f"{self.header()} ({options};)"
+
+
+@dataclass(frozen=True)
+class TlsSniRule(StatefulRule):
+    '''Matches the TLS SNI of a connection. A domain with a leading dot (e.g.
+    `.amazon.com`) matches that domain and all of its subdomains.'''
+    action: str = "pass"
+    protocol: str = "tls"
+    msg: str = ""
+    domain: str = ""
+    destination: str = "$EXTERNAL_NET"
+    destination_port: str = "443"
+
+    def normalized(self) -> "StatefulRule":
+        return replace(super().normalized(), domain=self.domain.strip().lower())
+
+    def body(self) -> List[str]:
+        match = ["tls.sni"]
+        if self.domain.startswith("."):
+            match += ["dotprefix", f'content:"{self.domain}"', "endswith"]
+        else:
+            match += [f'content:"{self.domain}"', "startswith", "endswith"]
+        return [*match, f'msg:"{self.msg or f"Allowing {self.domain} HTTPS requests"}"', *self.options]
+
+
+@dataclass(frozen=True)
+class IpSet:
+    '''A rule variable, referenced from stateful rules as `$NAME`.'''
+    name: str
+    definition: Sequence[str]
+
+
+@dataclass
+class StatelessRuleGroup:
+    name: str
+    rules: Sequence[StatelessRule]
+    # The capacity to reserve for the group. Defaults to exactly what the
+    # rules need. Reserve more if the group is expected to grow, since
+    # changing this replaces the group.
+    capacity: Optional[int] = None
+
+    @property
+    def required_capacity(self) -> int:
+        return sum(rule.capacity for rule in self.rules)
+
+    def _content(self) -> Dict[str, object]:
+        priorities = [rule.priority for rule in self.rules]
+        if len(set(priorities)) != len(priorities):
+            raise ValueError(
+                f"Rule group '{self.name}' has rules with the same priority.")
+
+        # Rules are evaluated by priority, so their order here doesn't matter:
+        rules = sorted(self.rules, key=lambda rule: rule.priority)
+        return {
+            "capacity": _check_capacity(self.name, self.capacity, self.required_capacity),
+            "type": "STATELESS",
+            "rule_group": {
+                "rules_source": {
+                    "stateless_rules_and_custom_actions": {
+                        "stateless_rules": [rule.to_args() for rule in rules],
+                    },
+                },
+            },
+        }
+
+    @property
+    def content_hash(self) -> str:
+        return _content_hash(self._content())
+
+    def to_args(self) -> "aws.networkfirewall.RuleGroupArgs":
+        content = self._content()
+        return aws.networkfirewall.RuleGroupArgs(
+            name=self.name,
+            tags={CONTENT_HASH_TAG: _content_hash(content)},
+            **content,
+        )
+
+
+@dataclass
+class StatefulRuleGroup:
+    name: str
+    rules: Sequence[StatefulRule]
+    ip_sets: Sequence[IpSet] = ()
+    rule_order: str = "STRICT_ORDER"
+    capacity: Optional[int] = None
+    # Leave the group unnamed, letting Pulumi auto-name it, for groups that
+    # were created that way.
+    auto_name: bool = field(default=False)
+
+    @property
+    def required_capacity(self) -> int:
+        return sum(rule.capacity for rule in self.canonical_rules())
+
+    def canonical_rules(self) -> List[StatefulRule]:
+        '''The rules normalized, without duplicates and, where every rule
+        has the same action (so which one matches first can't change a
+        verdict), sorted by their text.'''
+        rules = list(dict.fromkeys(rule.normalized() for rule in self.rules))
+        if len({rule.action for rule in rules}) <= 1:
+            rules.sort(key=lambda rule: (rule.render(0), rule.sid or 0))
+        return rules
+
+    def canonical_ip_sets(self) -> List[IpSet]:
+        '''The IP sets sorted by name, each with its CIDRs collapsed (IPv4,
+        then IPv6).'''
+        return [
+            IpSet(ip_set.name, _collapse_cidrs(ip_set.definition))
+            for ip_set in sorted(self.ip_sets, key=lambda ip_set: ip_set.name)
+        ]
+
+    def rules_string(self) -> str:
+        rules = self.canonical_rules()
+        return "\n".join(
+            rule.render(sid) for rule, sid in zip(rules, assign_sids(rules)))
+
+    def _content(self) -> Dict[str, object]:
+        rule_group: Dict[str, object] = {
+            "rules_source": {
+                "rules_string": self.rules_string(),
+            },
+            "stateful_rule_options": {
+                "rule_order": self.rule_order,
+            },
+        }
+        ip_sets = self.canonical_ip_sets()
+        if ip_sets:
+            rule_group["rule_variables"] = {
+                "ip_sets": [{
+                    "key": ip_set.name,
+                    "ip_set": {"definition": list(ip_set.definition)},
+                } for ip_set in ip_sets],
+            }
+
+        return {
+            "capacity": _check_capacity(self.name, self.capacity, self.required_capacity),
+            "type": "STATEFUL",
+            "rule_group": rule_group,
+        }
+
+    @property
+    def content_hash(self) -> str:
+        return _content_hash(self._content())
+
+    def to_args(self) -> "aws.networkfirewall.RuleGroupArgs":
+        content = self._content()
+        return aws.networkfirewall.RuleGroupArgs(
+            name=None if self.auto_name else self.name,
+            tags={CONTENT_HASH_TAG: _content_hash(content)},
+            **content,
+        )
+
+
+RuleGroup = Union[StatelessRuleGroup, StatefulRuleGroup]
+
+
+@dataclass(frozen=True)
+class RuleGroupReference:
+    priority: int
+    group: RuleGroup
+
+
+@dataclass
+class FirewallPolicy:
+    '''The rule groups of a firewall policy and what happens to traffic none
+    of them decide on. Groups are evaluated in priority order.'''
+    stateless_rule_groups: Sequence[RuleGroupReference] = ()
+    stateful_rule_groups: Sequence[RuleGroupReference] = ()
+    stateless_default_actions: Sequence[str] = ("aws:forward_to_sfe",)
+    stateless_fragment_default_actions: Sequence[str] = ("aws:forward_to_sfe",)
+    stateful_default_actions: Sequence[str] = ("aws:drop_strict", "aws:alert_strict")
+    stateful_rule_order: str = "STRICT_ORDER"
+
+    @property
+    def rule_groups(self) -> List[RuleGroup]:
+        return [reference.group for reference in
+                [*self.stateless_rule_groups, *self.stateful_rule_groups]]
+
+    def check_limits(
+        self,
+        max_rule_groups: int = MAX_POLICY_RULE_GROUPS,
+        max_capacity: int = MAX_POLICY_CAPACITY,
+    ) -> None:
+        '''Raises `CapacityError` if the policy references more rule groups,
+        or its groups reserve more capacity, than Network Firewall allows, so
+        that this fails before the groups are created rather than when the
+        policy is.'''
+        for kind, references in [("stateless", self.stateless_rule_groups),
+                                  ("stateful", self.stateful_rule_groups)]:
+            if len(references) > max_rule_groups:
+                raise CapacityError(
+                    f"The firewall policy references {len(references)} {kind} rule groups "
+                    f"but can reference at most {max_rule_groups}.")
+            reserved = sum(_reserved_capacity(reference.group) for reference in references)
+            if reserved > max_capacity:
+                raise CapacityError(
+                    f"The firewall policy's {kind} rule groups reserve a capacity of {reserved} "
+                    f"but can reserve at most {max_capacity}.")
+
+    def to_args(self, rule_group_arns: Mapping[str, pulumi.Input[str]]) -> "aws.networkfirewall.FirewallPolicyArgs":
+        '''`rule_group_arns` maps each rule group's name to its ARN.'''
+        return aws.networkfirewall.FirewallPolicyArgs(
+            firewall_policy=aws.networkfirewall.FirewallPolicyFirewallPolicyArgs(
+                stateless_default_actions=list(self.stateless_default_actions),
+                stateless_fragment_default_actions=list(self.stateless_fragment_default_actions),
+                stateful_default_actions=list(self.stateful_default_actions),
+                stateful_engine_options={
+                    "rule_order": self.stateful_rule_order
+                },
+                stateless_rule_group_references=[{
+                    "priority": reference.priority,
+                    "resource_arn": rule_group_arns[reference.group.name],
+                } for reference in sorted(self.stateless_rule_groups, key=lambda r: r.priority)],
+                stateful_rule_group_references=[{
+                    "priority": reference.priority,
+                    "resource_arn": rule_group_arns[reference.group.name],
+                } for reference in sorted(self.stateful_rule_groups, key=lambda r: r.priority)],
+            )
+        )
+
+
+def assign_sids(rules: Sequence[StatefulRule]) -> List[int]:
+    '''Returns a sid for each rule: its own if it has one, otherwise one
+    derived from a checksum of the rule's text. Collisions are resolved by
+    taking the next free sid, visiting rules in text order so the result
+    doesn't depend on the order of the rules.'''
+    taken = {rule.sid for rule in rules if rule.sid is not None}
+    if len(taken) != len([rule for rule in rules if rule.sid is not None]):
+        raise ValueError("Stateful rules have duplicate sids.")
+
+    generated: Dict[int, int] = {}
+    unassigned = [i for i, rule in enumerate(rules) if rule.sid is None]
+    for i in sorted(unassigned, key=lambda i: rules[i].render(0)):
+        text = rules[i].render(0).encode()
+        sid = GENERATED_SID_BASE + zlib.crc32(text) % GENERATED_SID_RANGE
+        while sid in taken:
+            sid += 1
+        taken.add(sid)
+        generated[i] = sid
+
+    return [rule.sid if rule.sid is not None else generated[i]
+            for i, rule in enumerate(rules)]
+
+
+def _check_capacity(name: str, reserved: Optional[int], required: int) -> int:
+    if reserved is None:
+        return required
+    if reserved < required:
+        raise CapacityError(
+            f"Rule group '{name}' needs a capacity of {required} but only reserves {reserved}.")
+    return reserved
+
+
+def _reserved_capacity(group: RuleGroup) -> int:
+    return group.required_capacity if group.capacity is None else group.capacity
+
+
+def _collapse_cidrs(cidrs: Sequence[str]) -> List[str]:
+    # collapse_addresses takes one IP version at a time:
+    networks = [ipaddress.ip_network(cidr.strip(), strict=False) for cidr in cidrs]
+    return [
+        str(network)
+        for version in (4, 6)
+        for network in ipaddress.collapse_addresses(n for n in networks if n.version == version)
+    ]
+
+
+def _content_hash(content: Mapping[str, object]) -> str:
+    text = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _without_whitespace(value: str) -> str:
+    '''Addresses and ports, e.g. `[10.0.0.0/8, 192.168.0.0/16]`, mean the
+    same without whitespace.'''
+    return re.sub(r"\s+", "", value)
+
+
+def _normalize_option(option: str) -> str:
+    '''`flow: established ` and `flow:established` are the same option.'''
+    keyword, separator, value = option.partition(":")
+    return f"{keyword.strip()}:{value.strip()}" if separator else keyword.strip()
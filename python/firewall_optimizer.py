@@ -0,0 +1,227 @@
+'''Shrinks stateless rule groups without changing what they do.
+
+The stateless engine evaluates rules in priority order and applies the first
+match, and AWS charges capacity per combination of match settings (see
+`StatelessRule.capacity`). So we:
+
+1. Normalize each rule: collapse overlapping and adjacent CIDRs, merge
+   overlapping and adjacent port ranges and drop duplicate protocols. A
+   setting that covers everything (all ports, or both `0.0.0.0/0` and
+   `::/0`) becomes "any".
+2. Drop rules shadowed by a higher-priority rule that matches everything
+   they match, since they can never fire.
+3. Merge rules with the same actions that differ in a single match setting,
+   moving the lower-priority rule up to the higher-priority one. That's only
+   done when every rule in between either has the same actions or can't
+   match the same packets, so no packet changes verdict.'''
+import ipaddress
+from dataclasses import dataclass, replace
+from typing import List, Optional, Sequence, Tuple
+
+from firewall_model import PortRange, StatelessRule, StatelessRuleGroup
+
+_ALL_ADDRESSES = (ipaddress.ip_network("0.0.0.0/0"), ipaddress.ip_network("::/0"))
+_ALL_PORTS = (0, 65535)
+
+# The match settings of a rule, in StatelessRule field order.
+_SETTINGS = ("protocols", "sources", "destinations", "source_ports", "destination_ports")
+
+
+@dataclass
+class OptimizationReport:
+    rules_before: int
+    rules_after: int
+    capacity_before: int
+    capacity_after: int
+    shadowed: int
+    merged: int
+
+    @property
+    def capacity_saved(self) -> int:
+        return self.capacity_before - self.capacity_after
+
+    def __str__(self) -> str:
+        return (f"{self.rules_before} -> {self.rules_after} rules, capacity "
+                f"{self.capacity_before} -> {self.capacity_after} "
+                f"({self.capacity_saved} saved; {self.shadowed} shadowed, {self.merged} merged)")
+
+
+def optimize_rules(rules: Sequence[StatelessRule]) -> Tuple[List[StatelessRule], OptimizationReport]:
+    ordered = sorted(rules, key=lambda rule: rule.priority)
+
+    kept = [_normalize(rule) for rule in ordered]
+    shadowed = merged = 0
+    changed = True
+    while changed:
+        kept, dropped = _drop_shadowed(kept)
+        shadowed += dropped
+        combined = _merge_rules(kept)
+        merged += combined
+        changed = combined > 0
+
+    return kept, OptimizationReport(
+        rules_before=len(ordered),
+        rules_after=len(kept),
+        capacity_before=sum(rule.capacity for rule in ordered),
+        capacity_after=sum(rule.capacity for rule in kept),
+        shadowed=shadowed,
+        merged=merged,
+    )
+
+
+def _drop_shadowed(rules: List[StatelessRule]) -> Tuple[List[StatelessRule], int]:
+    kept: List[StatelessRule] = []
+    for rule in rules:
+        if not any(_covers(earlier, rule) for earlier in kept):
+            kept.append(rule)
+    return kept, len(rules) - len(kept)
+
+
+def _merge_rules(rules: List[StatelessRule]) -> int:
+    '''Merges rules in place, returning how many merges were made.'''
+    merged = 0
+    i = 0
+    while i < len(rules):
+        j = i + 1
+        while j < len(rules):
+            combined = _merge(rules[i], rules[j])
+            if combined is not None and _can_move_up(rules, j, i):
+                rules[i] = combined
+                del rules[j]
+                merged += 1
+                # rules[i] now matches more, so look again at the rules we
+                # already passed over:
+                j = i + 1
+            else:
+                j += 1
+        i += 1
+    return merged
+
+
+def optimize_rule_group(group: StatelessRuleGroup) -> Tuple[StatelessRuleGroup, OptimizationReport]:
+    rules, report = optimize_rules(group.rules)
+    return replace(group, rules=rules), report
+
+
+def _normalize(rule: StatelessRule) -> StatelessRule:
+    return replace(
+        rule,
+        protocols=sorted(set(rule.protocols)),
+        sources=_collapse_addresses(rule.sources),
+        destinations=_collapse_addresses(rule.destinations),
+        source_ports=_collapse_ports(rule.source_ports),
+        destination_ports=_collapse_ports(rule.destination_ports),
+    )
+
+
+def _collapse_addresses(addresses: Sequence[str]) -> List[str]:
+    # collapse_addresses takes one IP version at a time:
+    parsed = [ipaddress.ip_network(address) for address in addresses]
+    networks = [
+        network
+        for version in (4, 6)
+        for network in ipaddress.collapse_addresses(n for n in parsed if n.version == version)
+    ]
+    # "Any" matches IPv6 too, so 0.0.0.0/0 alone isn't everything:
+    if all(network in networks for network in _ALL_ADDRESSES):
+        return []
+    return [str(network) for network in networks]
+
+
+def _collapse_ports(ports: Sequence[PortRange]) -> List[PortRange]:
+    merged: List[List[int]] = []
+    for start, end in sorted((port.from_port, port.end) for port in ports):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    if merged == [list(_ALL_PORTS)]:
+        return []
+    return [PortRange(start, end) for start, end in merged]
+
+
+def _covers(a: StatelessRule, b: StatelessRule) -> bool:
+    '''Whether every packet matching `b` also matches `a`.'''
+    return (_covers_values(a.protocols, b.protocols)
+            and _covers_addresses(a.sources, b.sources)
+            and _covers_addresses(a.destinations, b.destinations)
+            and _covers_ports(a.source_ports, b.source_ports)
+            and _covers_ports(a.destination_ports, b.destination_ports))
+
+
+def _intersects(a: StatelessRule, b: StatelessRule) -> bool:
+    '''Whether some packet matches both `a` and `b`.'''
+    return (_intersects_values(a.protocols, b.protocols)
+            and _intersects_addresses(a.sources, b.sources)
+            and _intersects_addresses(a.destinations, b.destinations)
+            and _intersects_ports(a.source_ports, b.source_ports)
+            and _intersects_ports(a.destination_ports, b.destination_ports))
+
+
+def _merge(a: StatelessRule, b: StatelessRule) -> Optional[StatelessRule]:
+    '''Returns one rule matching exactly what `a` or `b` match, if they have
+    the same actions and differ in at most one match setting.'''
+    if list(a.actions) != list(b.actions):
+        return None
+
+    differing = [name for name in _SETTINGS if getattr(a, name) != getattr(b, name)]
+    if len(differing) != 1:
+        return None
+
+    name = differing[0]
+    a_values, b_values = getattr(a, name), getattr(b, name)
+    if not a_values or not b_values:
+        # One of them already matches anything here, so it covers the other.
+        return replace(a, **{name: []})
+    return _normalize(replace(a, **{name: list(a_values) + list(b_values)}))
+
+
+def _can_move_up(rules: Sequence[StatelessRule], j: int, i: int) -> bool:
+    '''Whether rules[j] can be evaluated at rules[i]'s position instead of
+    its own without changing any verdict.'''
+    return all(
+        list(rules[k].actions) == list(rules[j].actions) or not _intersects(rules[k], rules[j])
+        for k in range(i + 1, j)
+    )
+
+
+def _covers_values(a: Sequence[int], b: Sequence[int]) -> bool:
+    return not a or (bool(b) and set(b) <= set(a))
+
+
+def _intersects_values(a: Sequence[int], b: Sequence[int]) -> bool:
+    return not a or not b or bool(set(a) & set(b))
+
+
+def _covers_addresses(a: Sequence[str], b: Sequence[str]) -> bool:
+    if not a:
+        return True
+    if not b:
+        return False
+    a_networks = [ipaddress.ip_network(address) for address in a]
+    return all(
+        any(x.version == y.version and y.subnet_of(x) for x in a_networks)
+        for y in map(ipaddress.ip_network, b)
+    )
+
+
+def _intersects_addresses(a: Sequence[str], b: Sequence[str]) -> bool:
+    if not a or not b:
+        return True
+    return any(
+        ipaddress.ip_network(x).overlaps(ipaddress.ip_network(y)) for x in a for y in b)
+
+
+def _covers_ports(a: Sequence[PortRange], b: Sequence[PortRange]) -> bool:
+    if not a:
+        return True
+    if not b:
+        return False
+    return all(
+        any(x.from_port <= y.from_port and y.end <= x.end for x in a) for y in b)
+
+
+def _intersects_ports(a: Sequence[PortRange], b: Sequence[PortRange]) -> bool:
+    if not a or not b:
+        return True
+    return any(x.from_port <= y.end and y.from_port <= x.end for x in a for y in b)
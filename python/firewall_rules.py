@@ -1,115 +1,130 @@
+from typing import Optional
+
 import pulumi_aws as aws
 import pulumi as pulumi
 
+from allowlist import DEFAULT_GROUP_CAPACITY, Allowlist, allowlist_rule_groups
+from firewall_model import (
+    MAX_POLICY_CAPACITY,
+    FirewallPolicy,
+    IpSet,
+    PortRange,
+    RuleGroupReference,
+    StatefulRule,
+    StatefulRuleGroup,
+    StatelessRule,
+    StatelessRuleGroup,
+    TlsSniRule,
+)
+from profiling import profiled
+
+
+def firewall_policy(
+    supernet_cidr: str,
+    allowlist: Optional[Allowlist] = None,
+    allowlist_capacity: int = DEFAULT_GROUP_CAPACITY,
+    policy_capacity: int = MAX_POLICY_CAPACITY,
+) -> FirewallPolicy:
+    '''The inspection firewall's policy, as a model that can be compiled
+    (see `create_firewall_policy`) or evaluated offline (see
+    `firewall_simulator.py`). The groups for `allowlist` (see allowlist.py)
+    come after `allow-amazon`, which passes the TCP handshakes their SNI
+    rules need.
 
-def create_firewall_policy(supernet_cidr: str) -> pulumi.Output[str]:
-    drop_remote = aws.networkfirewall.RuleGroup(
-        "drop-remote",
-        aws.networkfirewall.RuleGroupArgs(
-            capacity=2,
-            name="drop-remote",
-            type="STATELESS",
-            rule_group={
-                "rules_source": {
-                    "stateless_rules_and_custom_actions": {
-                        "stateless_rules": [{
-                            "priority": 1,
-                            "rule_definition": {
-                                "actions": ["aws:drop"],
-                                "match_attributes": {
-                                    "protocols": [6],
-                                    "sources": [{
-                                        "address_definition": "0.0.0.0/0"
-                                    }],
-                                    "source_ports": [{
-                                        "from_port": 22,
-                                        "to_port": 22,
-                                    }],
-                                    "destinations": [{
-                                        "address_definition": "0.0.0.0/0"
-                                    }],
-                                    "destination_ports": [{
-                                        "from_port": 22,
-                                        "to_port": 22,
-                                    }]
-                                }
-                            }
-                        }]
-                    }
-                }
-            }
-        )
+    Raises `CapacityError` if the groups don't fit in the policy: more than
+    20 per policy, or more than `policy_capacity` reserved between them.'''
+    # Capacities are reserved explicitly (rather than left to the compiler to
+    # size exactly) to leave room to grow, since changing them replaces the
+    # group. The compiler checks that the rules fit.
+    drop_remote = StatelessRuleGroup(
+        name="drop-remote",
+        capacity=2,
+        rules=[
+            StatelessRule(
+                priority=1,
+                actions=["aws:drop"],
+                protocols=[6],
+                sources=["0.0.0.0/0"],
+                source_ports=[PortRange(22)],
+                destinations=["0.0.0.0/0"],
+                destination_ports=[PortRange(22)],
+            ),
+        ],
     )
 
-    allow_icmp = aws.networkfirewall.RuleGroup(
-        "allow-icmp",
-        aws.networkfirewall.RuleGroupArgs(
-            capacity=100,
-            type="STATEFUL",
-            rule_group={
-                "rule_variables": {
-                    "ip_sets": [{
-                        "key": "SUPERNET",
-                        "ip_set": {
-                            "definition": [supernet_cidr]
-                        }
-                    }]
-                },
-                "rules_source": {
-                    "rules_string": 'pass icmp $SUPERNET any -> $SUPERNET any (msg: "Allowing ICMP packets"; sid:2; rev:1;)'
-                },
-                "stateful_rule_options": {
-                    "rule_order": "STRICT_ORDER"
-                },
-            }
-        )
+    allow_icmp = StatefulRuleGroup(
+        name="allow-icmp",
+        auto_name=True,
+        capacity=100,
+        ip_sets=[IpSet("SUPERNET", [supernet_cidr])],
+        rules=[
+            StatefulRule(
+                action="pass",
+                protocol="icmp",
+                source="$SUPERNET",
+                destination="$SUPERNET",
+                msg="Allowing ICMP packets",
+                sid=2,
+            ),
+        ],
     )
 
-    allow_amazon = aws.networkfirewall.RuleGroup(
-        "allow-amazon",
-        aws.networkfirewall.RuleGroupArgs(
-            capacity=100,
-            name="allow-amazon",
-            type="STATEFUL",
-            rule_group=aws.networkfirewall.RuleGroupRuleGroupArgs(
-                rules_source=aws.networkfirewall.RuleGroupRuleGroupRulesSourceArgs(
-                    rules_string='pass tcp any any <> $EXTERNAL_NET 443 (msg:"Allowing TCP in port 443"; flow:not_established; sid:892123; rev:1;)\n' +
-                    'pass tls any any -> $EXTERNAL_NET 443 (tls.sni; dotprefix; content:".amazon.com"; endswith; msg:"Allowing .amazon.com HTTPS requests"; sid:892125; rev:1;)'
-                ),
-                stateful_rule_options={
-                    "rule_order": "STRICT_ORDER",
-                },
-            )
-        )
+    allow_amazon = StatefulRuleGroup(
+        name="allow-amazon",
+        capacity=100,
+        rules=[
+            StatefulRule(
+                action="pass",
+                protocol="tcp",
+                direction="<>",
+                destination="$EXTERNAL_NET",
+                destination_port="443",
+                msg="Allowing TCP in port 443",
+                options=["flow:not_established"],
+                sid=892123,
+            ),
+            TlsSniRule(
+                domain=".amazon.com",
+                sid=892125,
+            ),
+        ],
     )
 
-    policy = aws.networkfirewall.FirewallPolicy(
-        "firewall-policy",
-        aws.networkfirewall.FirewallPolicyArgs(
-            firewall_policy=aws.networkfirewall.FirewallPolicyFirewallPolicyArgs(
-                stateless_default_actions=["aws:forward_to_sfe"],
-                stateless_fragment_default_actions=["aws:forward_to_sfe"],
-                stateful_default_actions=[
-                    "aws:drop_strict", "aws:alert_strict"],
-                stateful_engine_options={
-                    "rule_order": "STRICT_ORDER"
-                },
-                stateless_rule_group_references=[{
-                    "priority": 10,
-                    "resource_arn": drop_remote.arn
-                }],
-                stateful_rule_group_references=[
-                    {
-                        "priority": 10,
-                        "resource_arn": allow_icmp.arn,
-                    },
-                    {
-                        "priority": 20,
-                        "resource_arn": allow_amazon.arn,
-                    },
-                ]
-            )
-        )
+    allowlist_groups = []
+    if allowlist is not None:
+        allowlist_groups = allowlist_rule_groups(allowlist, capacity=allowlist_capacity)
+
+    policy = FirewallPolicy(
+        stateless_rule_groups=[RuleGroupReference(10, drop_remote)],
+        stateful_rule_groups=[
+            RuleGroupReference(10, allow_icmp),
+            RuleGroupReference(20, allow_amazon),
+            *[RuleGroupReference(30 + i, group) for i, group in enumerate(allowlist_groups)],
+        ],
+        stateless_default_actions=["aws:forward_to_sfe"],
+        stateless_fragment_default_actions=["aws:forward_to_sfe"],
+        stateful_default_actions=["aws:drop_strict", "aws:alert_strict"],
+        stateful_rule_order="STRICT_ORDER",
     )
+    policy.check_limits(max_capacity=policy_capacity)
+    return policy
 
-    return policy.arn
+
+@profiled("create_firewall_policy")
+def create_firewall_policy(
+    supernet_cidr: str,
+    allowlist: Optional[Allowlist] = None,
+    allowlist_capacity: int = DEFAULT_GROUP_CAPACITY,
+    policy_capacity: int = MAX_POLICY_CAPACITY,
+) -> pulumi.Output[str]:
+    policy = firewall_policy(supernet_cidr, allowlist, allowlist_capacity, policy_capacity)
+
+    rule_group_arns = {
+        group.name: aws.networkfirewall.RuleGroup(group.name, group.to_args()).arn
+        for group in policy.rule_groups
+    }
+
+    return aws.networkfirewall.FirewallPolicy(
+        "firewall-policy",
+        policy.to_args(rule_group_arns),
+    ).arn
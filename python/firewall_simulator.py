@@ -0,0 +1,418 @@
+'''Evaluates a `FirewallPolicy` (see `firewall_rules.firewall_policy`)
+against batches of flows offline, so rule changes can be checked against
+recorded or synthetic traffic without deploying anything.
+
+Flows are NumPy arrays and every rule is evaluated against the whole batch
+at once, first match wins:
+
+1. Stateless groups in priority order, rules in priority order. Flows no
+   rule matches get the policy's stateless default actions.
+2. Flows forwarded with `aws:forward_to_sfe` go through the stateful groups
+   in strict order. `pass`, `drop` and `reject` decide a flow; `alert` only
+   flags it. Flows no rule decides get the stateful default actions
+   (`aws:drop_strict`, `aws:alert_strict`, ...).
+
+Each element of a batch stands for one packet of a flow: `established` says
+whether the connection's handshake has completed, and `sni` the TLS server
+name seen on it (none before the TLS layer is known). That's what the
+`flow:` and `tls.sni` keywords in our rules depend on. Only the Suricata
+keywords this repo's rules use are supported; anything else raises
+`ValueError` rather than being silently ignored.
+
+numpy is not needed to deploy the stack, only to run this; see
+requirements-tools.txt.'''
+import ipaddress
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from firewall_model import (
+    FirewallPolicy,
+    StatefulRule,
+    StatefulRuleGroup,
+    StatelessRule,
+    StatelessRuleGroup,
+    TlsSniRule,
+    assign_sids,
+)
+
+PASS, DROP, REJECT = 0, 1, 2
+VERDICTS = ("pass", "drop", "reject")
+
+# The result of the stateless engine for flows it hands to the stateful one:
+_FORWARD = 3
+_STATELESS_ACTIONS = {"aws:pass": PASS, "aws:drop": DROP, "aws:forward_to_sfe": _FORWARD}
+_STATEFUL_ACTIONS = {"pass": PASS, "drop": DROP, "reject": REJECT}
+_PROTOCOLS = {"ip": None, "icmp": 1, "tcp": 6, "udp": 17, "tls": 6}
+
+Matcher = Callable[["Flows"], np.ndarray]
+
+
+@dataclass
+class Flows:
+    '''A batch of flows, one array element per flow. Addresses are IPv4
+    addresses as unsigned 32-bit integers. Server names are indexes into
+    `server_names`, whose first entry is "" (no TLS server name), so they can
+    be compared without touching strings.'''
+    protocol: np.ndarray
+    source: np.ndarray
+    destination: np.ndarray
+    source_port: np.ndarray
+    destination_port: np.ndarray
+    sni: Optional[np.ndarray] = None
+    server_names: Sequence[str] = ("",)
+    established: Optional[np.ndarray] = None
+
+    def __post_init__(self) -> None:
+        if self.sni is None:
+            self.sni = np.zeros(len(self.protocol), dtype=np.int32)
+        if self.established is None:
+            self.established = np.zeros(len(self.protocol), dtype=bool)
+        if not self.server_names or self.server_names[0] != "":
+            raise ValueError('The first server name must be "".')
+
+    def __len__(self) -> int:
+        return len(self.protocol)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Sequence]) -> "Flows":
+        '''Builds a batch from `(protocol, source, destination, source_port,
+        destination_port[, sni[, established]])` tuples with addresses as
+        strings, e.g. rows of a CSV file.'''
+        rows = [tuple(record) + ("", False)[len(record) - 5:] for record in records]
+        columns = list(zip(*rows)) if rows else [()] * 7
+        server_names = {"": 0}
+        for name in columns[5]:
+            server_names.setdefault(name, len(server_names))
+        return cls(
+            protocol=np.array([int(p) for p in columns[0]], dtype=np.uint8),
+            source=np.array([int(ipaddress.IPv4Address(a)) for a in columns[1]], dtype=np.uint32),
+            destination=np.array([int(ipaddress.IPv4Address(a)) for a in columns[2]], dtype=np.uint32),
+            source_port=np.array([int(p) for p in columns[3]], dtype=np.uint16),
+            destination_port=np.array([int(p) for p in columns[4]], dtype=np.uint16),
+            sni=np.array([server_names[name] for name in columns[5]], dtype=np.int32),
+            server_names=list(server_names),
+            # Accept CSV text as well as booleans:
+            established=np.array([str(e).lower() in ("true", "1") for e in columns[6]], dtype=bool),
+        )
+
+    def reversed(self) -> "Flows":
+        '''The same flows in the opposite direction.'''
+        return Flows(self.protocol, self.destination, self.source,
+                     self.destination_port, self.source_port,
+                     self.sni, self.server_names, self.established)
+
+
+@dataclass
+class Verdicts:
+    action: np.ndarray
+    # Whether an alert was logged for the flow:
+    alert: np.ndarray
+    # The index in `FirewallSimulator.rules` of the rule that decided the
+    # flow, or -1 if a default action did.
+    rule: np.ndarray
+
+    def counts(self) -> Dict[str, int]:
+        return {name: int(np.count_nonzero(self.action == code))
+                for code, name in enumerate(VERDICTS)}
+
+
+class FirewallSimulator:
+    '''Compiles a policy once into vectorized matchers, then evaluates any
+    number of batches with `evaluate`.
+
+    `home_net` is the policy's `$HOME_NET`, which AWS defaults to the CIDR of
+    the inspection VPC. `$EXTERNAL_NET` is everything else.'''
+
+    def __init__(self, policy: FirewallPolicy, home_net: Sequence[str]) -> None:
+        if policy.stateful_rule_order != "STRICT_ORDER":
+            raise ValueError(
+                f"Only STRICT_ORDER policies are supported, not {policy.stateful_rule_order}.")
+
+        self.policy = policy
+        self.variables: Dict[str, str] = {
+            "HOME_NET": _list_spec(home_net),
+            "EXTERNAL_NET": "!$HOME_NET",
+        }
+        self.rules: List[str] = []
+        self._stateless = []
+        self._stateful = []
+
+        for reference in sorted(policy.stateless_rule_groups, key=lambda r: r.priority):
+            self._compile_stateless(reference.group)
+        for reference in sorted(policy.stateful_rule_groups, key=lambda r: r.priority):
+            self._compile_stateful(reference.group)
+
+    def evaluate(self, flows: Flows) -> Verdicts:
+        count = len(flows)
+        action = np.full(count, -1, dtype=np.int8)
+        alert = np.zeros(count, dtype=bool)
+        rule = np.full(count, -1, dtype=np.int32)
+
+        undecided = np.ones(count, dtype=bool)
+        for index, code, matcher in self._stateless:
+            matched = undecided & matcher(flows)
+            action[matched] = code
+            rule[matched] = index
+            undecided &= ~matched
+        action[undecided] = _stateless_default(self.policy.stateless_default_actions)
+
+        undecided = action == _FORWARD
+        rule[undecided] = -1
+        for index, code, matcher in self._stateful:
+            matched = undecided & matcher(flows)
+            if code is None:
+                alert |= matched
+                continue
+            action[matched] = code
+            rule[matched] = index
+            undecided &= ~matched
+
+        defaults = self.policy.stateful_default_actions
+        action[undecided] = PASS
+        if "aws:drop_strict" in defaults:
+            action[undecided] = DROP
+        elif "aws:drop_established" in defaults:
+            action[undecided & flows.established] = DROP
+        if "aws:alert_strict" in defaults:
+            alert |= undecided
+        elif "aws:alert_established" in defaults:
+            alert |= undecided & flows.established
+
+        return Verdicts(action=action, alert=alert, rule=rule)
+
+    def _compile_stateless(self, group: StatelessRuleGroup) -> None:
+        for rule in sorted(group.rules, key=lambda r: r.priority):
+            codes = [_STATELESS_ACTIONS[a] for a in rule.actions if a in _STATELESS_ACTIONS]
+            if len(codes) != 1:
+                raise ValueError(
+                    f"Rule {rule.priority} of '{group.name}' needs exactly one standard action.")
+            self.rules.append(f"{group.name}/{rule.priority}")
+            self._stateless.append((len(self.rules) - 1, codes[0], _stateless_matcher(rule)))
+
+    def _compile_stateful(self, group: StatefulRuleGroup) -> None:
+        variables = dict(self.variables)
+        variables.update({ip_set.name: _list_spec(ip_set.definition) for ip_set in group.canonical_ip_sets()})
+
+        # What's deployed is the canonical form, so evaluate that:
+        rules = group.canonical_rules()
+        for rule, sid in zip(rules, assign_sids(rules)):
+            if rule.action == "alert":
+                code = None
+            elif rule.action in _STATEFUL_ACTIONS:
+                code = _STATEFUL_ACTIONS[rule.action]
+            else:
+                raise ValueError(f"Unsupported action '{rule.action}' in '{group.name}'.")
+            self.rules.append(f"{group.name}/sid:{sid}")
+            self._stateful.append((len(self.rules) - 1, code, _stateful_matcher(rule, variables)))
+
+
+def _stateless_default(actions: Sequence[str]) -> int:
+    for action in actions:
+        if action in _STATELESS_ACTIONS:
+            return _STATELESS_ACTIONS[action]
+    raise ValueError(f"No standard action in {list(actions)}.")
+
+
+def _stateless_matcher(rule: StatelessRule) -> Matcher:
+    protocols = np.array(sorted(set(rule.protocols)), dtype=np.uint8)
+    sources = _cidr_matcher(rule.sources)
+    destinations = _cidr_matcher(rule.destinations)
+    source_ports = [(port.from_port, port.end) for port in rule.source_ports]
+    destination_ports = [(port.from_port, port.end) for port in rule.destination_ports]
+
+    def match(flows: Flows) -> np.ndarray:
+        matched = np.ones(len(flows), dtype=bool)
+        if len(protocols):
+            matched &= np.isin(flows.protocol, protocols)
+        if sources:
+            matched &= sources(flows.source)
+        if destinations:
+            matched &= destinations(flows.destination)
+        if source_ports:
+            matched &= _in_ranges(flows.source_port, source_ports)
+        if destination_ports:
+            matched &= _in_ranges(flows.destination_port, destination_ports)
+        return matched
+
+    return match
+
+
+def _stateful_matcher(rule: StatefulRule, variables: Mapping[str, str]) -> Matcher:
+    if rule.protocol not in _PROTOCOLS:
+        raise ValueError(f"Unsupported protocol '{rule.protocol}'.")
+    if rule.direction not in ("->", "<>"):
+        raise ValueError(f"Unsupported direction '{rule.direction}'.")
+
+    protocol = _PROTOCOLS[rule.protocol]
+    source = _address_matcher(rule.source, variables)
+    destination = _address_matcher(rule.destination, variables)
+    source_port = _port_matcher(rule.source_port)
+    destination_port = _port_matcher(rule.destination_port)
+    checks = [_option_matcher(option) for option in rule.options]
+    if rule.protocol == "tls":
+        checks.append(lambda flows: flows.sni != 0)
+    if isinstance(rule, TlsSniRule):
+        checks.append(_sni_matcher(rule.domain))
+
+    def one_way(flows: Flows) -> np.ndarray:
+        return (source(flows.source) & destination(flows.destination)
+                & source_port(flows.source_port) & destination_port(flows.destination_port))
+
+    def match(flows: Flows) -> np.ndarray:
+        matched = one_way(flows)
+        if rule.direction == "<>":
+            matched |= one_way(flows.reversed())
+        if protocol is not None:
+            matched &= flows.protocol == protocol
+        for check in checks:
+            matched &= check(flows)
+        return matched
+
+    return match
+
+
+def _option_matcher(option: str) -> Matcher:
+    keyword, _, value = option.partition(":")
+    if keyword.strip() != "flow":
+        raise ValueError(f"Unsupported rule option '{option}'.")
+
+    checks = []
+    for flag in value.split(","):
+        flag = flag.strip()
+        if flag == "established":
+            checks.append(lambda flows: flows.established)
+        elif flag == "not_established":
+            checks.append(lambda flows: ~flows.established)
+        elif flag not in ("to_server", "from_client"):
+            # Flows are always seen from the client's side.
+            raise ValueError(f"Unsupported flow option '{flag}'.")
+
+    def match(flows: Flows) -> np.ndarray:
+        matched = np.ones(len(flows), dtype=bool)
+        for check in checks:
+            matched &= check(flows)
+        return matched
+
+    return match
+
+
+def _sni_matcher(domain: str) -> Matcher:
+    '''Matches `TlsSniRule.domain`: a leading dot also matches subdomains.'''
+    def matches(sni: str) -> bool:
+        if domain.startswith("."):
+            return sni != "" and f".{sni}".endswith(domain)
+        return sni == domain
+
+    def match(flows: Flows) -> np.ndarray:
+        # There are far fewer distinct names than flows, so match each name
+        # once and look the results up by index:
+        return np.array([matches(name) for name in flows.server_names], dtype=bool)[flows.sni]
+
+    return match
+
+
+def _address_matcher(spec: str, variables: Mapping[str, str]) -> Callable[[np.ndarray], np.ndarray]:
+    '''Compiles a Suricata address, e.g. `any`, `$HOME_NET`, `!10.0.0.0/8` or
+    `[10.0.0.0/8, !10.1.0.0/16]`.'''
+    spec = spec.strip()
+    if spec == "any":
+        return lambda addresses: np.ones(len(addresses), dtype=bool)
+    if spec.startswith("!"):
+        inner = _address_matcher(spec[1:], variables)
+        return lambda addresses: ~inner(addresses)
+    if spec.startswith("$"):
+        if spec[1:] not in variables:
+            raise ValueError(f"Undefined rule variable '{spec}'.")
+        return _address_matcher(variables[spec[1:]], variables)
+    if spec.startswith("["):
+        included, excluded = [], []
+        for item in _split_list(spec):
+            if item.startswith("!"):
+                excluded.append(_address_matcher(item[1:], variables))
+            else:
+                included.append(_address_matcher(item, variables))
+
+        def match(addresses: np.ndarray) -> np.ndarray:
+            matched = np.zeros(len(addresses), dtype=bool)
+            for matcher in included:
+                matched |= matcher(addresses)
+            if excluded and not included:
+                matched[:] = True
+            for matcher in excluded:
+                matched &= ~matcher(addresses)
+            return matched
+
+        return match
+    return _cidr_matcher([spec])
+
+
+def _cidr_matcher(cidrs: Sequence[str]) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+    networks = list(ipaddress.collapse_addresses(ipaddress.ip_network(c) for c in cidrs))
+    if not networks:
+        return None
+    masks = [(np.uint32(int(n.netmask)), np.uint32(int(n.network_address))) for n in networks]
+
+    def match(addresses: np.ndarray) -> np.ndarray:
+        matched = np.zeros(len(addresses), dtype=bool)
+        for mask, network in masks:
+            matched |= (addresses & mask) == network
+        return matched
+
+    return match
+
+
+def _port_matcher(spec: str) -> Callable[[np.ndarray], np.ndarray]:
+    '''Compiles a Suricata port, e.g. `any`, `443`, `1024:`, `!22` or
+    `[80, 443]`.'''
+    spec = spec.strip()
+    if spec == "any":
+        return lambda ports: np.ones(len(ports), dtype=bool)
+    if spec.startswith("!"):
+        inner = _port_matcher(spec[1:])
+        return lambda ports: ~inner(ports)
+    if spec.startswith("["):
+        included = [_port_matcher(item) for item in _split_list(spec) if not item.startswith("!")]
+        excluded = [_port_matcher(item[1:]) for item in _split_list(spec) if item.startswith("!")]
+
+        def match(ports: np.ndarray) -> np.ndarray:
+            matched = np.zeros(len(ports), dtype=bool) if included else np.ones(len(ports), dtype=bool)
+            for matcher in included:
+                matched |= matcher(ports)
+            for matcher in excluded:
+                matched &= ~matcher(ports)
+            return matched
+
+        return match
+
+    start, colon, end = spec.partition(":")
+    low = int(start) if start else 0
+    high = (int(end) if end else 65535) if colon else low
+    return lambda ports: _in_ranges(ports, [(low, high)])
+
+
+def _in_ranges(values: np.ndarray, ranges: Sequence[tuple]) -> np.ndarray:
+    matched = np.zeros(len(values), dtype=bool)
+    for low, high in ranges:
+        matched |= (values >= low) & (values <= high)
+    return matched
+
+
+def _split_list(spec: str) -> List[str]:
+    '''Splits `[a, [b, c], d]` into its top-level items.'''
+    items, depth, current = [], 0, ""
+    for char in spec.strip()[1:-1]:
+        if char == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+            continue
+        depth += {"[": 1, "]": -1}.get(char, 0)
+        current += char
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+
+def _list_spec(cidrs: Sequence[str]) -> str:
+    return f"[{', '.join(cidrs)}]"
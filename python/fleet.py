@@ -0,0 +1,181 @@
+import dataclasses
+import ipaddress
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import pulumi
+import pulumi_aws as aws
+
+from cidr_allocator import CidrAllocator
+from flow_logs import FlowLogDestination
+from spoke import SpokeVpc, SpokeVpcArgs
+from probe import ProbeSettings
+from vpc_endpoints import DEFAULT_ENDPOINT_SERVICES
+from spoke_workload import SpokeWorkload, SpokeWorkloadArgs, get_amazon_linux_2_ami_id
+
+
+@dataclass
+class SpokeSpec:
+    name: str
+    # When not pinned here, the block is allocated from the supernet (see
+    # allocate_spoke_cidrs).
+    vpc_cidr_block: Optional[str] = None
+    prefix_length: Optional[int] = None
+    workload: bool = False
+
+    @staticmethod
+    def from_config(value: dict) -> "SpokeSpec":
+        return SpokeSpec(
+            name=value["name"],
+            vpc_cidr_block=value.get("cidr"),
+            prefix_length=value.get("prefix_length"),
+            workload=bool(value.get("workload", False)),
+        )
+
+
+@dataclass
+class SpokeFleetArgs:
+    tgw_id: pulumi.Input[str]
+    spoke_tgw_route_table_id: pulumi.Input[str]
+    hub_tgw_route_table_id: pulumi.Input[str]
+    availability_zone_names: Optional[Sequence[str]] = None
+    # Workloads run throughput probes when set; other spokes reach them from
+    # anywhere in the supernet.
+    probe: Optional[ProbeSettings] = None
+    supernet_cidr_block: Optional[str] = None
+    endpoint_services: Sequence[str] = field(default_factory=lambda: list(DEFAULT_ENDPOINT_SERVICES))
+    # Use the hub's endpoints through these zones instead of creating
+    # endpoints in every spoke:
+    endpoint_zone_ids: Optional[pulumi.Input[Dict[str, str]]] = None
+    flow_logs: Optional[FlowLogDestination] = None
+
+
+@dataclass
+class Spoke:
+    vpc: SpokeVpc
+    workload: Optional[SpokeWorkload]
+
+
+def load_spoke_specs(config: pulumi.Config) -> List[SpokeSpec]:
+    '''Reads the `spokes` list from stack config, e.g.:
+
+        spokes:
+          - name: spoke1
+            cidr: 10.0.0.0/16
+            workload: true
+          - name: spoke2
+            prefix_length: 20
+    '''
+    specs = [SpokeSpec.from_config(value)
+             for value in config.get_object("spokes") or []]
+
+    names = set()
+    for spec in specs:
+        if spec.name in names:
+            raise Exception(f"Spoke '{spec.name}' is defined more than once.")
+        names.add(spec.name)
+
+    return specs
+
+
+def reserve_spoke_cidrs(specs: Sequence[SpokeSpec], allocator: CidrAllocator) -> None:
+    '''Reserves the CIDRs pinned in config, failing on any overlap. Call this
+    before allocating anything else so that allocations can't take them.'''
+    for spec in specs:
+        if spec.vpc_cidr_block:
+            allocator.reserve(spec.name, spec.vpc_cidr_block)
+
+
+def allocate_spoke_cidrs(specs: Sequence[SpokeSpec], allocator: CidrAllocator, default_prefix_length: int,
+                         previous: Optional[Mapping[str, str]] = None) -> List[SpokeSpec]:
+    '''Returns `specs` with a CIDR allocated for every spoke that doesn't pin
+    one.
+
+    `previous` is the stack's last `spoke-cidrs` export (see
+    hub_reference.read_spoke_cidrs). Spokes in it keep their blocks: those
+    are reserved before anything new is placed. A new spoke's preferred
+    block is derived from its name, and it takes the next free one if
+    that's taken. Pin `cidr` in config to freeze a block outright.'''
+    previous = previous or {}
+    allocated = {}
+    for spec in specs:
+        prefix_length = spec.prefix_length or default_prefix_length
+        block = previous.get(spec.name)
+        # A changed prefix_length means a new block:
+        if not spec.vpc_cidr_block and block and ipaddress.ip_network(block).prefixlen == prefix_length:
+            allocated[spec.name] = str(allocator.reserve(spec.name, block))
+
+    for spec in sorted(specs, key=lambda spec: spec.name):
+        if not spec.vpc_cidr_block and spec.name not in allocated:
+            allocated[spec.name] = str(allocator.allocate_stable(
+                spec.name, spec.prefix_length or default_prefix_length))
+
+    return [
+        dataclasses.replace(spec, vpc_cidr_block=allocated[spec.name])
+        if spec.name in allocated else spec
+        for spec in specs
+    ]
+
+
+def create_spoke_fleet(specs: Sequence[SpokeSpec], args: SpokeFleetArgs) -> Dict[str, Spoke]:
+    '''Creates the VPC, the propagation into the hub TGW route table and
+    (optionally) the workload for each spoke in a single pass.
+
+    Nothing here waits on an Output, so every spoke's resources are
+    registered up front and the engine can create them all concurrently.
+    The AMI lookup is shared by every workload: a blocking invoke per
+    workload would make evaluation time grow quadratically with the fleet.'''
+    workloads = [spec for spec in specs if spec.workload]
+    ami_id = None
+    if workloads:
+        ami_id = get_amazon_linux_2_ami_id()
+
+    probe_count = 0
+    if args.probe:
+        probe_count = args.probe.instances * len(workloads)
+    probe_spokes = [spec.name for spec in workloads]
+
+    spokes = {}
+    for spec in specs:
+        vpc = SpokeVpc(
+            spec.name,
+            SpokeVpcArgs(
+                vpc_cidr_block=spec.vpc_cidr_block,
+                tgw_id=args.tgw_id,
+                tgw_route_table_id=args.spoke_tgw_route_table_id,
+                availability_zone_names=args.availability_zone_names,
+                endpoint_services=args.endpoint_services,
+                endpoint_zone_ids=args.endpoint_zone_ids,
+                flow_logs=args.flow_logs,
+            ),
+        )
+
+        aws.ec2transitgateway.RouteTablePropagation(
+            f"hub-to-{spec.name}",
+            aws.ec2transitgateway.RouteTablePropagationArgs(
+                transit_gateway_attachment_id=vpc.tgw_attachment.id,
+                transit_gateway_route_table_id=args.hub_tgw_route_table_id,
+            )
+        )
+
+        workload = None
+        if spec.workload:
+            workload = SpokeWorkload(
+                spec.name,
+                SpokeWorkloadArgs(
+                    spoke_instance_subnet_id=vpc.workload_subnet_ids[0],
+                    spoke_vpc_id=vpc.vpc.vpc_id,
+                    ami_id=ami_id,
+                    probe=args.probe,
+                    probe_subnet_ids=vpc.workload_subnet_ids,
+                    probe_availability_zone_count=vpc.availability_zone_count,
+                    probe_ingress_cidr_block=args.supernet_cidr_block,
+                    probe_group=f"{pulumi.get_project()}-{pulumi.get_stack()}",
+                    probe_count=probe_count,
+                    probe_spokes=probe_spokes,
+                )
+            )
+
+        spokes[spec.name] = Spoke(vpc=vpc, workload=workload)
+
+    return spokes
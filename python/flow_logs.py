@@ -0,0 +1,124 @@
+'''VPC flow logs for the hub and every spoke, delivered to S3 as Parquet.
+
+Set `vpc-flow-logs` in stack config to turn them on:
+
+    vpc-flow-logs:
+      bucket: my-flow-logs       # optional; a bucket is created if not set
+      prefix: vpc-flow-logs
+      traffic_type: ALL          # or ACCEPT, REJECT
+      aggregation_interval: 60   # seconds; 60 or 600
+      retention_days: 30         # for a created bucket
+
+The logs use Hive-compatible partitions, one per hour:
+
+    <prefix>/AWSLogs/aws-account-id=<account>/aws-service=vpcflowlogs/aws-region=<region>/year=<YYYY>/month=<MM>/day=<DD>/hour=<HH>/*.parquet
+
+and the fields in FLOW_LOG_FIELDS. Those include the AZ, flow direction
+and the packet's original addresses (`pkt-srcaddr`, `pkt-dstaddr`), which
+`flow_report.py` needs to count each flow once and attribute it to a spoke.'''
+from dataclasses import dataclass
+from typing import Optional
+
+import pulumi
+import pulumi_aws as aws
+
+TRAFFIC_TYPES = ("ALL", "ACCEPT", "REJECT")
+AGGREGATION_INTERVALS = (60, 600)
+
+FLOW_LOG_FIELDS = (
+    "version",
+    "account-id",
+    "vpc-id",
+    "subnet-id",
+    "interface-id",
+    "az-id",
+    "srcaddr",
+    "dstaddr",
+    "pkt-srcaddr",
+    "pkt-dstaddr",
+    "srcport",
+    "dstport",
+    "protocol",
+    "packets",
+    "bytes",
+    "start",
+    "end",
+    "action",
+    "log-status",
+    "flow-direction",
+    "traffic-path",
+)
+
+
+@dataclass
+class FlowLogSettings:
+    # An existing bucket to deliver to. One is created if not set.
+    bucket: Optional[str] = None
+    prefix: str = "vpc-flow-logs"
+    traffic_type: str = "ALL"
+    # The longest a record aggregates packets over, in seconds. A minute
+    # makes the throughput report's peaks closer to the real ones.
+    aggregation_interval: int = 60
+    # How long a created bucket keeps logs:
+    retention_days: int = 30
+
+    @staticmethod
+    def from_config(value: dict) -> "FlowLogSettings":
+        settings = FlowLogSettings(**value)
+        if settings.traffic_type not in TRAFFIC_TYPES:
+            raise Exception(
+                f"Unknown flow log traffic type '{settings.traffic_type}'. Expected one of: {', '.join(TRAFFIC_TYPES)}.")
+        if settings.aggregation_interval not in AGGREGATION_INTERVALS:
+            raise Exception(
+                f"Flow log aggregation interval must be one of: {', '.join(map(str, AGGREGATION_INTERVALS))}. "
+                f"Got {settings.aggregation_interval}.")
+        settings.prefix = settings.prefix.strip("/")
+        return settings
+
+
+def load_flow_log_settings(config: pulumi.Config) -> Optional[FlowLogSettings]:
+    '''Reads the `vpc-flow-logs` object from stack config. Returns None (no
+    flow logs) if it's not set.'''
+    value = config.get_object("vpc-flow-logs")
+    if value is None:
+        return None
+    return FlowLogSettings.from_config(value)
+
+
+@dataclass
+class FlowLogDestination:
+    '''Where every VPC's flow logs go: a bucket shared by the hub and the
+    spokes.'''
+    bucket_arn: pulumi.Input[str]
+    settings: FlowLogSettings
+
+    def create_flow_log(self, name: str, vpc_id: pulumi.Input[str],
+                        opts: pulumi.ResourceOptions = None) -> "aws.ec2.FlowLog":
+        return aws.ec2.FlowLog(
+            f"{name}-flow-log",
+            aws.ec2.FlowLogArgs(
+                vpc_id=vpc_id,
+                traffic_type=self.settings.traffic_type,
+                log_destination_type="s3",
+                log_destination=pulumi.Output.concat(self.bucket_arn, "/", self.settings.prefix, "/"),
+                log_format=" ".join(f"${{{field}}}" for field in FLOW_LOG_FIELDS),
+                max_aggregation_interval=self.settings.aggregation_interval,
+                destination_options=aws.ec2.FlowLogDestinationOptionsArgs(
+                    file_format="parquet",
+                    hive_compatible_partitions=True,
+                    per_hour_partition=True,
+                ),
+                tags={
+                    "Name": name,
+                },
+            ),
+            opts=opts,
+        )
+
+
+def flow_log_destination(bucket: pulumi.Input[str], settings: FlowLogSettings) -> FlowLogDestination:
+    '''The destination for the bucket named `bucket`.'''
+    return FlowLogDestination(
+        bucket_arn=pulumi.Output.from_input(bucket).apply(lambda name: f"arn:aws:s3:::{name}"),
+        settings=settings,
+    )
@@ -0,0 +1,446 @@
+'''Capacity-planning numbers from the VPC flow logs (see flow_logs.py):
+bytes, packets, flow durations and cross-AZ share per spoke and per path,
+and the peak throughput the NAT Gateway, firewall and Transit Gateway
+carried.
+
+    aws s3 sync s3://<flow-log-bucket>/vpc-flow-logs/ flow-logs/
+    pulumi stack output --json > outputs.json
+    python flow_report.py --stack-outputs outputs.json flow-logs/
+
+The stack outputs give the hub and spoke CIDR blocks (`hub-cidr`,
+`spoke-cidrs`) and VPC IDs (`vpc-ids`). Pass `--stack-outputs` once per
+stack for sharded stacks.
+
+A flow is logged by every interface it crosses: the instances at either
+end, the TGW attachments, and in the hub the firewall endpoint and the NAT
+Gateway, which logs its outside leg as its own traffic. So records are
+counted only in the spokes, where traffic starts or ends, which counts each
+flow once:
+
+- as an egress record from an address in the spoke that logged it, or
+- as an ingress record to an address in the spoke that logged it, from
+  outside every spoke (the hub or the internet).
+
+The hub's records only describe traffic in transit and aren't counted. A
+path is the pair of where a flow starts and ends: the hub, a spoke, or
+`internet` for anything else. Only accepted traffic is counted.
+
+Cross-AZ share is the share of bytes, between addresses whose AZ is known,
+that crossed AZs. An address's AZ is learned from the records it sends, in
+a first pass over the logs.
+
+Durations are those of the records (`end - start`), which are capped by the
+aggregation interval. Peak throughput is the most bytes started in one
+`--window`, so it can't resolve bursts shorter than the aggregation
+interval.
+
+The Parquet files are memory-mapped and read in batches of columns, and
+everything is computed with vectorized NumPy operations on the batches.
+Memory depends on the batch size and the number of spokes, not on the
+amount of log: durations are kept as per-second histograms, and throughput
+as bytes per window. Needs the packages in requirements-tools.txt.'''
+import argparse
+import ipaddress
+import json
+import socket
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+INTERNET = "internet"
+HUB = "hub"
+
+COLUMNS = ("vpc_id", "az_id", "pkt_srcaddr", "pkt_dstaddr", "packets", "bytes",
+           "start", "end", "action", "flow_direction")
+
+# Durations longer than this (in seconds) count as this long. Records are
+# at most 600s (the longest aggregation interval) plus some delivery skew.
+MAX_DURATION = 3600
+PERCENTILES = (50, 99)
+DEFAULT_BATCH_SIZE = 1 << 20
+
+
+@dataclass
+class Topology:
+    '''Where each address and VPC belongs: the hub, a spoke, or the internet
+    (the last group).'''
+    cidrs: Dict[str, str]
+    vpc_ids: Dict[str, str]
+
+    def __post_init__(self) -> None:
+        self.groups = sorted(self.cidrs) + [INTERNET]
+        blocks = sorted((ipaddress.ip_network(cidr), self.groups.index(name)) for name, cidr in self.cidrs.items())
+        self._starts = np.array([int(network.network_address) for network, _ in blocks], dtype=np.int64)
+        self._ends = np.array([int(network.broadcast_address) for network, _ in blocks], dtype=np.int64)
+        self._indexes = np.array([index for _, index in blocks], dtype=np.int64)
+        # Only the spokes' records are counted (see above):
+        self._vpc_groups = {vpc_id: self.groups.index(name) for name, vpc_id in self.vpc_ids.items()
+                            if name in self.cidrs and name != HUB}
+        self.spokes = np.array([name not in (HUB, INTERNET) for name in self.groups])
+
+    @property
+    def internet(self) -> int:
+        return len(self.groups) - 1
+
+    @staticmethod
+    def from_stack_outputs(outputs: Iterable[Mapping[str, Any]]) -> "Topology":
+        '''Merges the outputs of `pulumi stack output --json` of one or more
+        stacks.'''
+        cidrs: Dict[str, str] = {}
+        vpc_ids: Dict[str, str] = {}
+        for output in outputs:
+            if "hub-cidr" in output and HUB in output.get("vpc-ids", {}):
+                cidrs[HUB] = output["hub-cidr"]
+            cidrs.update(output.get("spoke-cidrs", {}))
+            vpc_ids.update(output.get("vpc-ids", {}))
+        return Topology(cidrs, vpc_ids)
+
+    def address_groups(self, addresses: np.ndarray) -> np.ndarray:
+        '''The group of each address, as an index into `groups`.'''
+        if not len(self._starts):
+            return np.full(len(addresses), self.internet, dtype=np.int64)
+        i = np.searchsorted(self._starts, addresses, side="right") - 1
+        inside = (i >= 0) & (addresses <= self._ends[np.maximum(i, 0)])
+        return np.where(inside, self._indexes[np.maximum(i, 0)], self.internet)
+
+    def vpc_groups(self, vpc_ids: Sequence[str]) -> np.ndarray:
+        '''The spoke each VPC is, or -1 if it isn't one.'''
+        return np.array([self._vpc_groups.get(vpc_id, -1) for vpc_id in vpc_ids], dtype=np.int64)
+
+
+def encode(column) -> Tuple[np.ndarray, List[str]]:
+    '''Dictionary-encodes a string column: the index of each row's value in
+    a list of the distinct values. Nulls become "". Takes a NumPy array or a
+    PyArrow array, which is encoded without converting its rows to Python.'''
+    if isinstance(column, np.ndarray):
+        values, indices = np.unique(column.astype(str), return_inverse=True)
+        return indices, values.tolist()
+    import pyarrow.compute as pc
+    encoded = pc.fill_null(column, "").dictionary_encode()
+    return encoded.indices.to_numpy(zero_copy_only=False), encoded.dictionary.to_pylist()
+
+
+def numbers(column) -> np.ndarray:
+    if isinstance(column, np.ndarray):
+        return column.astype(np.int64)
+    import pyarrow.compute as pc
+    return pc.fill_null(column, 0).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def ipv4_addresses(column) -> np.ndarray:
+    '''Parses a column of IPv4 addresses to integers, parsing each distinct
+    address once. Anything else (e.g. IPv6 or "-") becomes -1.'''
+    indices, values = encode(column)
+    return _parse_addresses(values)[indices]
+
+
+def _parse_addresses(values: Sequence[str]) -> np.ndarray:
+    parsed = np.full(len(values), -1, dtype=np.int64)
+    for i, value in enumerate(values):
+        try:
+            parsed[i] = int.from_bytes(socket.inet_aton(value), "big")
+        except (OSError, TypeError):
+            pass
+    return parsed
+
+
+@dataclass
+class AddressZones:
+    '''The AZ of each address that sent traffic: sorted addresses and the
+    index of their AZ in `names`.'''
+    addresses: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    zones: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    names: List[str] = field(default_factory=list)
+
+    def add(self, addresses: np.ndarray, zone_indices: np.ndarray, zone_names: Sequence[str]) -> None:
+        zones = _remap(zone_indices, zone_names, self.names)
+        addresses = np.concatenate([self.addresses, addresses])
+        zones = np.concatenate([self.zones, zones])
+        # Keep one AZ per address, the last seen:
+        order = np.argsort(addresses, kind="stable")[::-1]
+        self.addresses, first = np.unique(addresses[order], return_index=True)
+        self.zones = zones[order][first]
+
+    def lookup(self, addresses: np.ndarray) -> np.ndarray:
+        '''The AZ index of each address, or -1 if unknown.'''
+        if not len(self.addresses):
+            return np.full(len(addresses), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.addresses, addresses), len(self.addresses) - 1)
+        return np.where(self.addresses[i] == addresses, self.zones[i], -1)
+
+
+def _remap(indices: np.ndarray, values: Sequence[str], names: List[str]) -> np.ndarray:
+    '''Maps indices into `values` to indices into `names`, adding the values
+    `names` doesn't have yet.'''
+    mapping = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        if value not in names:
+            names.append(value)
+        mapping[i] = names.index(value)
+    return mapping[indices] if len(values) else indices.astype(np.int64)
+
+
+@dataclass
+class Batch:
+    '''The columns of one batch of records that the report needs, decoded.'''
+    vpc_groups: np.ndarray
+    source_groups: np.ndarray
+    destination_groups: np.ndarray
+    sources: np.ndarray
+    destinations: np.ndarray
+    zone_indices: np.ndarray
+    zone_names: List[str]
+    packets: np.ndarray
+    bytes: np.ndarray
+    starts: np.ndarray
+    durations: np.ndarray
+    # Each record is counted where the traffic starts (an egress record in
+    # the source's spoke) or where it ends (an ingress record in the
+    # destination's spoke, from outside every spoke):
+    sent: np.ndarray
+    counted: np.ndarray
+
+    @staticmethod
+    def decode(columns: Mapping[str, Any], topology: Topology) -> "Batch":
+        vpc_indices, vpc_ids = encode(columns["vpc_id"])
+        vpc_groups = topology.vpc_groups(vpc_ids)[vpc_indices] if vpc_ids else np.zeros(0, dtype=np.int64)
+        sources = ipv4_addresses(columns["pkt_srcaddr"])
+        destinations = ipv4_addresses(columns["pkt_dstaddr"])
+        source_groups = topology.address_groups(sources)
+        destination_groups = topology.address_groups(destinations)
+
+        direction_indices, directions = encode(columns["flow_direction"])
+        egress = _equals(direction_indices, directions, "egress")
+        ingress = _equals(direction_indices, directions, "ingress")
+        action_indices, actions = encode(columns["action"])
+        accepted = _equals(action_indices, actions, "ACCEPT")
+
+        sent = accepted & egress & (vpc_groups >= 0) & (source_groups == vpc_groups)
+        received = (accepted & ingress & (vpc_groups >= 0) & (destination_groups == vpc_groups)
+                    & ~topology.spokes[source_groups])
+
+        zone_indices, zone_names = encode(columns["az_id"])
+        starts = numbers(columns["start"])
+        return Batch(
+            vpc_groups=vpc_groups,
+            source_groups=source_groups,
+            destination_groups=destination_groups,
+            sources=sources,
+            destinations=destinations,
+            zone_indices=zone_indices,
+            zone_names=zone_names,
+            packets=numbers(columns["packets"]),
+            bytes=numbers(columns["bytes"]),
+            starts=starts,
+            durations=np.clip(numbers(columns["end"]) - starts, 0, MAX_DURATION),
+            sent=sent,
+            counted=sent | received,
+        )
+
+
+def _equals(indices: np.ndarray, values: Sequence[str], value: str) -> np.ndarray:
+    if value not in values:
+        return np.zeros(len(indices), dtype=bool)
+    return indices == values.index(value)
+
+
+class FlowReport:
+    '''Accumulates the report one batch of records at a time. Call
+    `learn_zones` with every batch, then `add` with every batch.'''
+
+    def __init__(self, topology: Topology, window: int = 60) -> None:
+        self.topology = topology
+        self.window = window
+        self.zones = AddressZones()
+        groups = len(topology.groups)
+        self._paths = groups * groups
+        self.path_bytes = np.zeros(self._paths, dtype=np.int64)
+        self.path_packets = np.zeros(self._paths, dtype=np.int64)
+        self.path_records = np.zeros(self._paths, dtype=np.int64)
+        # Bytes between addresses whose AZs are known, and those of them
+        # that crossed AZs:
+        self.path_zoned_bytes = np.zeros(self._paths, dtype=np.int64)
+        self.path_cross_zone_bytes = np.zeros(self._paths, dtype=np.int64)
+        self.durations = np.zeros((groups, MAX_DURATION + 1), dtype=np.int64)
+        # Bytes started in each window, by window start, for traffic to or
+        # from the internet and for traffic between VPCs:
+        self.internet_windows: Dict[int, int] = {}
+        self.transit_windows: Dict[int, int] = {}
+
+    def learn_zones(self, batch: Batch) -> None:
+        self.zones.add(batch.sources[batch.sent], batch.zone_indices[batch.sent], batch.zone_names)
+
+    def add(self, batch: Batch) -> None:
+        counted = batch.counted
+        sources, destinations = batch.source_groups[counted], batch.destination_groups[counted]
+        paths = sources * len(self.topology.groups) + destinations
+        size = batch.bytes[counted]
+
+        self.path_bytes += np.bincount(paths, weights=size, minlength=self._paths).astype(np.int64)
+        self.path_packets += np.bincount(paths, weights=batch.packets[counted], minlength=self._paths).astype(np.int64)
+        self.path_records += np.bincount(paths, minlength=self._paths)
+
+        source_zones = self.zones.lookup(batch.sources[counted])
+        destination_zones = self.zones.lookup(batch.destinations[counted])
+        zoned = (source_zones >= 0) & (destination_zones >= 0)
+        crossed = zoned & (source_zones != destination_zones)
+        self.path_zoned_bytes += np.bincount(paths[zoned], weights=size[zoned], minlength=self._paths).astype(np.int64)
+        self.path_cross_zone_bytes += np.bincount(
+            paths[crossed], weights=size[crossed], minlength=self._paths).astype(np.int64)
+
+        # Durations by the spoke that logged the record:
+        np.add.at(self.durations, (batch.vpc_groups[counted], batch.durations[counted]), 1)
+
+        internet = self.topology.internet
+        windows = batch.starts[counted] // self.window * self.window
+        to_internet = (sources == internet) | (destinations == internet)
+        _add_windows(self.internet_windows, windows[to_internet], size[to_internet])
+        _add_windows(self.transit_windows, windows[sources != destinations], size[sources != destinations])
+
+    def to_dict(self) -> Dict[str, Any]:
+        groups = self.topology.groups
+        count = len(groups)
+        paths = []
+        for path in np.flatnonzero(self.path_records):
+            paths.append({
+                "source": groups[path // count],
+                "destination": groups[path % count],
+                "bytes": int(self.path_bytes[path]),
+                "packets": int(self.path_packets[path]),
+                "records": int(self.path_records[path]),
+                "cross_az_share": _share(self.path_cross_zone_bytes[path], self.path_zoned_bytes[path]),
+            })
+        paths.sort(key=lambda row: -row["bytes"])
+
+        by_path = lambda array: array.reshape(count, count)  # noqa: E731
+        sent = by_path(self.path_bytes).sum(axis=1)
+        received = by_path(self.path_bytes).sum(axis=0)
+        packets = by_path(self.path_packets).sum(axis=1) + by_path(self.path_packets).sum(axis=0)
+        cross = by_path(self.path_cross_zone_bytes).sum(axis=1) + by_path(self.path_cross_zone_bytes).sum(axis=0)
+        zoned = by_path(self.path_zoned_bytes).sum(axis=1) + by_path(self.path_zoned_bytes).sum(axis=0)
+        percentiles = _histogram_percentiles(self.durations, PERCENTILES)
+        vpcs = {
+            group: {
+                "bytes_sent": int(sent[i]),
+                "bytes_received": int(received[i]),
+                "packets": int(packets[i]),
+                **{f"p{q}_duration": int(percentiles[i, j]) for j, q in enumerate(PERCENTILES)},
+                "cross_az_share": _share(cross[i], zoned[i]),
+            }
+            for i, group in enumerate(groups[:-1])
+        }
+
+        return {
+            "window": self.window,
+            "vpcs": vpcs,
+            "paths": paths,
+            "capacity": {
+                "internet": _peaks(self.internet_windows, self.window),
+                "transit_gateway": _peaks(self.transit_windows, self.window),
+            },
+        }
+
+
+def _add_windows(totals: Dict[int, int], windows: np.ndarray, size: np.ndarray) -> None:
+    keys, indices = np.unique(windows, return_inverse=True)
+    for key, total in zip(keys.tolist(), np.bincount(indices, weights=size).tolist()):
+        totals[key] = totals.get(key, 0) + int(total)
+
+
+def _histogram_percentiles(histograms: np.ndarray, percentiles: Sequence[int]) -> np.ndarray:
+    '''The percentiles of each row of per-value counts (nearest rank).'''
+    cumulative = np.cumsum(histograms, axis=1)
+    totals = cumulative[:, -1:]
+    result = np.zeros((len(histograms), len(percentiles)), dtype=np.int64)
+    for j, q in enumerate(percentiles):
+        rank = np.maximum(np.ceil(totals * q / 100), 1)
+        result[:, j] = np.where(totals[:, 0] > 0, (cumulative < rank).sum(axis=1), 0)
+    return result
+
+
+def _share(part: int, whole: int) -> float:
+    return round(float(part) / float(whole), 4) if whole else 0.0
+
+
+def _peaks(windows: Mapping[int, int], window: int) -> Dict[str, float]:
+    '''Peak and 99th percentile throughput over windows, in Gbit/s.'''
+    if not windows:
+        return {"peak_gbps": 0.0, "p99_gbps": 0.0, "windows": 0}
+    rates = np.array(list(windows.values()), dtype=np.float64) * 8 / window / 1e9
+    return {
+        "peak_gbps": round(float(rates.max()), 3),
+        "p99_gbps": round(float(np.percentile(rates, 99)), 3),
+        "windows": len(rates),
+    }
+
+
+def read_batches(path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Mapping[str, Any]]:
+    '''Streams the columns the report needs from the Parquet files under
+    `path`, memory-mapped, a batch of rows at a time.'''
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive",
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+    for batch in dataset.to_batches(columns=list(COLUMNS), batch_size=batch_size):
+        yield {name: batch.column(name) for name in COLUMNS}
+
+
+def flow_report(path: str, topology: Topology, window: int = 60,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> FlowReport:
+    '''Reads the logs under `path` twice: once to learn each address's AZ,
+    then to count.'''
+    report = FlowReport(topology, window)
+    for columns in read_batches(path, batch_size):
+        report.learn_zones(Batch.decode(columns, topology))
+    for columns in read_batches(path, batch_size):
+        report.add(Batch.decode(columns, topology))
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{'vpc':<20} {'sent':>14} {'received':>14} {'packets':>12} "
+             f"{'p50 s':>6} {'p99 s':>6} {'cross-AZ':>9}"]
+    for name, row in report["vpcs"].items():
+        lines.append(f"{name:<20} {row['bytes_sent']:>14} {row['bytes_received']:>14} {row['packets']:>12} "
+                     f"{row['p50_duration']:>6} {row['p99_duration']:>6} {row['cross_az_share']:>9.1%}")
+    lines.append("")
+    lines.append(f"{'source':<20} {'destination':<20} {'bytes':>14} {'packets':>12} {'cross-AZ':>9}")
+    for row in report["paths"]:
+        lines.append(f"{row['source']:<20} {row['destination']:<20} {row['bytes']:>14} "
+                     f"{row['packets']:>12} {row['cross_az_share']:>9.1%}")
+    lines.append("")
+    lines.append(f"throughput over {report['window']}s windows (Gbit/s):")
+    for name, label in (("internet", "NAT Gateway / firewall (internet)"), ("transit_gateway", "Transit Gateway")):
+        peaks = report["capacity"][name]
+        lines.append(f"  {label:<34} peak {peaks['peak_gbps']:>8.3f}  p99 {peaks['p99_gbps']:>8.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Directory of Parquet flow logs (e.g. synced from the flow log bucket).")
+    parser.add_argument("--stack-outputs", action="append", required=True,
+                        help="`pulumi stack output --json` of a stack. Repeat for sharded stacks.")
+    parser.add_argument("--window", type=int, default=60, help="Seconds per throughput window (default: 60).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    outputs = []
+    for path in args.stack_outputs:
+        with open(path) as f:
+            outputs.append(json.load(f))
+    report = flow_report(args.path, Topology.from_stack_outputs(outputs), args.window, args.batch_size).to_dict()
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 from dataclasses import dataclass
-from typing import Sequence
+from typing import Dict, Optional, Sequence
 
 import pulumi
 import pulumi_aws as aws
 import pulumi_awsx as awsx
 
-from pprint import pprint
+from availability_zones import get_availability_zone_names
+from cidr_allocator import hub_subnet_cidr_blocks, inspection_cidr_blocks
+from firewall_logging import FirewallLogSettings
+from flow_logs import FlowLogDestination
+from log_bucket import create_log_bucket
+from profiling import profiled
+from vpc_endpoints import private_dns_name, service_name
+from vpc_subnets import at_index, route_table_ids, subnet_ids_by_name
 
 
 @dataclass
@@ -16,9 +23,39 @@ class HubVpcArgs:
     spoke_tgw_route_table_id: pulumi.Input[str]
     hub_tgw_route_table_id: pulumi.Input[str]
     firewall_policy_arn: pulumi.Input[str]
+    availability_zone_count: int = 3
+    # Looked up (the first availability_zone_count available AZs) if not
+    # supplied. Pass the same names to the spokes so their TGW attachments
+    # land in the AZs that have a firewall endpoint.
+    availability_zone_names: Optional[Sequence[str]] = None
+    # Carved out of vpc_cidr_block around the awsx subnets if not supplied:
+    inspection_cidr_blocks: Optional[Sequence[str]] = None
+    # "direct" sends traffic between the TGW and the NAT Gateway directly;
+    # "firewall" sends it through the firewall endpoint in the same AZ.
+    routing_mode: str = "direct"
+    # "single" shares one NAT Gateway between all AZs; "one-per-az" keeps
+    # egress in the AZ it came from.
+    nat_gateway_strategy: str = "single"
+    # Interface endpoints to host in the hub for every spoke (see
+    # vpc_endpoints.py). None creates no endpoints.
+    endpoint_services: Optional[Sequence[str]] = None
+    # Carved out of vpc_cidr_block after the inspection subnets if not
+    # supplied:
+    endpoint_cidr_blocks: Optional[Sequence[str]] = None
+    # Deliver the firewall's alert and flow logs to S3 (see
+    # firewall_logging.py). No logging if not supplied.
+    firewall_logs: Optional[FirewallLogSettings] = None
+    # Log the VPC's flows to S3 (see flow_logs.py). No flow log if not
+    # supplied.
+    flow_logs: Optional[FlowLogDestination] = None
+
+
+ROUTING_MODES = ("direct", "firewall")
+NAT_GATEWAY_STRATEGIES = ("single", "one-per-az")
 
 
 class HubVpc(pulumi.ComponentResource):
+    @profiled("HubVpc")
     def __init__(self, name: str, args: HubVpcArgs, opts: pulumi.ResourceOptions = None) -> None:
         super().__init__("awsAdvancedNetworkingWorkshop:index:HubVpc", name, None, opts)
 
@@ -26,6 +63,19 @@ class HubVpc(pulumi.ComponentResource):
         self.name = name
         self.args = args
 
+        if args.routing_mode not in ROUTING_MODES:
+            raise Exception(
+                f"Unknown routing mode '{args.routing_mode}'. Expected one of: {', '.join(ROUTING_MODES)}.")
+        if args.nat_gateway_strategy not in NAT_GATEWAY_STRATEGIES:
+            raise Exception(
+                f"Unknown NAT Gateway strategy '{args.nat_gateway_strategy}'. Expected one of: {', '.join(NAT_GATEWAY_STRATEGIES)}.")
+
+        # Everything per-AZ in the hub (subnets, firewall endpoints, NAT
+        # Gateways and routes) is laid out from this one list, so it all
+        # lines up however many AZs there are:
+        self.availability_zones = list(
+            args.availability_zone_names or get_availability_zone_names(args.availability_zone_count))
+
         self.vpc = awsx.ec2.Vpc(
             f"{name}-vpc",
             awsx.ec2.VpcArgs(
@@ -49,7 +99,10 @@ class HubVpc(pulumi.ComponentResource):
                 # https://github.com/pulumi/pulumi-awsx/issues/966 is resolved.
                 nat_gateways=awsx.ec2.NatGatewayConfigurationArgs(
                     strategy=awsx.ec2.NatGatewayStrategy.NONE
-                )
+                ),
+                # We need to know the AZs up front so we can register one
+                # route per AZ without waiting on the subnets:
+                availability_zone_names=self.availability_zones,
             ),
             opts=pulumi.ResourceOptions(
                 *(opts or {}),
@@ -57,26 +110,21 @@ class HubVpc(pulumi.ComponentResource):
             ),
         )
 
-        self.eip = aws.ec2.Eip(
-            f"{name}-eip",
-            opts=pulumi.ResourceOptions(
-                parent=self,
-            ),
-        )
+        self.public_subnet_ids = subnet_ids_by_name(
+            self.vpc, f"{name}-vpc", "public")
+        self.tgw_subnet_ids = subnet_ids_by_name(
+            self.vpc, f"{name}-vpc", "tgw")
 
-        self.nat_gateway = aws.ec2.NatGateway(
-            f"{name}-nat-gateway",
-            aws.ec2.NatGatewayArgs(
-                subnet_id=self.vpc.public_subnet_ids[0],
-                allocation_id=self.eip.allocation_id,
-                tags={
-                    "Name": f"{name}-nat-gateway",
-                }
-            ),
-            pulumi.ResourceOptions(
-                parent=self
+        if args.flow_logs:
+            args.flow_logs.create_flow_log(
+                name,
+                self.vpc.vpc_id,
+                opts=pulumi.ResourceOptions(
+                    parent=self,
+                ),
             )
-        )
+
+        self.create_nat_gateways()
 
         self.tgw_attachment = aws.ec2transitgateway.VpcAttachment(
             f"{name}-tgw-vpc-attachment",
@@ -128,22 +176,20 @@ class HubVpc(pulumi.ComponentResource):
         # are not using AWS Firewall.
         self.create_firewall()
 
-        # NOTE: To route traffic through the firewall, uncomment the call to
-        # create_firewall_routes. To route traffic directly from the TGW to the
-        # NAT Gateway, uncomment the call to create_direct_nat_routes. You may
-        # need to run `pulumi up` with both routes commented to switch between
-        # routing traffic directly/through the firewall because there is an
-        # identical route that cannot be defined twice.
+        # Set `routing-mode` in config to switch between routing traffic
+        # directly and through the firewall. Both modes register the same
+        # routes and differ only in their targets, so a switch is an in-place
+        # update of each route that converges in a single `pulumi up`.
+        self.create_routes()
 
-        # pulumi.Output.all(self.firewall.firewall_statuses,
-        #                   self.vpc.public_subnet_ids, self.vpc.isolated_subnet_ids).apply(lambda args: self.create_firewall_routes(args[0], args[1], args[2]))
-
-        pulumi.Output.all(self.vpc.public_subnet_ids,
-                          self.vpc.isolated_subnet_ids).apply(lambda args: self.create_direct_nat_routes(args[0], args[1]))
+        # The private hosted zone for each centralized endpoint, by service:
+        self.endpoint_zone_ids: Optional[pulumi.Output[Dict[str, str]]] = None
+        if args.endpoint_services:
+            self.create_endpoints()
 
         self.register_outputs({
             "vpc": self.vpc,
-            "eip": self.eip,
+            "eips": self.eips,
             # TODO: Check whether this is being returned before it's actually
             # provisioned and is causing an issue downstream if we try to spin
             # this stack all up at once.
@@ -151,46 +197,285 @@ class HubVpc(pulumi.ComponentResource):
             "tgw_attachment": self.tgw_attachment,
         })
 
-    def create_direct_nat_routes(self, public_subnet_ids: Sequence[str], isolated_subnet_ids: Sequence[str]):
-        # Create routes for the supernet (a CIDR block that encompasses all
-        # spoke VPCs) from the public subnets in the hub VPC (where the NAT
-        # Gateways for centralized egress live) to the TGW.
-        for subnet_id in public_subnet_ids:
-            route_table = aws.ec2.get_route_table(
-                subnet_id=subnet_id
+    def create_nat_gateways(self):
+        # With one NAT Gateway per AZ, each AZ's egress leaves (and its
+        # replies return) through its own AZ, avoiding inter-AZ data charges
+        # and keeping traffic symmetric through the firewall. The first
+        # gateway keeps the names of the original single NAT Gateway.
+        count = 1
+        if self.args.nat_gateway_strategy == "one-per-az":
+            count = len(self.availability_zones)
+
+        self.eips = []
+        self.nat_gateways = []
+        for i in range(count):
+            suffix = "" if i == 0 else f"-{i+1}"
+
+            eip = aws.ec2.Eip(
+                f"{self.name}-eip{suffix}",
+                opts=pulumi.ResourceOptions(
+                    parent=self,
+                ),
+            )
+
+            nat_gateway = aws.ec2.NatGateway(
+                f"{self.name}-nat-gateway{suffix}",
+                aws.ec2.NatGatewayArgs(
+                    subnet_id=self.vpc.public_subnet_ids[i],
+                    allocation_id=eip.allocation_id,
+                    tags={
+                        "Name": f"{self.name}-nat-gateway{suffix}",
+                    }
+                ),
+                pulumi.ResourceOptions(
+                    parent=self
+                )
             )
 
+            self.eips.append(eip)
+            self.nat_gateways.append(nat_gateway)
+
+        # Kept for callers that expect a single NAT Gateway:
+        self.eip = self.eips[0]
+        self.nat_gateway = self.nat_gateways[0]
+
+    def nat_gateway_id(self, az_index: int) -> pulumi.Output[str]:
+        '''The NAT Gateway that egress from the AZ at `az_index` leaves
+        through.'''
+        return self.nat_gateways[az_index % len(self.nat_gateways)].id
+
+    def create_routes(self):
+        # Route table IDs come from the route table associations awsx creates
+        # for each subnet, so we can register every route up front (and see
+        # them all in `pulumi preview`) without looking anything up in AWS.
+        # Routes are keyed by AZ index rather than subnet ID for the same
+        # reason.
+        public_route_table_ids = route_table_ids(
+            self.vpc, self.public_subnet_ids)
+        tgw_route_table_ids = route_table_ids(self.vpc, self.tgw_subnet_ids)
+
+        endpoint_ids = None
+        if self.args.routing_mode == "firewall":
+            endpoint_ids = self.firewall_endpoint_ids()
+
+        for i, zone in enumerate(self.availability_zones):
+
+            # Create routes for the supernet (a CIDR block that encompasses all
+            # spoke VPCs) from the public subnets in the hub VPC (where the NAT
+            # Gateways for centralized egress live) to the TGW, or to the
+            # firewall for incoming packets.
+            inbound = {"transit_gateway_id": self.args.tgw_id}
+            if endpoint_ids is not None:
+                inbound = {"vpc_endpoint_id": endpoint_ids.apply(lambda ids, zone=zone: ids[zone])}
+
             aws.ec2.Route(
-                f"{self.name}-route-{subnet_id}-to-tgw",
+                f"{self.name}-public-{i+1}-supernet",
                 aws.ec2.RouteArgs(
-                    route_table_id=route_table.id,
+                    route_table_id=at_index(public_route_table_ids, i),
                     destination_cidr_block=self.args.supernet_cidr_block,
-                    transit_gateway_id=self.args.tgw_id,
+                    **inbound,
                 ),
                 pulumi.ResourceOptions(
                     depends_on=[self.tgw_attachment],
                     parent=self,
+                    aliases=[pulumi.Alias(name=f"{self.name}-public-{i+1}-supernet-to-tgw")],
                 ),
             )
 
-        # Create routes from the TGW subnet to the NAT Gateway.
-        for subnet_id in isolated_subnet_ids:
-            route_table = aws.ec2.get_route_table(
-                subnet_id=subnet_id
-            )
+            # Create routes from the TGW subnet to the NAT Gateway, or to the
+            # firewall for outgoing packets.
+            outbound = {"nat_gateway_id": self.nat_gateway_id(i)}
+            if endpoint_ids is not None:
+                outbound = {"vpc_endpoint_id": endpoint_ids.apply(lambda ids, zone=zone: ids[zone])}
 
             aws.ec2.Route(
-                f"{self.name}-route-{subnet_id}-to-tgw",
+                f"{self.name}-tgw-{i+1}-default",
                 aws.ec2.RouteArgs(
-                    route_table_id=route_table.id,
+                    route_table_id=at_index(tgw_route_table_ids, i),
                     destination_cidr_block="0.0.0.0/0",
-                    nat_gateway_id=self.nat_gateway.id,
+                    **outbound,
                 ),
                 pulumi.ResourceOptions(
                     parent=self,
+                    aliases=[pulumi.Alias(name=f"{self.name}-tgw-{i+1}-default-to-nat")],
+                ),
+            )
+
+    def create_endpoints(self):
+        '''Creates the interface endpoints the spokes share, in subnets of
+        their own, with a private hosted zone per service that the spokes
+        associate with.
+
+        Spokes reach the endpoints over the TGW: traffic for the hub's CIDR
+        is delivered by the TGW subnets' local route, and the endpoint
+        subnets route replies for the supernet straight back to the TGW. So
+        (as with per-spoke endpoints) it doesn't go through the firewall.'''
+        cidr_blocks = self.args.endpoint_cidr_blocks or hub_subnet_cidr_blocks(
+            self.args.vpc_cidr_block, len(self.availability_zones), ["inspection", "endpoints"])["endpoints"]
+
+        subnet_ids = []
+        for i, (zone, cidr_block) in enumerate(zip(self.availability_zones, cidr_blocks)):
+            resource_name = f"{self.name}-endpoints-{i+1}"
+            subnet = aws.ec2.Subnet(
+                resource_name,
+                aws.ec2.SubnetArgs(
+                    vpc_id=self.vpc.vpc_id,
+                    availability_zone=zone,
+                    cidr_block=cidr_block,
+                    tags={
+                        "Name": resource_name
+                    }
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=self,
+                    delete_before_replace=True,
+                ),
+            )
+            subnet_ids.append(subnet.id)
+
+            route_table = aws.ec2.RouteTable(
+                resource_name,
+                aws.ec2.RouteTableArgs(
+                    vpc_id=self.vpc.vpc_id,
+                    tags={
+                        "Name": resource_name,
+                    }
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=subnet,
+                ),
+            )
+
+            aws.ec2.RouteTableAssociation(
+                resource_name,
+                aws.ec2.RouteTableAssociationArgs(
+                    route_table_id=route_table.id,
+                    subnet_id=subnet.id
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=subnet,
+                ),
+            )
+
+            aws.ec2.Route(
+                f"{self.name}-endpoints-supernet-to-tgw-{i+1}",
+                aws.ec2.RouteArgs(
+                    route_table_id=route_table.id,
+                    destination_cidr_block=self.args.supernet_cidr_block,
+                    transit_gateway_id=self.args.tgw_id
+                ),
+                opts=pulumi.ResourceOptions(
+                    depends_on=[self.tgw_attachment],
+                    parent=route_table,
+                ),
+            )
+
+        security_group = aws.ec2.SecurityGroup(
+            f"{self.name}-endpoint-sg",
+            aws.ec2.SecurityGroupArgs(
+                vpc_id=self.vpc.vpc_id,
+                description="HTTPS to the shared VPC endpoints from the spokes",
+                ingress=[
+                    aws.ec2.SecurityGroupIngressArgs(
+                        cidr_blocks=[self.args.supernet_cidr_block],
+                        description="HTTPS from the hub and spokes",
+                        protocol="tcp",
+                        from_port=443,
+                        to_port=443,
+                    ),
+                ],
+            ),
+            opts=pulumi.ResourceOptions(
+                parent=self,
+            ),
+        )
+
+        zone_ids = {}
+        for service in self.args.endpoint_services:
+            endpoint = aws.ec2.VpcEndpoint(
+                f"{self.name}-endpoint-{service}",
+                aws.ec2.VpcEndpointArgs(
+                    vpc_id=self.vpc.vpc_id,
+                    service_name=service_name(service, aws.config.region),
+                    # The zone below takes the place of the endpoint's own
+                    # private DNS, which only the hub VPC could resolve:
+                    private_dns_enabled=False,
+                    security_group_ids=[security_group.id],
+                    vpc_endpoint_type="Interface",
+                    subnet_ids=subnet_ids,
+                    tags={
+                        "Name": f"{self.name}-{service}"
+                    },
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=self,
+                ),
+            )
+
+            dns_name = private_dns_name(service, aws.config.region)
+            zone = aws.route53.Zone(
+                f"{self.name}-endpoint-{service}",
+                aws.route53.ZoneArgs(
+                    name=dns_name,
+                    comment=f"Resolves {service} to the hub's VPC endpoint",
+                    vpcs=[aws.route53.ZoneVpcArgs(vpc_id=self.vpc.vpc_id)],
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=endpoint,
+                    # Spokes add themselves with ZoneAssociations, which
+                    # would otherwise show up as drift here:
+                    ignore_changes=["vpcs"],
+                ),
+            )
+
+            # The endpoint's first DNS entry is its regional name, which
+            # resolves to its network interface in every AZ:
+            dns_entry = endpoint.dns_entries.apply(lambda entries: entries[0])
+            aws.route53.Record(
+                f"{self.name}-endpoint-{service}",
+                aws.route53.RecordArgs(
+                    zone_id=zone.zone_id,
+                    name=dns_name,
+                    type="A",
+                    aliases=[aws.route53.RecordAliasArgs(
+                        name=dns_entry.dns_name,
+                        zone_id=dns_entry.hosted_zone_id,
+                        evaluate_target_health=True,
+                    )],
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=zone,
                 ),
             )
 
+            zone_ids[service] = zone.zone_id
+
+        self.endpoint_zone_ids = pulumi.Output.all(**zone_ids)
+
+    def firewall_endpoint_ids(self) -> pulumi.Output[Dict[str, str]]:
+        '''Returns the firewall's endpoint ID in each AZ, keyed by AZ name.
+
+        The index is built once from the firewall's sync states, so each
+        route looks up its endpoint directly instead of scanning the
+        attachments (or calling get_subnet to find out which AZ a subnet is
+        in).'''
+        def index(statuses) -> Dict[str, str]:
+            endpoint_ids = {}
+            for sync_state in statuses[0].sync_states:
+                attachments = sync_state.attachments or []
+                if len(attachments) != 1:
+                    raise Exception(
+                        f"Expected exactly 1 firewall subnet attachment for AZ '{sync_state.availability_zone}'. Found {len(attachments)} instead.")
+                endpoint_ids[sync_state.availability_zone] = attachments[0].endpoint_id
+
+            missing = [zone for zone in self.availability_zones if zone not in endpoint_ids]
+            if missing:
+                raise Exception(
+                    f"The firewall has no endpoint in {', '.join(missing)}.")
+            return endpoint_ids
+
+        return self.firewall.firewall_statuses.apply(index)
+
     # def create_nat_routes(self, subnet_ids: Sequence[str], nat_gateway_id: pulumi.Output[str]):
     #     '''Creates routes from the supplied subnet IDs to the NAT Gateway'''
     #     for subnet_id in subnet_ids:
@@ -233,11 +518,11 @@ class HubVpc(pulumi.ComponentResource):
     #         )
 
     def create_firewall(self):
-        region = aws.config.region
+        cidr_blocks = self.args.inspection_cidr_blocks or inspection_cidr_blocks(
+            self.args.vpc_cidr_block, len(self.availability_zones))
         inspection_subnets = [
-            {"az": f"{region}a", "cidr": "10.129.0.32/28"},
-            {"az": f"{region}b", "cidr": "10.129.0.96/28"},
-            {"az": f"{region}c", "cidr": "10.129.0.160/28"},
+            {"az": zone, "cidr": cidr}
+            for zone, cidr in zip(self.availability_zones, cidr_blocks)
         ]
         subnet_ids = []
         for i, inspection_subnet in enumerate(inspection_subnets):
@@ -302,7 +587,7 @@ class HubVpc(pulumi.ComponentResource):
                 aws.ec2.RouteArgs(
                     route_table_id=route_table.id,
                     destination_cidr_block="0.0.0.0/0",
-                    nat_gateway_id=self.nat_gateway.id
+                    nat_gateway_id=self.nat_gateway_id(i)
                 ),
                 opts=pulumi.ResourceOptions(
                     parent=route_table,
@@ -324,66 +609,45 @@ class HubVpc(pulumi.ComponentResource):
             ),
         )
 
-    def create_firewall_routes(self, statuses, public_subnet_ids, tgw_subnet_ids):
-        # Map the output of the Firewall attachments to a structure more
-        # suitable structure:
-        attachments = []
-        for sync_state in statuses[0]["sync_states"]:
-            attachment = {
-                "az": sync_state["availability_zone"],
-                "subnet_id": sync_state["attachments"][0]["subnet_id"],
-                "endpoint_id": sync_state["attachments"][0]["endpoint_id"],
-            }
-            attachments.append(attachment)
-
-        # Add routes from public subnets to the firewall for incoming packets.
-        for subnet_id in public_subnet_ids:
-            subnet = aws.ec2.get_subnet(id=subnet_id)
-            route_table = aws.ec2.get_route_table(
-                subnet_id=subnet_id
-            )
-
-            # Find the attachment in our availability zone
-            subnet_attachments = [
-                attachment for attachment in attachments if attachment['az'] == subnet.availability_zone]
-            if len(subnet_attachments) != 1:
-                raise Exception(
-                    f"Expected exactly 1 firewall subnet attachment for AZ '{subnet.availability_zone}'. Found {len(subnet_attachments)} instead.")
-
-            aws.ec2.Route(
-                f"{self.name}-{subnet_id}-to-firewall",
-                aws.ec2.RouteArgs(
-                    route_table_id=route_table.id,
-                    destination_cidr_block=self.args.supernet_cidr_block,
-                    vpc_endpoint_id=subnet_attachments[0]["endpoint_id"],
-                ),
-                pulumi.ResourceOptions(
+        self.firewall_log_bucket: Optional[pulumi.Output[str]] = None
+        if self.args.firewall_logs:
+            self.create_firewall_logging(self.args.firewall_logs)
+
+    def create_firewall_logging(self, settings: FirewallLogSettings):
+        bucket_name = settings.bucket
+        if bucket_name is None:
+            bucket = create_log_bucket(
+                f"{self.name}-firewall-logs",
+                settings.prefix,
+                settings.retention_days,
+                opts=pulumi.ResourceOptions(
                     parent=self,
                 ),
             )
-
-        # Add routes from the TGW subnets to the firewall for outgoing packets.
-        for subnet_id in tgw_subnet_ids:
-            subnet = aws.ec2.get_subnet(id=subnet_id)
-            route_table = aws.ec2.get_route_table(
-                subnet_id=subnet_id
-            )
-
-            # Find the attachment in our availability zone
-            subnet_attachments = [
-                attachment for attachment in attachments if attachment['az'] == subnet.availability_zone]
-            if len(subnet_attachments) != 1:
-                raise Exception(
-                    f"Expected exactly 1 firewall subnet attachment for AZ '{subnet.availability_zone}'. Found {len(subnet_attachments)} instead.")
-
-            aws.ec2.Route(
-                f"{self.name}-{subnet_id}-to-firewall",
-                aws.ec2.RouteArgs(
-                    route_table_id=route_table.id,
-                    destination_cidr_block="0.0.0.0/0",
-                    vpc_endpoint_id=subnet_attachments[0]["endpoint_id"],
+            bucket_name = bucket.bucket
+
+        # One destination per log type; Network Firewall adds the bucket
+        # policy that lets its log delivery write to the bucket.
+        aws.networkfirewall.LoggingConfiguration(
+            f"{self.name}-firewall-logging",
+            aws.networkfirewall.LoggingConfigurationArgs(
+                firewall_arn=self.firewall.arn,
+                logging_configuration=aws.networkfirewall.LoggingConfigurationLoggingConfigurationArgs(
+                    log_destination_configs=[
+                        aws.networkfirewall.LoggingConfigurationLoggingConfigurationLogDestinationConfigArgs(
+                            log_destination={
+                                "bucketName": bucket_name,
+                                "prefix": settings.prefix,
+                            },
+                            log_destination_type="S3",
+                            log_type=log_type,
+                        )
+                        for log_type in settings.types
+                    ],
                 ),
-                pulumi.ResourceOptions(
-                    parent=self,
-                ),
-            )
+            ),
+            opts=pulumi.ResourceOptions(
+                parent=self.firewall,
+            ),
+        )
+        self.firewall_log_bucket = pulumi.Output.from_input(bucket_name)
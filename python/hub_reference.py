@@ -0,0 +1,106 @@
+'''Splits the program into a hub stack and any number of spoke stacks.
+
+The `stack-role` config value selects what a stack manages:
+
+- `all` (the default): everything, in one stack.
+- `hub`: the Transit Gateway, its route tables, the firewall policy and the
+  hub VPC. Exports the TGW and route table IDs spoke stacks attach to.
+- `spokes`: the spokes in its `spokes` config and their propagations into
+  the hub TGW route table, attached to the hub stack named by `hub-stack`.
+
+Spoke stacks work out the hub's CIDR block and AZs from their own config the
+same way the hub stack does, since both are needed to plan the spokes before
+anything is read from the hub stack. They check those against the hub
+stack's exports, so a mismatch fails the update instead of deploying spokes
+that overlap the hub or attach in AZs without a firewall endpoint.
+
+Spoke stacks don't see each other's spokes unless told to. Give each one
+its own `spokes-cidr` range to allocate from, or list the others in
+`spoke-stacks`, whose `spoke-cidrs` exports (see read_spoke_cidrs) are then
+reserved before this stack allocates anything.'''
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+import pulumi
+# Reads a StackReference's outputs while the program runs, the way the SDK
+# runs a blocking invoke:
+from pulumi.runtime.sync_await import _sync_await
+
+STACK_ROLES = ("all", "hub", "spokes")
+
+
+def load_stack_role(config: pulumi.Config) -> str:
+    role = config.get("stack-role") or "all"
+    if role not in STACK_ROLES:
+        raise Exception(
+            f"Unknown stack role '{role}'. Expected one of: {', '.join(STACK_ROLES)}.")
+    return role
+
+
+@dataclass
+class HubReference:
+    tgw_id: pulumi.Output[str]
+    spoke_tgw_route_table_id: pulumi.Output[str]
+    hub_tgw_route_table_id: pulumi.Output[str]
+    # The private hosted zones of the hub's shared VPC endpoints, by
+    # service, when the endpoints are centralized:
+    endpoint_zone_ids: Optional[pulumi.Output[Dict[str, str]]] = None
+    # The bucket the hub stack created for VPC flow logs, if it did:
+    flow_log_bucket: Optional[pulumi.Output[str]] = None
+
+    @staticmethod
+    def from_stack(
+        stack_name: str,
+        supernet_cidr_block: str,
+        hub_cidr_block: str,
+        availability_zone_names: Sequence[str],
+        endpoint_services: Optional[Sequence[str]] = None,
+        flow_log_bucket: bool = False,
+    ) -> "HubReference":
+        '''References the hub stack `stack_name` (e.g. `org/project/hub`),
+        checking that it agrees with this stack's view of the hub. Pass
+        `endpoint_services` to use the hub's centralized VPC endpoints, and
+        `flow_log_bucket` to log flows to the hub's flow log bucket.'''
+        hub = pulumi.StackReference(stack_name)
+
+        expected: Dict[str, Any] = {
+            "hub-and-spoke-supernet": supernet_cidr_block,
+            "hub-cidr": hub_cidr_block,
+            "availability-zones": list(availability_zone_names),
+        }
+
+        def check(actual: Dict[str, Any]) -> str:
+            for key, value in expected.items():
+                if actual[key] != value:
+                    raise Exception(
+                        f"Hub stack '{stack_name}' has {key} {actual[key]!r}, but this stack expects {value!r}. "
+                        f"Set {key} in this stack's config to match.")
+            return actual["tgw-id"]
+
+        # Everything attaches to the TGW, so making its ID depend on the check
+        # stops any spoke being created against a hub that doesn't match:
+        tgw_id = pulumi.Output.all(**{
+            key: hub.require_output(key) for key in ["tgw-id", *expected]
+        }).apply(check)
+
+        return HubReference(
+            tgw_id=tgw_id,
+            spoke_tgw_route_table_id=hub.require_output("spoke-tgw-route-table-id"),
+            hub_tgw_route_table_id=hub.require_output("hub-tgw-route-table-id"),
+            endpoint_zone_ids=hub.require_output("endpoint-zone-ids") if endpoint_services else None,
+            flow_log_bucket=hub.require_output("flow-log-bucket") if flow_log_bucket else None,
+        )
+
+
+def read_spoke_cidrs(stack_name: Optional[str] = None) -> Dict[str, str]:
+    '''Returns the `spoke-cidrs` export of `stack_name`, or by default this
+    stack's own from its last update. It's read before any spoke is planned,
+    so that the allocator can reserve those blocks. Empty if the stack hasn't
+    exported it yet.'''
+    own = stack_name is None
+    if own:
+        stack_name = f"{pulumi.get_organization()}/{pulumi.get_project()}/{pulumi.get_stack()}"
+    reference = pulumi.StackReference(
+        "previous-spoke-cidrs" if own else f"{stack_name}-spoke-cidrs", stack_name=stack_name)
+    details = _sync_await(reference.get_output_details("spoke-cidrs"))
+    return dict(details.value or {})
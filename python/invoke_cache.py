@@ -0,0 +1,211 @@
+'''A record/replay cache for provider invokes (`aws.ec2.get_ami` and friends).
+
+Results are memoized for the duration of a run and kept on disk per stack in
+`.invoke-cache/<stack>.json` so that later runs (e.g. CI previews) don't have
+to go back to AWS. The behavior is selected with the `invoke-cache` config
+value:
+
+- `cache` (the default): serve results from memory or disk while they are
+  younger than `invoke-cache-ttl` seconds (default 3600), otherwise call AWS
+  and record the result.
+- `replay`: serve results only from disk, regardless of their age, and fail on
+  anything that hasn't been recorded. No invoke reaches AWS.
+- `off`: always call AWS and record nothing.
+
+Unless the mode is `off`, hit and miss counts are written to stderr when
+the program exits.'''
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import types
+from typing import Any, Callable, Dict, Optional
+
+import pulumi
+
+import profiling
+
+MODES = ("cache", "replay", "off")
+DEFAULT_TTL_SECONDS = 3600
+
+_cache: Optional["InvokeCache"] = None
+_cache_lock = threading.Lock()
+
+
+class InvokeCacheMiss(Exception):
+    '''Raised in replay mode for an invoke that has no recorded result.'''
+
+
+class InvokeCache:
+    def __init__(self, path: str, mode: str = "cache", ttl: float = DEFAULT_TTL_SECONDS) -> None:
+        if mode not in MODES:
+            raise ValueError(
+                f"Unknown invoke-cache mode '{mode}'. Expected one of: {', '.join(MODES)}.")
+
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0}
+
+        self._memory: Dict[str, Any] = {}
+        self._recorded: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+
+        if mode != "off" and os.path.exists(path):
+            with open(path) as f:
+                self._recorded = json.load(f)
+
+    def invoke(self, fn: Callable[..., Any], **kwargs) -> Any:
+        '''Calls `fn(**kwargs)` (a provider function such as
+        `aws.ec2.get_ami`), or returns its cached result.'''
+        if self.mode == "off":
+            with self._lock:
+                self.stats["misses"] += 1
+            return _call(fn, kwargs)
+
+        key = _cache_key(fn, kwargs)
+        with self._lock:
+            if key in self._memory:
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+            entry = self._recorded.get(key)
+            if entry is not None and (self.mode == "replay" or time.time() - entry["recorded_at"] < self.ttl):
+                self.stats["disk_hits"] += 1
+                result = self._memory[key] = _to_namespace(entry["result"])
+                return result
+
+            if self.mode == "replay":
+                raise InvokeCacheMiss(
+                    f"No recorded result for {key} in '{self.path}'. Run with invoke-cache set to 'cache' to record it.")
+
+            if entry is not None:
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+
+        # Called without the lock, so a slow invoke doesn't hold up others.
+        # Two threads missing on the same key both call it, and the last one
+        # to finish is recorded.
+        result = _call(fn, kwargs)
+        with self._lock:
+            self._memory[key] = result
+            self._recorded[key] = {
+                "recorded_at": time.time(),
+                "result": _to_plain(result),
+            }
+            self._dirty = True
+        return result
+
+    def invoke_output(self, fn: Callable[..., Any], **kwargs) -> pulumi.Output[Any]:
+        '''Like `invoke`, but accepts Outputs anywhere in the arguments (as the
+        `*_output` provider functions do) and returns an Output.'''
+        return pulumi.Output.from_input(kwargs).apply(lambda args: self.invoke(fn, **args))
+
+    def save(self) -> None:
+        '''Writes recorded results to disk, evicting any that have expired.'''
+        with self._lock:
+            if not self._dirty:
+                return
+
+            now = time.time()
+            live = {
+                key: entry for key, entry in self._recorded.items()
+                if now - entry["recorded_at"] < self.ttl
+            }
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(live, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def summary(self) -> str:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return (
+            f"invoke cache ({self.mode}): {hits} hits "
+            f"({self.stats['memory_hits']} in memory, {self.stats['disk_hits']} on disk), "
+            f"{self.stats['misses']} misses ({self.stats['expired']} expired)"
+        )
+
+
+def get_cache() -> InvokeCache:
+    '''Returns the invoke cache for the current stack, creating it from config
+    on first use.'''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = pulumi.Config()
+            ttl = config.get_float("invoke-cache-ttl")
+            _cache = InvokeCache(
+                path=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  ".invoke-cache", f"{pulumi.get_stack()}.json"),
+                mode=config.get("invoke-cache") or "cache",
+                # 0 is a valid TTL (record, but never serve from disk):
+                ttl=DEFAULT_TTL_SECONDS if ttl is None else ttl,
+            )
+            atexit.register(_report, _cache)
+        return _cache
+
+
+def reset() -> None:
+    '''Discards the current cache so that the next invoke re-reads config.
+    Used when evaluating the program several times in one process.'''
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.save()
+            atexit.unregister(_report)
+        _cache = None
+
+
+def invoke(fn: Callable[..., Any], **kwargs) -> Any:
+    return get_cache().invoke(fn, **kwargs)
+
+
+def invoke_output(fn: Callable[..., Any], **kwargs) -> pulumi.Output[Any]:
+    return get_cache().invoke_output(fn, **kwargs)
+
+
+def _call(fn: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+    return profiling.invoke(f"{fn.__module__}.{fn.__qualname__}", lambda: fn(**kwargs))
+
+
+def _report(cache: InvokeCache) -> None:
+    cache.save()
+    # To stderr, so stdout is left to the program (and tools that parse it):
+    if cache.mode != "off":
+        print(cache.summary(), file=sys.stderr)
+
+
+def _cache_key(fn: Callable[..., Any], kwargs: Dict[str, Any]) -> str:
+    return f"{fn.__module__}.{fn.__qualname__}:{json.dumps(_to_plain(kwargs), sort_keys=True)}"
+
+
+def _to_plain(value: Any) -> Any:
+    '''Converts invoke arguments and results (args and result classes, which
+    keep their properties in `__dict__`) to plain JSON-compatible values.'''
+    if isinstance(value, dict):
+        return {str(k): _to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if hasattr(value, "__dict__"):
+        return {"__attrs__": {k: _to_plain(v) for k, v in vars(value).items()}}
+    return str(value)
+
+
+def _to_namespace(value: Any) -> Any:
+    '''Turns a recorded result back into an object with attribute access, so
+    callers can use it exactly like the provider's result class.'''
+    if isinstance(value, dict) and "__attrs__" in value:
+        return types.SimpleNamespace(**{k: _to_namespace(v) for k, v in value["__attrs__"].items()})
+    if isinstance(value, dict):
+        return {k: _to_namespace(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_namespace(v) for v in value]
+    return value
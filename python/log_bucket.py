@@ -0,0 +1,48 @@
+'''The S3 bucket the firewall and flow logs are delivered to, when config
+doesn't name an existing one.'''
+import pulumi
+import pulumi_aws as aws
+
+
+def create_log_bucket(name: str, prefix: str, retention_days: int,
+                      opts: pulumi.ResourceOptions = None) -> "aws.s3.BucketV2":
+    '''A private bucket that expires what's under `prefix` after
+    `retention_days`. The log delivery services add the bucket policy that
+    lets them write to it.'''
+    bucket = aws.s3.BucketV2(name, opts=opts)
+
+    aws.s3.BucketPublicAccessBlock(
+        name,
+        aws.s3.BucketPublicAccessBlockArgs(
+            bucket=bucket.id,
+            block_public_acls=True,
+            block_public_policy=True,
+            ignore_public_acls=True,
+            restrict_public_buckets=True,
+        ),
+        opts=pulumi.ResourceOptions(
+            parent=bucket,
+        ),
+    )
+
+    aws.s3.BucketLifecycleConfigurationV2(
+        name,
+        aws.s3.BucketLifecycleConfigurationV2Args(
+            bucket=bucket.id,
+            rules=[aws.s3.BucketLifecycleConfigurationV2RuleArgs(
+                id=f"expire-{prefix.replace('/', '-')}",
+                status="Enabled",
+                filter=aws.s3.BucketLifecycleConfigurationV2RuleFilterArgs(
+                    prefix=f"{prefix}/",
+                ),
+                expiration=aws.s3.BucketLifecycleConfigurationV2RuleExpirationArgs(
+                    days=retention_days,
+                ),
+            )],
+        ),
+        opts=pulumi.ResourceOptions(
+            parent=bucket,
+        ),
+    )
+
+    return bucket
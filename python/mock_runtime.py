@@ -0,0 +1,234 @@
+'''Runs the Pulumi program (or any part of it) against `pulumi.runtime.set_mocks`
+so it can be evaluated offline, without AWS credentials or the Pulumi engine.
+
+The mocks record every resource registration and every provider invoke, which
+is what the tests and benchmarks use to reason about the program.'''
+import collections
+import ipaddress
+import runpy
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import pulumi
+from pulumi.runtime import rpc
+from pulumi.runtime.mocks import MockMonitor
+from pulumi.runtime.stack import run_pulumi_func
+from pulumi.runtime.sync_await import _sync_await
+
+import invoke_cache
+import profiling
+
+PROJECT = "aws-hub-and-spoke-with-inspection-vpc-python"
+
+
+class Registration(NamedTuple):
+    '''A resource as the engine would know it after an update: its type,
+    name, ID and state (inputs plus outputs).'''
+    typ: str
+    name: str
+    id: str
+    state: Dict
+
+
+class ProgramMocks(pulumi.runtime.Mocks):
+    '''Mocks that return plausible outputs for the resources and invokes this
+    program uses. `awsx:ec2:Vpc` is a component implemented by the awsx
+    provider, so its subnets, route tables and route table associations are
+    synthesized here the same way awsx lays them out.'''
+
+    def __init__(self, region: str = "us-east-1", availability_zones: int = 3,
+                 stack_outputs: Optional[Dict[str, Dict]] = None) -> None:
+        self.region = region
+        self.availability_zones = availability_zones
+        # The outputs of the stacks a StackReference can read, by stack name:
+        self.stack_outputs = stack_outputs or {}
+        self.resources: List[pulumi.runtime.MockResourceArgs] = []
+        # Every resource, including those synthesized for awsx components:
+        self.registrations: List[Registration] = []
+        self.invokes: collections.Counter = collections.Counter()
+
+    def new_resource(self, args: pulumi.runtime.MockResourceArgs):
+        self.resources.append(args)
+        resource_id = f"{args.name}-id"
+
+        if args.typ == "awsx:ec2:Vpc":
+            outputs = self._vpc_outputs(args)
+        elif args.typ == "pulumi:pulumi:StackReference":
+            # A stack that hasn't been updated yet has no outputs:
+            outputs = {"name": args.inputs["name"], "outputs": self.stack_outputs.get(args.inputs["name"], {}),
+                       "secretOutputNames": []}
+        else:
+            outputs = dict(args.inputs)
+            outputs.setdefault("arn", f"arn:aws:mock:{self.region}::{args.name}")
+        if args.typ == "aws:networkfirewall/firewall:Firewall":
+            outputs["firewallStatuses"] = self._firewall_statuses(args)
+        if args.typ == "aws:ec2/vpcEndpoint:VpcEndpoint":
+            outputs["dnsEntries"] = [{
+                "dnsName": f"vpce-{args.name}.{args.inputs.get('serviceName')}.vpce.amazonaws.com",
+                "hostedZoneId": "Z7HUB3Q7PPRR3",
+            }]
+        if args.typ == "aws:route53/zone:Zone":
+            outputs["zoneId"] = f"Z{args.name}"
+
+        self.registrations.append(Registration(args.typ, args.name, resource_id, outputs))
+        return resource_id, outputs
+
+    def call(self, args: pulumi.runtime.MockCallArgs):
+        self.invokes[args.token] += 1
+
+        if args.token == "aws:ec2/getAmi:getAmi":
+            return {"id": "ami-0123456789abcdef0", "architecture": "x86_64"}
+        if args.token == "aws:index/getAvailabilityZones:getAvailabilityZones":
+            return {
+                "names": self._zones(),
+                "zoneIds": [f"use1-az{i+1}" for i in range(self.availability_zones)],
+                "id": self.region,
+            }
+        return {"id": f"{args.token}-result"}
+
+    def _zones(self) -> List[str]:
+        return [f"{self.region}{chr(ord('a') + i)}" for i in range(self.availability_zones)]
+
+    def _vpc_outputs(self, args: pulumi.runtime.MockResourceArgs) -> Dict:
+        zones = args.inputs.get("availabilityZoneNames") or self._zones()[
+            :int(args.inputs.get("numberOfAvailabilityZones") or self.availability_zones)]
+        vpc_id = f"{args.name}-vpc-id"
+
+        specs = args.inputs.get("subnetSpecs") or [{"type": "Private"}, {"type": "Public"}]
+        cidrs = _subnet_cidrs(args.inputs.get("cidrBlock"), len(zones), specs)
+
+        subnets, route_tables, associations = [], [], []
+        ids_by_type = collections.defaultdict(list)
+        for i, zone in enumerate(zones):
+            for j, spec in enumerate(specs):
+                subnet_name = f"{args.name}-{spec.get('name') or spec['type'].lower()}-{i+1}"
+                subnet_id = f"{subnet_name}-id"
+                route_table_id = f"{subnet_name}-rtb-id"
+                ids_by_type[spec["type"]].append(subnet_id)
+
+                subnets.append(self._child(
+                    "aws:ec2/subnet:Subnet", subnet_name, subnet_id, {
+                        "vpcId": vpc_id,
+                        "availabilityZone": zone,
+                        "cidrBlock": cidrs[i][j],
+                        "tags": {"Name": subnet_name},
+                    }))
+                route_tables.append(self._child(
+                    "aws:ec2/routeTable:RouteTable", subnet_name, route_table_id, {
+                        "vpcId": vpc_id,
+                        "tags": {"Name": subnet_name},
+                    }))
+                associations.append(self._child(
+                    "aws:ec2/routeTableAssociation:RouteTableAssociation", subnet_name,
+                    f"{subnet_name}-rtbassoc-id", {
+                        "subnetId": subnet_id,
+                        "routeTableId": route_table_id,
+                    }))
+
+        return {
+            "vpcId": vpc_id,
+            "cidrBlock": args.inputs.get("cidrBlock"),
+            "subnets": subnets,
+            "routeTables": route_tables,
+            "routeTableAssociations": associations,
+            "publicSubnetIds": ids_by_type["Public"],
+            "privateSubnetIds": ids_by_type["Private"],
+            "isolatedSubnetIds": ids_by_type["Isolated"],
+            "natGateways": [],
+            "eips": [],
+            "routes": [],
+            "vpcEndpoints": [],
+        }
+
+    def _firewall_statuses(self, args: pulumi.runtime.MockResourceArgs) -> List[Dict]:
+        '''One endpoint per subnet mapping, in the subnet's AZ.'''
+        zones = {registration.id: registration.state.get("availabilityZone")
+                 for registration in self.registrations
+                 if registration.typ == "aws:ec2/subnet:Subnet"}
+        return [{
+            "syncStates": [{
+                "availabilityZone": zones.get(mapping["subnetId"]),
+                "attachments": [{
+                    "subnetId": mapping["subnetId"],
+                    "endpointId": f"vpce-{args.name}-{i+1}",
+                    "status": "READY",
+                }],
+            } for i, mapping in enumerate(args.inputs.get("subnetMappings") or [])],
+        }]
+
+    def _child(self, typ: str, name: str, resource_id: str, state: Dict) -> Dict:
+        '''Registers a child resource of a mocked component with the mock
+        monitor and returns a resource reference to it.'''
+        monitor = pulumi.runtime.settings.get_monitor()
+        urn = f"urn:pulumi:{pulumi.get_stack()}::{pulumi.get_project()}::{typ}::{name}"
+        state = dict(state, id=resource_id)
+        self.registrations.append(Registration(typ, name, resource_id, state))
+        if isinstance(monitor, MockMonitor):
+            monitor.resources[urn] = MockMonitor.ResourceRegistration(
+                urn, resource_id, state)
+        return {
+            rpc._special_sig_key: rpc._special_resource_sig,
+            "urn": urn,
+            "id": resource_id,
+        }
+
+    def resources_of_type(self, typ: str) -> List[pulumi.runtime.MockResourceArgs]:
+        return [resource for resource in self.resources if resource.typ == typ]
+
+
+def _subnet_cidrs(vpc_cidr: Optional[str], zone_count: int, specs: List[Dict]) -> List[List[Optional[str]]]:
+    '''Lays subnets out the way awsx does: the VPC CIDR is split into one
+    block per AZ (rounded up to a power of two) and each AZ's subnets are
+    packed, in spec order, from the start of its block.'''
+    if not vpc_cidr or not all(spec.get("cidrMask") for spec in specs):
+        return [[None] * len(specs) for _ in range(zone_count)]
+
+    vpc = ipaddress.ip_network(vpc_cidr)
+    new_prefix = vpc.prefixlen + max(zone_count - 1, 0).bit_length()
+    cidrs = []
+    for block in list(vpc.subnets(new_prefix=new_prefix))[:zone_count]:
+        address, zone_cidrs = int(block.network_address), []
+        for spec in specs:
+            size = 2 ** (32 - int(spec["cidrMask"]))
+            address = -(-address // size) * size
+            zone_cidrs.append(str(ipaddress.ip_network((address, int(spec["cidrMask"])))))
+            address += size
+        cidrs.append(zone_cidrs)
+    return cidrs
+
+
+def run(program: Callable[[], None], config: Optional[Dict[str, str]] = None,
+        mocks: Optional[ProgramMocks] = None, stack: str = "dev", preview: bool = False) -> ProgramMocks:
+    '''Runs `program` against mocks and waits for every resource registration
+    and `apply` callback it triggers to finish.'''
+    mocks = mocks or ProgramMocks()
+    invoke_cache.reset()
+    profiling.stop()
+    pulumi.runtime.set_all_config({
+        "aws:region": mocks.region,
+        f"{PROJECT}:hub-and-spoke-supernet": "10.0.0.0/8",
+        # Every invoke should reach the mocks unless a caller asks otherwise:
+        f"{PROJECT}:invoke-cache": "off",
+        **{
+            key if ":" in key else f"{PROJECT}:{key}": value
+            for key, value in (config or {}).items()
+        },
+    })
+    # "organization" is what the engine reports for self-managed backends:
+    pulumi.runtime.set_mocks(mocks, project=PROJECT, stack=stack, preview=preview, organization="organization")
+    try:
+        _sync_await(run_pulumi_func(program))
+    finally:
+        # A run that fails stops waiting on its outstanding RPCs and Outputs;
+        # cancel them so they can't fail the next run instead.
+        settings = pulumi.runtime.settings.SETTINGS
+        for task in [*settings.outputs, *settings.rpc_manager.rpcs]:
+            if hasattr(task, "cancel"):
+                task.cancel()
+        settings.outputs.clear()
+        settings.rpc_manager.clear()
+    return mocks
+
+
+def run_main(path: str, **kwargs) -> ProgramMocks:
+    '''Runs the program's `__main__.py` at `path` against mocks.'''
+    return run(lambda: runpy.run_path(path, run_name="__main__"), **kwargs)
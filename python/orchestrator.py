@@ -0,0 +1,233 @@
+'''Previews or updates the hub stack and many spoke stacks with the
+Automation API (see `hub_reference.py` for how the program is split).
+
+    python orchestrator.py up --hub hub --spokes team-a team-b --workers 8
+    python orchestrator.py preview --discover
+
+The hub goes first; if updating it fails, the spokes are skipped. Spokes
+then run in a process pool, `--workers` at a time, each in its own `pulumi`
+process. Operations that fail because AWS (or the backend) throttled us are
+retried with exponential backoff. A timing summary for each stack is printed
+at the end, and the exit code is non-zero if any stack failed.
+
+`--discover` finds the stacks from each stack's `stack-role` config.'''
+import argparse
+import concurrent.futures
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+PROGRAM_DIR = os.path.dirname(os.path.abspath(__file__))
+OPERATIONS = ("preview", "up")
+
+# Errors worth retrying: AWS API throttling, and the backend or engine
+# asking us to slow down.
+_THROTTLING = re.compile(
+    r"Throttling|ThrottlingException|Rate exceeded|RequestLimitExceeded|TooManyRequests|"
+    r"SlowDown|429 Too Many Requests|RequestThrottled",
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class StackTask:
+    stack_name: str
+    operation: str = "preview"
+    work_dir: str = PROGRAM_DIR
+    # An inline program (and its project name) to run instead of the one in
+    # work_dir. Must be a module-level function so the pool can pickle it.
+    program: Optional[Callable[[], None]] = None
+    project_name: Optional[str] = None
+    # Extra environment for the pulumi CLI, e.g. PULUMI_BACKEND_URL:
+    env: Dict[str, str] = field(default_factory=dict)
+    retries: int = 5
+
+
+@dataclass
+class StackResult:
+    stack_name: str
+    operation: str
+    # "succeeded", "failed" or "skipped":
+    status: str
+    attempts: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+    # Resource counts by operation, e.g. {"create": 2, "same": 10}:
+    changes: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def seconds(self) -> float:
+        return self.finished - self.started
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    return bool(_THROTTLING.search(str(error)))
+
+
+def with_retries(
+    operation: Callable[[], T],
+    retries: int,
+    base_delay: float = 2.0,
+    max_delay: float = 60.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    '''Calls `operation`, retrying it up to `retries` times while it fails
+    with a throttling error.
+
+    Backoff is exponential with full jitter, so that spokes throttled at the
+    same moment don't all retry at the same moment too.'''
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return operation()
+        except Exception as error:
+            if attempt > retries or not is_throttling_error(error):
+                raise
+            sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+
+
+def run_stack(task: StackTask) -> StackResult:
+    '''Runs one preview or update. Runs in a pool worker, so it imports the
+    Automation API itself and never raises.'''
+    from pulumi import automation as auto
+
+    def select():
+        options = auto.LocalWorkspaceOptions(env_vars=task.env or None)
+        if task.program is not None:
+            return auto.create_or_select_stack(
+                stack_name=task.stack_name, project_name=task.project_name,
+                program=task.program, opts=options)
+        options.work_dir = task.work_dir
+        return auto.select_stack(stack_name=task.stack_name, work_dir=task.work_dir, opts=options)
+
+    result = StackResult(task.stack_name, task.operation, "failed", started=time.time())
+
+    def operate() -> Dict[str, int]:
+        result.attempts += 1
+        stack = select()
+        if task.operation == "preview":
+            changes = stack.preview(color="never").change_summary
+        else:
+            changes = stack.up(color="never").summary.resource_changes or {}
+        # Preview keys are OpType enums; up's are plain strings:
+        return {getattr(op, "value", op): count for op, count in changes.items()}
+
+    try:
+        result.changes = with_retries(operate, task.retries)
+        result.status = "succeeded"
+    except Exception as error:
+        # The CLI's output can be long; the end is where the error is:
+        result.error = str(error)[-2000:]
+    result.finished = time.time()
+    return result
+
+
+def orchestrate(
+    hub: Optional[StackTask],
+    spokes: Sequence[StackTask],
+    workers: int,
+    run: Callable[[StackTask], StackResult] = run_stack,
+    on_result: Callable[[StackResult], None] = lambda result: None,
+) -> List[StackResult]:
+    '''Runs `hub` and then `spokes`, at most `workers` spokes at a time.'''
+    results = []
+    if hub is not None:
+        results.append(run(hub))
+        on_result(results[-1])
+        if results[-1].status != "succeeded" and hub.operation == "up":
+            skipped = [StackResult(task.stack_name, task.operation, "skipped",
+                                   error=f"hub stack '{hub.stack_name}' failed") for task in spokes]
+            for result in skipped:
+                on_result(result)
+            return results + skipped
+
+    if not spokes:
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, task) for task in spokes]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+            on_result(results[-1])
+    return results
+
+
+def format_results(results: Sequence[StackResult]) -> str:
+    lines = [f"{'stack':<32} {'operation':<9} {'status':<9} {'attempts':>8} {'seconds':>8}  changes"]
+    for result in results:
+        changes = " ".join(f"{op}={count}" for op, count in sorted(result.changes.items()) if op != "same")
+        lines.append(
+            f"{result.stack_name:<32} {result.operation:<9} {result.status:<9} {result.attempts:>8} "
+            f"{result.seconds:>8.1f}  {changes or '-'}")
+    succeeded = [result for result in results if result.status == "succeeded"]
+    if succeeded:
+        wall = max(r.finished for r in succeeded) - min(r.started for r in succeeded)
+        lines.append(f"{len(succeeded)}/{len(results)} stacks succeeded in {wall:.1f}s "
+                     f"({sum(r.seconds for r in succeeded):.1f}s of stack time)")
+    return "\n".join(lines)
+
+
+def discover_stacks(work_dir: str, env: Dict[str, str]) -> Tuple[Optional[str], List[str]]:
+    '''Returns the hub stack and the spoke stacks in `work_dir`'s project,
+    by their `stack-role` config.'''
+    from pulumi import automation as auto
+
+    workspace = auto.LocalWorkspace(work_dir=work_dir, env_vars=env or None)
+    project = workspace.project_settings().name
+    hub, spokes = None, []
+    for summary in workspace.list_stacks():
+        role = workspace.get_all_config(summary.name).get(f"{project}:stack-role")
+        role = role.value if role else "all"
+        if role == "spokes":
+            spokes.append(summary.name)
+        elif role == "hub":
+            if hub is not None:
+                raise Exception(f"Found more than one hub stack: {hub}, {summary.name}.")
+            hub = summary.name
+    return hub, sorted(spokes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("operation", choices=OPERATIONS)
+    parser.add_argument("--hub", help="The hub stack, run before the spokes.")
+    parser.add_argument("--spokes", nargs="*", default=[], help="Spoke stacks.")
+    parser.add_argument("--discover", action="store_true",
+                        help="Find the hub and spoke stacks from their stack-role config.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="Spoke stacks to run at once (default: the number of CPUs).")
+    parser.add_argument("--retries", type=int, default=5,
+                        help="Retries per stack on throttling errors (default: 5).")
+    parser.add_argument("--work-dir", default=PROGRAM_DIR)
+    parser.add_argument("--backend-url", help="Sets PULUMI_BACKEND_URL, e.g. file://~/.pulumi-local.")
+    args = parser.parse_args()
+
+    env = {"PULUMI_BACKEND_URL": args.backend_url} if args.backend_url else {}
+    hub, spokes = args.hub, list(args.spokes)
+    if args.discover:
+        hub, spokes = discover_stacks(args.work_dir, env)
+
+    def task(name: str) -> StackTask:
+        return StackTask(name, args.operation, work_dir=args.work_dir, env=env, retries=args.retries)
+
+    def progress(result: StackResult) -> None:
+        print(f"{result.stack_name}: {result.status} ({result.seconds:.1f}s)", flush=True)
+        if result.error and result.status == "failed":
+            print(result.error, file=sys.stderr)
+
+    results = orchestrate(task(hub) if hub else None, [task(name) for name in spokes],
+                          workers=args.workers, on_result=progress)
+    print(format_results(results))
+    if any(result.status != "succeeded" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+'''Throughput and latency probes for the spoke workloads.
+
+In probe mode each workload spoke runs `instances` probe instances, spread
+round-robin across its AZs. Every probe serves iperf3 and HTTP, finds its
+peers in other spokes by their `probe-group` tag, and measures:
+
+- iperf3 throughput to one peer in each other spoke (east-west, through the
+  TGW and, in firewall mode, the inspection VPC), and
+- HTTP latency to each of `urls` (egress through the hub's NAT Gateway).
+
+An iperf3 server runs one test at a time, so the probes take turns (see
+`probe_schedule`): in each round every probe measures a different peer and
+is measured by exactly one. Rounds drift apart a little on real instances,
+so a test the server turns away as busy is retried.
+
+Results are written as JSON to `RESULTS_DIR` on each instance (and copied to
+`s3://<results_bucket>/<group>/<probe>/` if a bucket is set). The probe runs
+once at boot; run `sudo run-probe` over SSM to measure again after a
+firewall or routing change.
+
+Everything here is plain Python so that placement and user data can be
+tested without deploying anything.'''
+import shlex
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import pulumi
+
+RESULTS_DIR = "/var/log/probe"
+IPERF3_PORT = 5201
+HTTP_PORT = 80
+# How many times a test turned away by a busy iperf3 server is tried:
+IPERF3_ATTEMPTS = 5
+
+# One JSON line per HTTP request (curl's --write-out):
+_TIMING_FORMAT = '{"url": "%{url_effective}", "code": %{http_code}, "connect": %{time_connect}, "total": %{time_total}}\\n'
+
+
+@dataclass
+class ProbeSettings:
+    # Probe instances per workload spoke:
+    instances: int = 3
+    # Seconds per iperf3 test:
+    duration: int = 10
+    # Parallel iperf3 streams per test:
+    parallel: int = 4
+    # HTTP requests per URL; latency percentiles come from these:
+    requests: int = 20
+    urls: Sequence[str] = field(default_factory=lambda: ["https://aws.amazon.com/"])
+    # How long a probe waits for all of its peers to come up:
+    peer_timeout: int = 600
+    results_bucket: Optional[str] = None
+
+    @staticmethod
+    def from_config(value: dict) -> "ProbeSettings":
+        settings = ProbeSettings(**value)
+        if settings.instances < 1:
+            raise Exception(
+                f"Probe instances must be at least 1. Got {settings.instances}.")
+        return settings
+
+
+def load_probe_settings(config: pulumi.Config) -> Optional[ProbeSettings]:
+    '''Reads the `probe` object from stack config, e.g.:
+
+        probe:
+          instances: 3
+          duration: 30
+          urls: [https://aws.amazon.com/]
+
+    Returns None (a single connectivity-check instance per workload) if it's
+    not set.'''
+    value = config.get_object("probe")
+    if value is None:
+        return None
+    return ProbeSettings.from_config(value)
+
+
+def place_probes(instances: int, availability_zone_count: int) -> List[int]:
+    '''Returns the AZ index for each of `instances` probes, round-robin, so
+    that every AZ gets a probe before any AZ gets a second one.'''
+    return [i % availability_zone_count for i in range(instances)]
+
+
+def probe_schedule(spokes: Sequence[str], spoke: str, index: int) -> List[Tuple[str, int]]:
+    '''Returns the peers probe `index` (1-based) of `spoke` measures, one
+    per other spoke in `spokes`, as (spoke, probe index) pairs in the order
+    it measures them.
+
+    In round r, the probes of the spoke at position s measure those of the
+    spoke at position s + r (wrapping around), probe for probe. That's a
+    different spoke for every s, so each probe is measured by exactly one
+    other probe per round, and the probes of a spoke measure different
+    peers.'''
+    spokes = sorted(spokes)
+    position = spokes.index(spoke)
+    return [(spokes[(position + r) % len(spokes)], index) for r in range(1, len(spokes))]
+
+
+def probe_user_data(
+    settings: ProbeSettings,
+    group: str,
+    spoke: str,
+    probe: str,
+    expected_peers: int,
+    schedule: Sequence[Tuple[str, int]] = (),
+) -> str:
+    '''Returns the user data for one probe instance.
+
+    `group` tags every probe in the stack, and `expected_peers` is how many
+    probes (including this one) to wait for before measuring. `schedule` is
+    the peers to measure, in order (see probe_schedule).'''
+    q = shlex.quote
+    urls = " ".join(q(url) for url in settings.urls)
+    rounds = "".join(f"{peer_spoke} {peer_index}\n" for peer_spoke, peer_index in schedule)
+    upload = ""
+    if settings.results_bucket:
+        upload = f'aws s3 cp --recursive "$out" {q(f"s3://{settings.results_bucket}/{group}/{probe}/")}$run/'
+
+    return f'''#!/bin/bash
+set -uo pipefail
+
+yum install -y iperf3 jq python3
+
+# Serve both tests so that other probes can measure against this one:
+cat > /etc/systemd/system/probe-iperf3.service <<'UNIT'
+[Unit]
+Description=iperf3 server for throughput probes
+After=network-online.target
+
+[Service]
+ExecStart=/usr/bin/iperf3 --server --port {IPERF3_PORT}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+
+cat > /etc/systemd/system/probe-http.service <<'UNIT'
+[Unit]
+Description=HTTP server for latency probes
+After=network-online.target
+
+[Service]
+WorkingDirectory=/tmp
+ExecStart=/usr/bin/python3 -m http.server {HTTP_PORT}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+
+systemctl daemon-reload
+systemctl enable --now probe-iperf3 probe-http
+
+cat > /usr/local/bin/run-probe <<'PROBE'
+#!/bin/bash
+set -uo pipefail
+
+group={q(group)}
+spoke={q(spoke)}
+probe={q(probe)}
+expected_peers={expected_peers}
+run=$(date -u +%Y%m%dT%H%M%SZ)
+out={RESULTS_DIR}/$run
+mkdir -p "$out"
+
+token=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+region=$(curl -s -H "X-aws-ec2-metadata-token: $token" http://169.254.169.254/latest/meta-data/placement/region)
+
+peers() {{
+  aws ec2 describe-instances --region "$region" \\
+    --filters "Name=tag:probe-group,Values=$group" "Name=instance-state-name,Values=running" \\
+    --query 'Reservations[].Instances[].[PrivateIpAddress, Tags[?Key==`probe-spoke`]|[0].Value, Tags[?Key==`probe-index`]|[0].Value]' \\
+    --output text
+}}
+
+deadline=$((SECONDS + {settings.peer_timeout}))
+until [ "$(peers | wc -l)" -ge "$expected_peers" ] || [ "$SECONDS" -ge "$deadline" ]; do
+  sleep 10
+done
+
+# One peer per other spoke, in turns so that no peer is measured by two
+# probes at once:
+listing=$(peers)
+while read -r peer_spoke peer_index; do
+  address=$(awk -v s="$peer_spoke" -v i="$peer_index" '$2 == s && $3 == i {{print $1; exit}}' <<< "$listing")
+  if [ -z "$address" ]; then
+    jq -n --arg spoke "$peer_spoke" --arg index "$peer_index" '{{error: "peer not found", spoke: $spoke, index: $index}}' \\
+      > "$out/iperf3-$peer_spoke.json"
+    continue
+  fi
+  for attempt in $(seq {IPERF3_ATTEMPTS}); do
+    iperf3 --client "$address" --port {IPERF3_PORT} --time {settings.duration} --parallel {settings.parallel} --json \\
+      < /dev/null > "$out/iperf3-$peer_spoke.json"
+    jq -e '(.error // "") | test("busy")' "$out/iperf3-$peer_spoke.json" > /dev/null || break
+    sleep $((5 + RANDOM % 10))
+  done
+  for i in $(seq {settings.requests}); do
+    curl -s -o /dev/null --max-time 10 -w {q(_TIMING_FORMAT)} \\
+      "http://$address:{HTTP_PORT}/" < /dev/null
+  done > "$out/http-$peer_spoke.jsonl"
+done <<'SCHEDULE'
+{rounds}SCHEDULE
+
+for url in {urls}; do
+  for i in $(seq {settings.requests}); do
+    curl -s -o /dev/null --max-time 10 -w {q(_TIMING_FORMAT)} "$url"
+  done
+done > "$out/http-egress.jsonl"
+
+jq -n --arg probe "$probe" --arg spoke "$spoke" --arg run "$run" '{{probe: $probe, spoke: $spoke, run: $run}}' > "$out/run.json"
+ln -sfn "$out" {RESULTS_DIR}/latest
+{upload}
+PROBE
+
+chmod +x /usr/local/bin/run-probe
+/usr/local/bin/run-probe
+'''
@@ -0,0 +1,235 @@
+'''Profiling hooks for program evaluation.
+
+Records where a preview or update spends its time in the program:
+
+- construction of each component (`HubVpc`, `SpokeVpc`, `SpokeWorkload`)
+  and of the firewall policy (`create_firewall_policy`), via `@profiled`,
+- each `apply` callback, attributed to the component that registered it,
+- each invoke made through the invoke cache, and
+- the number of resources registered while each component was being built.
+
+The time not accounted for by any of these is time spent waiting on the
+engine (or on Outputs that haven't resolved yet).
+
+Profiling is off by default. Enable it with the `profile` config value or
+the `PULUMI_PROGRAM_PROFILE` environment variable, set to `true` (which
+writes `.profile/<stack>.trace.json`) or to the path of the trace file. When
+the program exits we write a Chrome trace (open it in chrome://tracing or
+https://ui.perfetto.dev) and print a summary table.'''
+import atexit
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pulumi
+
+ENVIRONMENT_VARIABLE = "PULUMI_PROGRAM_PROFILE"
+
+_profiler: Optional["Profiler"] = None
+_profiler_lock = threading.Lock()
+_original_apply = pulumi.Output.apply
+
+
+class Profiler:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.events: List[Dict[str, Any]] = []
+        self.resources: collections.Counter = collections.Counter()
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _components(self) -> List[str]:
+        '''The components under construction on this thread, innermost last.'''
+        if not hasattr(self._local, "components"):
+            self._local.components = []
+        return self._local.components
+
+    def current_component(self) -> str:
+        return self._components[-1] if self._components else "program"
+
+    def _now(self) -> float:
+        '''Microseconds since profiling started, as Chrome traces expect.'''
+        return (time.perf_counter() - self._start) * 1e6
+
+    def _record(self, category: str, name: str, component: str, start: float) -> None:
+        event = {
+            "ph": "X",
+            "cat": category,
+            "name": name,
+            "ts": start,
+            "dur": self._now() - start,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"component": component},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def construct(self, kind: str, name: str, fn: Callable[[], Any]) -> Any:
+        component = f"{kind}:{name}" if name else kind
+        self._components.append(component)
+        start = self._now()
+        try:
+            return fn()
+        finally:
+            self._components.pop()
+            self._record("construct", kind, component, start)
+
+    def wrap_apply(self, func: Callable[[Any], Any]) -> Callable[[Any], Any]:
+        '''Wraps an `apply` callback so its time is recorded against the
+        component that registered it.'''
+        component = self.current_component()
+
+        @functools.wraps(func)
+        def timed(value):
+            self._components.append(component)
+            start = self._now()
+            try:
+                return func(value)
+            finally:
+                self._components.pop()
+                self._record("apply", getattr(func, "__qualname__", "apply"), component, start)
+
+        return timed
+
+    def invoke(self, token: str, fn: Callable[[], Any]) -> Any:
+        component = self.current_component()
+        start = self._now()
+        try:
+            return fn()
+        finally:
+            self._record("invoke", token, component, start)
+
+    def count_resource(self, args: pulumi.ResourceTransformationArgs) -> None:
+        '''A stack transformation that counts registrations (and changes
+        nothing).'''
+        if args.opts is not None and args.opts.urn:
+            # A reference to an existing resource (e.g. the subnets in an
+            # awsx Vpc's outputs) rather than a registration.
+            return None
+        with self._lock:
+            self.resources[self.current_component()] += 1
+        return None
+
+    def summary(self) -> List[Dict[str, Any]]:
+        '''Totals per component type, slowest first.'''
+        rows: Dict[str, Dict[str, Any]] = {}
+
+        def row(component: str) -> Dict[str, Any]:
+            kind = component.split(":", 1)[0]
+            return rows.setdefault(kind, {
+                "component": kind, "count": 0, "construct_ms": 0.0, "applies": 0,
+                "apply_ms": 0.0, "invokes": 0, "invoke_ms": 0.0, "resources": 0})
+
+        for event in self.events:
+            totals = row(event["args"]["component"])
+            milliseconds = event["dur"] / 1000
+            if event["cat"] == "construct":
+                totals["count"] += 1
+                totals["construct_ms"] += milliseconds
+            elif event["cat"] == "apply":
+                totals["applies"] += 1
+                totals["apply_ms"] += milliseconds
+            elif event["cat"] == "invoke":
+                totals["invokes"] += 1
+                totals["invoke_ms"] += milliseconds
+
+        # Including those registered later from the component's applies:
+        for component, count in self.resources.items():
+            row(component)["resources"] += count
+
+        return sorted(rows.values(), key=lambda totals: -(totals["construct_ms"] + totals["apply_ms"]))
+
+    def format_summary(self) -> str:
+        lines = [f"{'component':<24} {'count':>6} {'construct ms':>13} {'applies':>8} "
+                 f"{'apply ms':>10} {'invokes':>8} {'invoke ms':>10} {'resources':>10}"]
+        for row in self.summary():
+            lines.append(
+                f"{row['component']:<24} {row['count']:>6} {row['construct_ms']:>13.1f} {row['applies']:>8} "
+                f"{row['apply_ms']:>10.1f} {row['invokes']:>8} {row['invoke_ms']:>10.1f} {row['resources']:>10}")
+        lines.append(f"total wall time: {self._now() / 1e6:.2f}s")
+        return "\n".join(lines)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def start(config: Optional[pulumi.Config] = None) -> Optional[Profiler]:
+    '''Starts profiling if it's enabled in config or the environment. Call
+    this before creating any resources.'''
+    global _profiler
+    setting = os.environ.get(ENVIRONMENT_VARIABLE) or (config or pulumi.Config()).get("profile")
+    if not setting or setting.lower() in ("false", "0", "off"):
+        return None
+
+    path = setting
+    if setting.lower() in ("true", "1", "on"):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            ".profile", f"{pulumi.get_stack()}.trace.json")
+
+    with _profiler_lock:
+        if _profiler is not None:
+            return _profiler
+        _profiler = Profiler(path)
+        pulumi.runtime.register_stack_transformation(_profiler.count_resource)
+        pulumi.Output.apply = _profiled_apply
+        atexit.register(_report, _profiler)
+        return _profiler
+
+
+def stop() -> Optional[Profiler]:
+    '''Stops profiling, writes the trace and returns the profiler. Used when
+    evaluating the program several times in one process.'''
+    global _profiler
+    with _profiler_lock:
+        profiler, _profiler = _profiler, None
+        pulumi.Output.apply = _original_apply
+        if profiler is not None:
+            atexit.unregister(_report)
+            profiler.save()
+        return profiler
+
+
+def profiled(kind: str) -> Callable:
+    '''Records calls to the decorated component `__init__` (or function)
+    when profiling is on. For a component, the resource name (the first
+    argument after `self`) identifies the instance.'''
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return fn(*args, **kwargs)
+            name = args[1] if fn.__name__ == "__init__" and len(args) > 1 else ""
+            return profiler.construct(kind, name, lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorate
+
+
+def invoke(token: str, fn: Callable[[], Any]) -> Any:
+    '''Calls `fn` (an invoke), recording its latency when profiling is on.'''
+    profiler = _profiler
+    if profiler is None:
+        return fn()
+    return profiler.invoke(token, fn)
+
+
+def _profiled_apply(self, func, run_with_unknowns: bool = False):
+    profiler = _profiler
+    if profiler is not None:
+        func = profiler.wrap_apply(func)
+    return _original_apply(self, func, run_with_unknowns)
+
+
+def _report(profiler: Profiler) -> None:
+    profiler.save()
+    print(profiler.format_summary())
+    print(f"trace written to {profiler.path}")
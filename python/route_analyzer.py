@@ -0,0 +1,509 @@
+'''Traces traffic through the VPC and Transit Gateway route tables the
+program registers, offline, so routing mistakes show up before `pulumi up`
+rather than as dropped traffic.
+
+Routing is spread across `__main__.py` (the TGW route tables), `HubVpc` and
+`SpokeVpc`. `RouteGraph` puts it back together from resource state: either
+the registrations recorded by `mock_runtime.ProgramMocks` or the resources of
+`pulumi stack export`. Each VPC and TGW route table is indexed as a radix
+trie, so each hop is a longest-prefix-match lookup, the same way AWS picks a
+route:
+
+    graph = RouteGraph.from_mocks(mock_runtime.run_main("__main__.py"))
+    print(graph.path("spoke1-vpc-private-1", "8.8.8.8"))
+    findings = graph.check_pairs(graph.subnets_named("private"))
+
+`check_pairs` traces every pair of subnets both ways and reports blackholes
+and asymmetric pairs, whose traffic crosses different firewall endpoints or
+NAT gateways on the way out than on the way back. Stateful middleboxes drop
+asymmetric traffic.
+
+Traffic between AZs is where asymmetry usually shows up. The TGW delivers
+into an attachment in the AZ the traffic arrived from, so the two
+directions of a cross-AZ flow would reach the inspection VPC in different
+AZs. An attachment with appliance mode enabled instead gets one AZ per
+flow, used both ways. The graph models that choice as the lower of the
+two endpoints' AZs, which is the same in either direction.'''
+import ipaddress
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from route_summarization import summarize_routes
+
+DELIVERED = "delivered"
+INTERNET = "internet"
+BLACKHOLE = "blackhole"
+LOOP = "loop"
+
+# Hops that keep per-connection state, so traffic must cross the same one in
+# both directions:
+STATEFUL_HOPS = ("firewall-endpoint", "nat-gateway")
+
+_MAX_HOPS = 32
+
+
+class Route(NamedTuple):
+    prefix: str
+    prefixlen: int
+    target: object
+
+
+class RadixTrie:
+    '''A binary trie over IPv4 prefixes supporting longest-prefix match.'''
+
+    def __init__(self) -> None:
+        # Each node is [child for bit 0, child for bit 1, Route]:
+        self._root: list = [None, None, None]
+
+    def insert(self, network: ipaddress.IPv4Network, target, replace: bool = True) -> None:
+        node = self._root
+        address = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (address >> (31 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if replace or node[2] is None:
+            node[2] = Route(str(network), network.prefixlen, target)
+
+    def longest_match(self, address: int) -> Optional[Route]:
+        node, match = self._root, self._root[2]
+        for i in range(32):
+            node = node[(address >> (31 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
+
+    def routes(self) -> List[Route]:
+        '''Every route in the trie, shortest prefixes first.'''
+        routes, level = [], [self._root]
+        while level:
+            routes += [node[2] for node in level if node[2] is not None]
+            level = [child for node in level for child in node[:2] if child is not None]
+        return routes
+
+
+@dataclass(frozen=True)
+class Hop:
+    kind: str
+    id: str
+    zone: Optional[str] = None
+    # The prefix of the route that was followed out of this hop:
+    route: Optional[str] = None
+
+    def __str__(self) -> str:
+        zone = f" ({self.zone})" if self.zone else ""
+        route = f" via {self.route}" if self.route else ""
+        return f"{self.kind} {self.id}{zone}{route}"
+
+
+@dataclass
+class Path:
+    source: str
+    destination: str
+    hops: Tuple[Hop, ...]
+    outcome: str
+    # Why the path ended in a blackhole or loop:
+    reason: str = ""
+
+    @property
+    def stateful_hops(self) -> Tuple[Hop, ...]:
+        return tuple(hop for hop in self.hops if hop.kind in STATEFUL_HOPS)
+
+    def __str__(self) -> str:
+        lines = [f"{self.source} -> {self.destination}: {self.outcome}"
+                 + (f" ({self.reason})" if self.reason else "")]
+        lines += [f"  {hop}" for hop in self.hops]
+        return "\n".join(lines)
+
+
+@dataclass
+class Findings:
+    paths_checked: int = 0
+    blackholes: List[Path] = field(default_factory=list)
+    # Pairs of paths, there and back, that cross different stateful hops:
+    asymmetric: List[Tuple[Path, Path]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.blackholes and not self.asymmetric
+
+
+@dataclass
+class _Subnet:
+    id: str
+    name: str
+    vpc_id: str
+    zone: Optional[str]
+    cidr: Optional[ipaddress.IPv4Network]
+    route_table_id: Optional[str] = None
+
+
+@dataclass
+class _Vpc:
+    id: str
+    name: str
+    cidr: ipaddress.IPv4Network
+    attachment_id: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        self.network = int(self.cidr.network_address)
+        self.netmask = int(self.cidr.netmask)
+
+
+@dataclass
+class _Attachment:
+    id: str
+    vpc_id: str
+    subnet_ids: Sequence[str]
+    route_table_id: Optional[str] = None
+    appliance_mode: bool = False
+    # The subnet the TGW delivers to in each AZ:
+    subnet_by_zone: Dict[Optional[str], str] = field(default_factory=dict)
+
+
+class RouteGraph:
+    '''The route tables, attachments and gateways of a deployment.
+
+    `resources` are `(type, name, id, state)` tuples, where `state` has the
+    resource's inputs and outputs with camelCase keys as Pulumi records them.'''
+
+    def __init__(self, resources: Iterable[Tuple[str, str, str, Mapping]]) -> None:
+        self.vpcs: Dict[str, _Vpc] = {}
+        self.subnets: Dict[str, _Subnet] = {}
+        self._route_tables: Dict[str, RadixTrie] = {}
+        self._tgw_route_tables: Dict[str, RadixTrie] = {}
+        self._attachments: Dict[str, _Attachment] = {}
+        self._nat_gateways: Dict[str, str] = {}
+        # Firewall endpoint ID -> the subnet it's in:
+        self._endpoints: Dict[str, str] = {}
+        # Subnet CIDR -> AZ, to find the AZ a destination address is in:
+        self._zones = RadixTrie()
+        self._cache: Dict[Tuple, Tuple] = {}
+        self._hops: Dict[Tuple, Hop] = {}
+
+        by_type: Dict[str, List[Tuple[str, str, Mapping]]] = {}
+        for typ, name, resource_id, state in resources:
+            by_type.setdefault(typ, []).append((name, resource_id, state))
+
+        def each(typ: str):
+            return by_type.get(typ, [])
+
+        for name, resource_id, state in each("awsx:ec2:Vpc"):
+            if state.get("vpcId") and state.get("cidrBlock"):
+                self.vpcs[state["vpcId"]] = _Vpc(
+                    state["vpcId"], name, ipaddress.ip_network(state["cidrBlock"]))
+        for name, resource_id, state in each("aws:ec2/vpc:Vpc"):
+            if resource_id not in self.vpcs and state.get("cidrBlock"):
+                self.vpcs[resource_id] = _Vpc(
+                    resource_id, _name(name, state), ipaddress.ip_network(state["cidrBlock"]))
+
+        for name, resource_id, state in each("aws:ec2/subnet:Subnet"):
+            self.subnets[resource_id] = _Subnet(
+                id=resource_id,
+                name=_name(name, state),
+                vpc_id=state.get("vpcId"),
+                zone=state.get("availabilityZone"),
+                cidr=ipaddress.ip_network(state["cidrBlock"]) if state.get("cidrBlock") else None,
+            )
+            if self.subnets[resource_id].cidr is not None:
+                self._zones.insert(self.subnets[resource_id].cidr, state.get("availabilityZone"))
+
+        for name, resource_id, state in each("aws:ec2/routeTable:RouteTable"):
+            self._route_tables[resource_id] = RadixTrie()
+        for name, resource_id, state in each("aws:ec2/routeTableAssociation:RouteTableAssociation"):
+            if state.get("subnetId") in self.subnets:
+                self.subnets[state["subnetId"]].route_table_id = state.get("routeTableId")
+        for name, resource_id, state in each("aws:ec2/route:Route"):
+            if state.get("destinationCidrBlock"):
+                self._route_tables.setdefault(state["routeTableId"], RadixTrie()).insert(
+                    ipaddress.ip_network(state["destinationCidrBlock"]), _vpc_target(state))
+
+        for name, resource_id, state in each("aws:ec2/natGateway:NatGateway"):
+            self._nat_gateways[resource_id] = state.get("subnetId")
+        for name, resource_id, state in each("aws:networkfirewall/firewall:Firewall"):
+            for status in state.get("firewallStatuses") or []:
+                for sync_state in status.get("syncStates") or []:
+                    for attachment in sync_state.get("attachments") or []:
+                        self._endpoints[attachment["endpointId"]] = attachment["subnetId"]
+
+        for name, resource_id, state in each("aws:ec2transitgateway/vpcAttachment:VpcAttachment"):
+            attachment = self._attachments[resource_id] = _Attachment(
+                resource_id, state.get("vpcId"), state.get("subnetIds") or [],
+                appliance_mode=state.get("applianceModeSupport") == "enable")
+            for subnet_id in reversed(attachment.subnet_ids):
+                if subnet_id in self.subnets:
+                    attachment.subnet_by_zone[self.subnets[subnet_id].zone] = subnet_id
+            if state.get("vpcId") in self.vpcs:
+                self.vpcs[state["vpcId"]].attachment_id = resource_id
+        for name, resource_id, state in each("aws:ec2transitgateway/routeTable:RouteTable"):
+            self._tgw_route_tables[resource_id] = RadixTrie()
+        for name, resource_id, state in each("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation"):
+            if state.get("transitGatewayAttachmentId") in self._attachments:
+                self._attachments[state["transitGatewayAttachmentId"]].route_table_id = \
+                    state.get("transitGatewayRouteTableId")
+        # Static routes take precedence over propagated ones for the same
+        # prefix, so insert them first and don't let propagations replace
+        # them:
+        for name, resource_id, state in each("aws:ec2transitgateway/route:Route"):
+            target = "blackhole" if state.get("blackhole") else state.get("transitGatewayAttachmentId")
+            self._tgw_route_tables.setdefault(state["transitGatewayRouteTableId"], RadixTrie()).insert(
+                ipaddress.ip_network(state["destinationCidrBlock"]), target)
+        for name, resource_id, state in each("aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation"):
+            attachment = self._attachments.get(state.get("transitGatewayAttachmentId"))
+            vpc = self.vpcs.get(attachment.vpc_id) if attachment else None
+            if vpc is not None:
+                self._tgw_route_tables.setdefault(state["transitGatewayRouteTableId"], RadixTrie()).insert(
+                    vpc.cidr, attachment.id, replace=False)
+
+    @classmethod
+    def from_mocks(cls, mocks) -> "RouteGraph":
+        '''Builds the graph from a `mock_runtime.ProgramMocks` run.'''
+        return cls(mocks.registrations)
+
+    @classmethod
+    def from_stack_export(cls, deployment: Mapping) -> "RouteGraph":
+        '''Builds the graph from the output of `pulumi stack export`.'''
+        return cls(
+            (resource["type"], resource["urn"].split("::")[-1], resource.get("id"),
+             {**resource.get("inputs", {}), **resource.get("outputs", {})})
+            for resource in deployment["deployment"]["resources"]
+        )
+
+    def summarized_tgw_routes(self, protected: Sequence[str] = ()) -> Dict[str, Dict[str, object]]:
+        '''Returns each TGW route table summarized with `summarize_routes`,
+        which forwards every address as before and never newly covers an
+        address without a route, or one in `protected` (e.g. space reserved
+        for spokes yet to come). Compare the sizes with `tgw_route_counts` to
+        see what summarizing would save.'''
+        return {
+            table_id: summarize_routes({route.prefix: route.target for route in routes.routes()}, protected)
+            for table_id, routes in self._tgw_route_tables.items()
+        }
+
+    def tgw_route_counts(self) -> Dict[str, int]:
+        return {table_id: len(routes.routes()) for table_id, routes in self._tgw_route_tables.items()}
+
+    def subnets_named(self, subnet_name: str) -> List[str]:
+        '''Returns the names of the subnets of every VPC created from the awsx
+        subnet spec `subnet_name`, e.g. "private".'''
+        infix = f"-{subnet_name}-"
+        return sorted(
+            subnet.name for subnet in self.subnets.values()
+            if infix in subnet.name and subnet.name.rsplit("-", 1)[-1].isdigit()
+        )
+
+    def path(self, source: str, destination: str) -> Path:
+        '''Traces traffic from the subnet `source` (a name or ID) to the
+        address `destination`.'''
+        subnet = self._subnet(source)
+        address = int(ipaddress.IPv4Address(destination))
+        hops, outcome, reason, _ = self._walk(("subnet", subnet.id), address, 0)
+        return Path(subnet.name, destination, hops, outcome, reason)
+
+    def check_pairs(self, subnets: Sequence[str]) -> Findings:
+        '''Traces traffic between every two of `subnets` that are in different
+        VPCs, in the same AZ or not, both ways, reporting blackholes and
+        asymmetric pairs.
+
+        Paths are only built for findings; everything else stays as the
+        cached tuples `_walk` returns. Past its first hop, a path depends
+        only on the TGW route table, the AZ and the destination, so checking
+        every pair of a large fleet stays affordable.'''
+        subnets = [self._subnet(subnet) for subnet in subnets]
+        addresses = [self._representative(subnet) for subnet in subnets]
+
+        findings = Findings()
+        for i, a in enumerate(subnets):
+            start = ("subnet", a.id)
+            for j in range(i + 1, len(subnets)):
+                b = subnets[j]
+                if a.vpc_id == b.vpc_id:
+                    continue
+                there = self._walk(start, addresses[j], 0, cache=False)
+                back = self._walk(("subnet", b.id), addresses[i], 0, cache=False)
+                findings.paths_checked += 2
+
+                if there[1] != DELIVERED:
+                    findings.blackholes.append(Path(a.name, b.name, *there[:3]))
+                if back[1] != DELIVERED:
+                    findings.blackholes.append(Path(b.name, a.name, *back[:3]))
+                if (there[1] == back[1] == DELIVERED
+                        and there[3] != tuple(reversed(back[3]))):
+                    findings.asymmetric.append((
+                        Path(a.name, b.name, *there[:3]),
+                        Path(b.name, a.name, *back[:3])))
+
+        return findings
+
+    def check_egress(self, sources: Sequence[str], destination: str = "8.8.8.8") -> Findings:
+        '''Traces traffic from each source subnet to the internet address
+        `destination`, and the replies back from the NAT gateway it leaves
+        through, reporting blackholes and asymmetric paths.'''
+        findings = Findings()
+        for source in sources:
+            subnet = self._subnet(source)
+            there = self.path(subnet.id, destination)
+            findings.paths_checked += 1
+            if there.outcome != INTERNET:
+                findings.blackholes.append(there)
+                continue
+
+            nat = there.hops[-1]
+            hops, outcome, reason, _ = self._walk(
+                ("subnet", self._nat_gateways[nat.id]), self._representative(subnet), 0)
+            back = Path(destination, subnet.name, (nat, *hops), outcome, reason)
+            findings.paths_checked += 1
+            if outcome != DELIVERED:
+                findings.blackholes.append(back)
+            elif there.stateful_hops != tuple(reversed(back.stateful_hops)):
+                findings.asymmetric.append((there, back))
+        return findings
+
+    def _subnet(self, name_or_id: str) -> _Subnet:
+        if name_or_id in self.subnets:
+            return self.subnets[name_or_id]
+        for subnet in self.subnets.values():
+            if subnet.name == name_or_id:
+                return subnet
+        raise KeyError(f"No subnet named '{name_or_id}'.")
+
+    def _representative(self, subnet: _Subnet) -> int:
+        '''An address in `subnet`, after the 4 addresses AWS reserves.'''
+        network = subnet.cidr or self.vpcs[subnet.vpc_id].cidr
+        return int(network.network_address) + min(4, network.num_addresses - 1)
+
+    def _walk(self, node: Tuple, address: int, depth: int, cache: bool = True):
+        '''Follows routes from `node` to `address`, returning the hops, the
+        outcome, why it failed (if it did) and the stateful hops crossed.
+        Results are cached by node and address: the rest of a path doesn't
+        depend on how traffic got there. Pass `cache=False` for a node that
+        won't be visited again with this address, e.g. the start of each
+        pair in `check_pairs`.'''
+        key = (node, address)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        if depth > _MAX_HOPS:
+            return (), LOOP, f"more than {_MAX_HOPS} hops", ()
+
+        # Mark the node as in progress so a cycle ends as a loop:
+        self._cache[key] = ((), LOOP, f"routing loop at {node[1]}", ())
+        hop, next_node, outcome, reason = self._step(node, address)
+        stateful = (hop,) if hop.kind in STATEFUL_HOPS else ()
+        if next_node is None:
+            result = ((hop,), outcome, reason, stateful)
+        else:
+            hops, outcome, reason, rest = self._walk(next_node, address, depth + 1)
+            result = ((hop, *hops), outcome, reason, stateful + rest)
+        if cache:
+            self._cache[key] = result
+        else:
+            del self._cache[key]
+        return result
+
+    def _hop(self, kind: str, hop_id: str, zone: Optional[str] = None, route=None) -> Hop:
+        '''Returns a shared Hop, so the millions of paths of a large check
+        don't each allocate their own.'''
+        key = (kind, hop_id, zone, route)
+        hop = self._hops.get(key)
+        if hop is None:
+            hop = self._hops[key] = Hop(kind, hop_id, zone, None if route is None else str(route))
+        return hop
+
+    def _step(self, node: Tuple, address: int):
+        '''Returns the hop for `node` and the next node, or the outcome if
+        traffic ends here.'''
+        kind, node_id = node[0], node[1]
+
+        if kind == "subnet":
+            subnet = self.subnets[node_id]
+            vpc = self.vpcs.get(subnet.vpc_id)
+            routes = self._route_tables.get(subnet.route_table_id)
+            if routes is None:
+                return self._hop("subnet", subnet.name, subnet.zone), None, BLACKHOLE, "no route table"
+
+            match = routes.longest_match(address)
+            # The local route can't be overridden by a less specific route:
+            if vpc is not None and (address & vpc.netmask) == vpc.network \
+                    and (match is None or match.prefixlen <= vpc.cidr.prefixlen):
+                return self._hop("subnet", subnet.name, subnet.zone, "local"), None, DELIVERED, ""
+            if match is None:
+                return self._hop("subnet", subnet.name, subnet.zone), None, BLACKHOLE, "no route"
+
+            target_kind, target_id = match.target
+            hop = self._hop("subnet", subnet.name, subnet.zone, match.prefix)
+            if target_kind == "transit-gateway":
+                if vpc is None or vpc.attachment_id is None:
+                    return hop, None, BLACKHOLE, "VPC has no TGW attachment"
+                route_table_id = self._attachments[vpc.attachment_id].route_table_id
+                if route_table_id not in self._tgw_route_tables:
+                    return hop, None, BLACKHOLE, \
+                        f"attachment {vpc.attachment_id} has no route table association"
+                # Where traffic goes next depends only on the TGW route table
+                # and AZ, not the attachment, so every spoke sharing a route
+                # table shares the rest of its paths in the cache:
+                return hop, ("tgw", route_table_id, subnet.zone), None, ""
+            if target_kind == "nat-gateway":
+                return hop, ("nat", target_id), None, ""
+            if target_kind == "vpc-endpoint" and target_id in self._endpoints:
+                return hop, ("endpoint", target_id), None, ""
+            if target_kind == "gateway":
+                return hop, None, INTERNET, ""
+            return hop, None, BLACKHOLE, f"unknown target {target_id}"
+
+        if kind == "nat":
+            subnet = self.subnets.get(self._nat_gateways.get(node_id))
+            hop = self._hop("nat-gateway", node_id, subnet.zone if subnet else None)
+            if _is_private(address):
+                return hop, None, BLACKHOLE, "NAT gateway can't reach a private address"
+            return hop, None, INTERNET, ""
+
+        if kind == "endpoint":
+            subnet = self.subnets.get(self._endpoints[node_id])
+            hop = self._hop("firewall-endpoint", node_id, subnet.zone if subnet else None)
+            if subnet is None:
+                return hop, None, BLACKHOLE, "endpoint subnet unknown"
+            # Inspected traffic leaves through the endpoint subnet's routes:
+            return hop, ("subnet", subnet.id), None, ""
+
+        # kind == "tgw": traffic arriving at a TGW route table, in a zone.
+        zone = node[2]
+        match = self._tgw_route_tables[node_id].longest_match(address)
+        if match is None:
+            return self._hop("tgw-route-table", node_id, zone), None, BLACKHOLE, "no route"
+
+        hop = self._hop("tgw-route-table", node_id, zone, match.prefix)
+        attachment = self._attachments.get(match.target)
+        if attachment is None:
+            return hop, None, BLACKHOLE, "blackhole route"
+        if not attachment.subnet_ids:
+            return hop, None, BLACKHOLE, f"attachment {attachment.id} has no subnets"
+        # The TGW delivers into the attachment's subnet in the same AZ when
+        # it has one. In appliance mode it picks one AZ per flow for both
+        # directions (see the module docstring):
+        if attachment.appliance_mode and zone is not None:
+            destination = self._zones.longest_match(address)
+            if destination is not None and destination.target is not None:
+                zone = min(zone, destination.target)
+        return hop, ("subnet", attachment.subnet_by_zone.get(zone, attachment.subnet_ids[0])), None, ""
+
+
+def _vpc_target(state: Mapping) -> Tuple[str, Optional[str]]:
+    for key, kind in (("transitGatewayId", "transit-gateway"),
+                      ("natGatewayId", "nat-gateway"),
+                      ("vpcEndpointId", "vpc-endpoint"),
+                      ("gatewayId", "gateway")):
+        if state.get(key):
+            return kind, state[key]
+    return "unknown", None
+
+
+def _name(name: str, state: Mapping) -> str:
+    return (state.get("tags") or {}).get("Name") or name
+
+
+def _is_private(address: int) -> bool:
+    return ipaddress.IPv4Address(address).is_private
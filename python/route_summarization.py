@@ -0,0 +1,141 @@
+'''Summarizes a route table into the fewest routes that forward every address
+exactly as before.
+
+`collapse_addresses` alone only merges prefixes that are exactly adjacent. We
+use ORTC (Draves et al., "Constructing Optimal IP Routing Tables", 1999)
+instead, which also lets a summary cover a more specific route to a different
+target, since longest-prefix match still sends that range to its own target.
+For example, spokes behind one attachment at 10.0.0.0/24, 10.0.2.0/24 and
+10.0.3.0/24, plus a spoke behind another at 10.0.1.0/24, become two routes:
+10.0.0.0/22 and 10.0.1.0/24.
+
+A summary never newly covers an address that had no route, or a `protected`
+range (e.g. the hub VPC or space reserved for other uses) that no route
+covers. So traffic to unallocated space is still dropped rather than sent to
+a spoke, and a spoke added later doesn't inherit traffic meant for someone
+else. Protecting a range never changes where an address is forwarded: routes
+inside it, and routes covering it, still forward it as before.
+
+Targets are compared for equality only, so a TGW route table can only be
+summarized where several prefixes share an attachment: a spoke's VPC CIDR
+can't be merged with another spoke's, because each is behind its own
+attachment.'''
+import ipaddress
+from typing import Dict, Hashable, List, Mapping, Optional, Sequence, Set
+
+# The "target" of addresses that have no route, which no summary may cover:
+_UNROUTED = object()
+
+
+class _Node:
+    __slots__ = ("children", "target", "candidates")
+
+    def __init__(self) -> None:
+        self.children: List[Optional["_Node"]] = [None, None]
+        self.target = None
+        self.candidates: Set = set()
+
+
+def summarize_routes(
+    routes: Mapping[str, Hashable],
+    protected: Sequence[str] = (),
+) -> Dict[str, Hashable]:
+    '''Returns the fewest routes (prefix -> target) that, under longest-prefix
+    match, forward every address to the same target as `routes` and leave
+    every address without a route without one, whether or not it's in
+    `protected`.'''
+    networks = [(ipaddress.ip_network(prefix), target) for prefix, target in routes.items()]
+    if not networks:
+        return {}
+    max_prefixlen = networks[0][0].max_prefixlen
+
+    root = _Node()
+    root.target = _UNROUTED
+    for network, target in networks:
+        _insert(root, network, target, max_prefixlen)
+    # A protected range no route covers is unrouted, so no summary can newly
+    # cover it. The routes inside it are kept:
+    for prefix in protected:
+        _protect(root, ipaddress.ip_network(prefix), max_prefixlen)
+
+    _push_down(root, _UNROUTED)
+    _merge_candidates(root)
+
+    summarized: Dict[str, Hashable] = {}
+    _select(root, _UNROUTED, 0, 0, max_prefixlen, type(networks[0][0]), summarized)
+    return summarized
+
+
+def _insert(root: _Node, network, target, max_prefixlen: int) -> None:
+    node = root
+    address = int(network.network_address)
+    for depth in range(network.prefixlen):
+        bit = (address >> (max_prefixlen - 1 - depth)) & 1
+        if node.children[bit] is None:
+            node.children[bit] = _Node()
+        node = node.children[bit]
+    node.target = target
+
+
+def _protect(root: _Node, network, max_prefixlen: int) -> None:
+    node = root
+    address = int(network.network_address)
+    for depth in range(network.prefixlen):
+        if node.target not in (None, _UNROUTED):
+            # A route covers the range.
+            return
+        bit = (address >> (max_prefixlen - 1 - depth)) & 1
+        if node.children[bit] is None:
+            node.children[bit] = _Node()
+        node = node.children[bit]
+    if node.target is None:
+        node.target = _UNROUTED
+
+
+def _push_down(node: _Node, inherited) -> None:
+    '''ORTC pass 1: gives every node zero or two children and every leaf the
+    target that longest-prefix match gives its range.'''
+    target = node.target if node.target is not None else inherited
+    if node.children == [None, None]:
+        node.target = target
+        return
+    node.target = None
+    for bit in (0, 1):
+        if node.children[bit] is None:
+            node.children[bit] = _Node()
+        _push_down(node.children[bit], target)
+
+
+def _merge_candidates(node: _Node) -> None:
+    '''ORTC pass 2: the targets a node's route could have. Where some of its
+    range has no route, it can't have one either.'''
+    if node.children == [None, None]:
+        node.candidates = {node.target}
+        return
+    left, right = node.children
+    _merge_candidates(left)
+    _merge_candidates(right)
+    if _UNROUTED in left.candidates or _UNROUTED in right.candidates:
+        # Any route here would cover unrouted addresses:
+        node.candidates = {_UNROUTED}
+    else:
+        node.candidates = (left.candidates & right.candidates) or (left.candidates | right.candidates)
+
+
+def _select(node: _Node, inherited, address: int, depth: int, max_prefixlen: int,
+            network_type, summarized: Dict[str, Hashable]) -> None:
+    '''ORTC pass 3: emits a route only where the inherited target isn't one
+    of the node's candidates.'''
+    if inherited in node.candidates:
+        target = inherited
+    else:
+        # Candidates are unordered; sort so the output is deterministic:
+        target = min(node.candidates, key=repr)
+        summarized[str(network_type((address << (max_prefixlen - depth), depth)))] = target
+
+    if node.children == [None, None]:
+        return
+    for bit in (0, 1):
+        _select(node.children[bit], target, (address << 1) | bit, depth + 1,
+                max_prefixlen, network_type, summarized)
+
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Sequence
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence
 
 import json
 
@@ -7,20 +7,41 @@ import pulumi
 import pulumi_aws as aws
 import pulumi_awsx as awsx
 
+from flow_logs import FlowLogDestination
+from profiling import profiled
+from vpc_endpoints import DEFAULT_ENDPOINT_SERVICES, service_name
+from vpc_subnets import at_index, route_table_ids, subnet_ids_by_name
+
 
 @dataclass
 class SpokeVpcArgs:
     vpc_cidr_block: str
     tgw_id: pulumi.Input[str]
     tgw_route_table_id: pulumi.Input[str]
+    availability_zone_count: int = 3
+    # Pass the hub's AZs so every spoke attaches to the TGW in AZs that have
+    # a firewall endpoint. awsx picks the first availability_zone_count AZs
+    # if not supplied.
+    availability_zone_names: Optional[Sequence[str]] = None
+    endpoint_services: Sequence[str] = field(default_factory=lambda: list(DEFAULT_ENDPOINT_SERVICES))
+    # The hub's private hosted zone for each service, by service name. When
+    # supplied, the spoke uses the hub's endpoints through these instead of
+    # creating its own (see vpc_endpoints.py).
+    endpoint_zone_ids: Optional[pulumi.Input[Dict[str, str]]] = None
+    # Log the VPC's flows to S3 (see flow_logs.py). No flow log if not
+    # supplied.
+    flow_logs: Optional[FlowLogDestination] = None
 
 
 class SpokeVpc(pulumi.ComponentResource):
+    @profiled("SpokeVpc")
     def __init__(self, name: str, args: SpokeVpcArgs, opts: pulumi.ResourceOptions = None) -> None:
         super().__init__("awsAdvancedNetworkingWorkshop:index:SpokeVpc", name, None, opts)
 
         self._name = name
         self._args = args
+        self.availability_zone_count = len(
+            args.availability_zone_names or []) or args.availability_zone_count
 
         # Spoke VPCs don't have a need for public subnets because all egress to the
         # internet will flow through the TGW and out the inspection VPC.
@@ -53,40 +74,35 @@ class SpokeVpc(pulumi.ComponentResource):
                 ),
                 enable_dns_hostnames=True,
                 enable_dns_support=True,
+                # awsx accepts only one of these:
+                **({"availability_zone_names": args.availability_zone_names}
+                   if args.availability_zone_names else
+                   {"number_of_availability_zones": args.availability_zone_count}),
             )
         )
 
-        tgw_subnets = aws.ec2.get_subnets_output(
-            filters=[
-                aws.ec2.GetSubnetFilterArgs(
-                    name="tag:Name",
-                    values=[f"{name}-vpc-tgw-*"],
-                ),
-                aws.ec2.GetSubnetFilterArgs(
-                    name="vpc-id",
-                    values=[self.vpc.vpc_id],
-                ),
-            ]
-        )
-
-        tgw_subnets = aws.ec2.get_subnets_output(
-            filters=[
-                aws.ec2.GetSubnetFilterArgs(
-                    name="tag:Name",
-                    values=[f"{self._name}-vpc-tgw-*"],
-                ),
-                aws.ec2.GetSubnetFilterArgs(
-                    name="vpc-id",
-                    values=[self.vpc.vpc_id],
+        # Reading the subnets from the Vpc's own outputs rather than calling
+        # get_subnets means a spoke costs no AWS API calls at plan time, and
+        # is stable and descriptive in case we change the subnet type above:
+        self.tgw_subnet_ids = subnet_ids_by_name(
+            self.vpc, f"{name}-vpc", "tgw")
+        self.workload_subnet_ids = subnet_ids_by_name(
+            self.vpc, f"{name}-vpc", "private")
+
+        if args.flow_logs:
+            args.flow_logs.create_flow_log(
+                name,
+                self.vpc.vpc_id,
+                opts=pulumi.ResourceOptions(
+                    parent=self,
                 ),
-            ]
-        )
+            )
 
         self.tgw_attachment = aws.ec2transitgateway.VpcAttachment(
             f"{name}-tgw-vpc-attachment",
             aws.ec2transitgateway.VpcAttachmentArgs(
                 transit_gateway_id=args.tgw_id,
-                subnet_ids=tgw_subnets.apply(lambda x: x.ids),
+                subnet_ids=self.tgw_subnet_ids,
                 vpc_id=self.vpc.vpc_id,
                 transit_gateway_default_route_table_association=False,
                 transit_gateway_default_route_table_propagation=False,
@@ -125,28 +141,20 @@ class SpokeVpc(pulumi.ComponentResource):
             ),
         )
 
-        # Using get_subnets rather than vpc.isolated_subnet_ids because it's more
-        # stable (in case we change the subnet type above) and descriptive:
-        private_subnets = aws.ec2.get_subnets_output(
-            filters=[
-                aws.ec2.GetSubnetFilterArgs(
-                    name="tag:Name",
-                    values=[f"{self._name}-vpc-private-*"],
-                ),
-                aws.ec2.GetSubnetFilterArgs(
-                    name="vpc-id",
-                    values=[self.vpc.vpc_id],
-                ),
-            ]
-        )
-        self.workload_subnet_ids = private_subnets.ids
+        if args.endpoint_zone_ids is not None:
+            self._associate_endpoint_zones(args.endpoint_zone_ids)
+        else:
+            self._create_vpc_endpoints(self.workload_subnet_ids)
+        self._create_routes(self.workload_subnet_ids)
 
-        private_subnets.apply(lambda x: self._create_vpc_endpoints(x.ids))
-        private_subnets.apply(lambda x: self._create_routes(x.ids))
+        self.register_outputs({
+            "vpc": self.vpc,
+            "workload_subnet_ids": self.workload_subnet_ids
+        })
 
     def _create_vpc_endpoints(
         self,
-        subnet_ids: Sequence[str]
+        subnet_ids: pulumi.Input[Sequence[str]]
     ):
         vpc_endpoint_sg = aws.ec2.SecurityGroup(
             f"{self._name}-vpc-endpoint-sg",
@@ -173,12 +181,12 @@ class SpokeVpc(pulumi.ComponentResource):
             )
         )
 
-        for service in ["ec2messages", "ssmmessages", "ssm"]:
+        for service in self._args.endpoint_services:
             aws.ec2.VpcEndpoint(
                 f"{self._name}-endpoint-{service}",
                 aws.ec2.VpcEndpointArgs(
                     vpc_id=self.vpc.vpc_id,
-                    service_name=f"com.amazonaws.{aws.config.region}.{service}",
+                    service_name=service_name(service, aws.config.region),
                     private_dns_enabled=True,
                     security_group_ids=[vpc_endpoint_sg.id],
                     vpc_endpoint_type="Interface",
@@ -189,21 +197,40 @@ class SpokeVpc(pulumi.ComponentResource):
                 )
             )
 
+    def _associate_endpoint_zones(self, zone_ids: pulumi.Input[Dict[str, str]]):
+        '''Resolves the services' DNS names to the hub's endpoints, which
+        the spoke reaches through its default route to the TGW.'''
+        def zone_id(ids: Dict[str, str], service: str) -> str:
+            if service not in ids:
+                raise Exception(
+                    f"The hub has no VPC endpoint for '{service}'. Add it to vpc-endpoint-services in the hub stack.")
+            return ids[service]
+
+        zone_ids = pulumi.Output.from_input(zone_ids)
+        for service in self._args.endpoint_services:
+            aws.route53.ZoneAssociation(
+                f"{self._name}-endpoint-{service}-zone-association",
+                aws.route53.ZoneAssociationArgs(
+                    zone_id=zone_ids.apply(lambda ids, service=service: zone_id(ids, service)),
+                    vpc_id=self.vpc.vpc_id,
+                ),
+                pulumi.ResourceOptions(
+                    parent=self,
+                ),
+            )
+
     def _create_routes(
         self,
-        private_subnet_ids: Sequence[str],
+        private_subnet_ids: pulumi.Input[Sequence[str]],
     ):
+        private_route_table_ids = route_table_ids(self.vpc, private_subnet_ids)
 
-        for subnet_id in private_subnet_ids:
-            route_table = aws.ec2.get_route_table(
-                subnet_id=subnet_id,
-            )
-
+        for i in range(self.availability_zone_count):
             # Direct egress for anything outside this VPC to the Transit Gateway:
             aws.ec2.Route(
-                f"spoke{self._name}-tgw-route-{subnet_id}",
+                f"{self._name}-private-{i+1}-tgw-route",
                 aws.ec2.RouteArgs(
-                    route_table_id=route_table.id,
+                    route_table_id=at_index(private_route_table_ids, i),
                     destination_cidr_block="0.0.0.0/0",
                     transit_gateway_id=self._args.tgw_id,
                 ),
@@ -212,8 +239,3 @@ class SpokeVpc(pulumi.ComponentResource):
                     parent=self,
                 ),
             )
-
-        self.register_outputs({
-            "vpc": self.vpc,
-            "workload_subnet_ids": self.workload_subnet_ids
-        })
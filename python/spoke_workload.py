@@ -1,29 +1,89 @@
 from dataclasses import dataclass
+from typing import List, Optional, Sequence
 
 import json
 
 import pulumi
 import pulumi_aws as aws
 
+import invoke_cache
+from probe import HTTP_PORT, IPERF3_PORT, ProbeSettings, place_probes, probe_schedule, probe_user_data
+from profiling import profiled
+from vpc_subnets import at_index
+
 
 @dataclass
 class SpokeWorkloadArgs:
     spoke_vpc_id: pulumi.Input[str]
     spoke_instance_subnet_id: str
+    # Looked up per workload if not supplied. Pass the result of
+    # get_amazon_linux_2_ami_id() when creating many workloads so the lookup
+    # happens once.
+    ami_id: Optional[pulumi.Input[str]] = None
+    # Set to run throughput probes (see probe.py) instead of the single
+    # connectivity-check instance:
+    probe: Optional[ProbeSettings] = None
+    # Probe mode only: the subnets to spread probes across (one per AZ), the
+    # CIDR block other probes reach this one from, the tag value shared by
+    # every probe in the stack and the total number of probes in it.
+    probe_subnet_ids: Optional[pulumi.Output[List[str]]] = None
+    probe_availability_zone_count: int = 3
+    probe_ingress_cidr_block: Optional[str] = None
+    probe_group: Optional[str] = None
+    probe_count: int = 0
+    # The workload spokes in the stack, which the probes take turns
+    # measuring (see probe.probe_schedule):
+    probe_spokes: Sequence[str] = ()
+
+
+def get_amazon_linux_2_ami_id() -> str:
+    amazon_linux_2 = invoke_cache.invoke(
+        aws.ec2.get_ami,
+        most_recent=True,
+        owners=["amazon"],
+        filters=[
+            aws.ec2.GetAmiFilterArgs(
+                name="name",
+                values=["amzn2-ami-hvm-*-x86_64-gp2"],
+            ),
+            aws.ec2.GetAmiFilterArgs(
+                name="owner-alias",
+                values=["amazon"],
+            )
+        ],
+    )
+    return amazon_linux_2.id
 
 
 class SpokeWorkload(pulumi.ComponentResource):
     '''Comprises a small EC2 instance running Amazon Linux 2 with SSM shell
     access and security group to verify network connectivity.'''
 
+    @profiled("SpokeWorkload")
     def __init__(self, name: str, args: SpokeWorkloadArgs, opts: pulumi.ResourceOptions = None) -> None:
         super().__init__("awsAdvancedNetworkingWorkshop:index:SpokeWorkload", name, None, opts)
 
+        # Probes measure against each other, so they also accept iperf3 and
+        # HTTP from the other spokes:
+        ingress = None
+        if args.probe:
+            ingress = [
+                aws.ec2.SecurityGroupIngressArgs(
+                    cidr_blocks=[args.probe_ingress_cidr_block],
+                    description=description,
+                    protocol="tcp",
+                    from_port=port,
+                    to_port=port,
+                )
+                for port, description in [(IPERF3_PORT, "iperf3"), (HTTP_PORT, "HTTP")]
+            ]
+
         sg = aws.ec2.SecurityGroup(
             f"{name}-instance-sg",
             aws.ec2.SecurityGroupArgs(
                 description="Allow all outbound traffic",
                 vpc_id=args.spoke_vpc_id,
+                ingress=ingress,
                 egress=[
                     aws.ec2.SecurityGroupEgressArgs(
                         cidr_blocks=["0.0.0.0/0"],
@@ -63,6 +123,9 @@ class SpokeWorkload(pulumi.ComponentResource):
             )
         )
 
+        if args.probe:
+            self.create_probe_policy(name, ec2_role, args.probe)
+
         instance_profile = aws.iam.InstanceProfile(
             f"{name}-instance-profile",
             aws.iam.InstanceProfileArgs(
@@ -70,34 +133,93 @@ class SpokeWorkload(pulumi.ComponentResource):
             )
         )
 
-        amazon_linux_2 = aws.ec2.get_ami(
-            most_recent=True,
-            owners=["amazon"],
-            filters=[
-                aws.ec2.GetAmiFilterArgs(
-                    name="name",
-                    values=["amzn2-ami-hvm-*-x86_64-gp2"],
+        ami_id = args.ami_id or get_amazon_linux_2_ami_id()
+
+        if args.probe:
+            self.instances = self.create_probes(
+                name, args, ami_id, sg.id, instance_profile.name)
+        else:
+            self.instances = [aws.ec2.Instance(
+                f"{name}-instance",
+                aws.ec2.InstanceArgs(
+                    ami=ami_id,
+                    instance_type="t3.micro",
+                    vpc_security_group_ids=[sg.id],
+                    subnet_id=args.spoke_instance_subnet_id,
+                    tags={
+                        "Name": f"{name}-instance",
+                    },
+                    iam_instance_profile=instance_profile.name,
                 ),
-                aws.ec2.GetAmiFilterArgs(
-                    name="owner-alias",
-                    values=["amazon"],
-                )
-            ],
-        )
+                opts=pulumi.ResourceOptions(
+                    parent=self
+                ),
+            )]
 
-        aws.ec2.Instance(
-            f"{name}-instance",
-            aws.ec2.InstanceArgs(
-                ami=amazon_linux_2.id,
-                instance_type="t3.micro",
-                vpc_security_group_ids=[sg.id],
-                subnet_id=args.spoke_instance_subnet_id,
-                tags={
-                    "Name": f"{name}-instance",
-                },
-                iam_instance_profile=instance_profile.name,
+    def create_probe_policy(self, name: str, role: "aws.iam.Role", probe: ProbeSettings):
+        '''Lets probes find each other by tag and, if a results bucket is
+        set, upload their results.'''
+        statements = [{
+            "Effect": "Allow",
+            "Action": "ec2:DescribeInstances",
+            "Resource": "*",
+        }]
+        if probe.results_bucket:
+            statements.append({
+                "Effect": "Allow",
+                "Action": "s3:PutObject",
+                "Resource": f"arn:aws:s3:::{probe.results_bucket}/*",
+            })
+
+        aws.iam.RolePolicy(
+            f"{name}-probe-policy",
+            aws.iam.RolePolicyArgs(
+                role=role.id,
+                policy=json.dumps({
+                    "Version": "2012-10-17",
+                    "Statement": statements,
+                }),
             ),
             opts=pulumi.ResourceOptions(
                 parent=self
             ),
         )
+
+    def create_probes(
+        self,
+        name: str,
+        args: SpokeWorkloadArgs,
+        ami_id: pulumi.Input[str],
+        security_group_id: pulumi.Output[str],
+        instance_profile_name: pulumi.Output[str],
+    ) -> List["aws.ec2.Instance"]:
+        instances = []
+        zones = place_probes(args.probe.instances, args.probe_availability_zone_count)
+        for i, zone_index in enumerate(zones):
+            probe_name = f"{name}-probe-{i+1}"
+            instances.append(aws.ec2.Instance(
+                probe_name,
+                aws.ec2.InstanceArgs(
+                    ami=ami_id,
+                    instance_type="t3.micro",
+                    vpc_security_group_ids=[security_group_id],
+                    subnet_id=at_index(args.probe_subnet_ids, zone_index),
+                    user_data=probe_user_data(
+                        args.probe, args.probe_group, name, probe_name, args.probe_count,
+                        probe_schedule(args.probe_spokes or [name], name, i + 1)),
+                    # So a change to the probe settings deploys fresh probes
+                    # that measure again rather than leaving stale ones:
+                    user_data_replace_on_change=True,
+                    tags={
+                        "Name": probe_name,
+                        "probe-group": args.probe_group,
+                        "probe-spoke": name,
+                        "probe-index": str(i + 1),
+                    },
+                    iam_instance_profile=instance_profile_name,
+                ),
+                opts=pulumi.ResourceOptions(
+                    parent=self
+                ),
+            ))
+        return instances
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The Pulumi program lives in the directory above; make its modules importable
+# the same way `pulumi up` does.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
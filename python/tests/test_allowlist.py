@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+import mock_runtime
+from allowlist import (
+    MAX_STATEFUL_CAPACITY,
+    AllowlistError,
+    allowlist_rule_groups,
+    load_allowlist,
+    pack_entries,
+    read_allowlist,
+)
+from firewall_model import CapacityError
+from firewall_rules import firewall_policy
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def test_entries_are_normalized_and_deduplicated():
+    allowlist = read_allowlist([
+        "# comment\n",
+        "\n",
+        "Example.COM.\n",
+        "example.com  # again\n",
+        "*.GitHub.com\n",
+        ".github.com\n",
+        "bücher.de\n",
+        "203.0.113.7/24\n",
+        "203.0.112.0/24\n",
+        "198.51.100.1\n",
+    ])
+
+    assert allowlist.domains == {"example.com", ".github.com", "xn--bcher-kva.de"}
+    assert allowlist.cidrs == {"203.0.112.0/23", "198.51.100.1/32"}
+
+
+@pytest.mark.parametrize("line", ["localhost", "exa mple.com", "-bad-.com", "10.0.0.0/33", "2001:db8::/32"])
+def test_invalid_entries_are_rejected_with_their_line(line):
+    with pytest.raises(AllowlistError, match="line 2"):
+        read_allowlist(["example.com", line])
+
+
+def test_packing_respects_capacity():
+    entries = [f"host{i}.example.com" for i in range(1000)]
+    groups = pack_entries(entries, 100)
+
+    assert sorted(entry for _, group in groups for entry in group) == sorted(entries)
+    assert all(len(group) <= 100 for _, group in groups)
+    # Groups split in halves, so none of them is less than half full on
+    # average:
+    assert len(groups) <= 2 * 1000 // 100
+
+
+def test_adding_an_entry_changes_one_group():
+    entries = [f"host{i}.example.com" for i in range(1000)]
+    before = dict(pack_entries(entries, 100))
+
+    for added in ["new.example.com", "other.example.org", "a.b.c"]:
+        after = dict(pack_entries(entries + [added], 100))
+        changed = {prefix for prefix in before.keys() | after.keys() if before.get(prefix) != after.get(prefix)}
+        if len(after) == len(before):
+            assert len(changed) == 1
+        else:
+            # The group it landed in split in two:
+            assert len(changed) == 3
+
+
+def test_rule_groups_pass_allowlisted_domains(tmp_path):
+    pytest.importorskip("numpy")
+    from firewall_simulator import DROP, PASS, FirewallSimulator, Flows
+
+    path = tmp_path / "allowlist.txt"
+    path.write_text("".join(f"host{i}.example.com\n" for i in range(50)) + ".github.com\n203.0.113.0/24\n")
+    allowlist = load_allowlist(str(path))
+
+    groups = allowlist_rule_groups(allowlist, capacity=20)
+    assert all(group.to_args().capacity == 20 for group in groups)
+    assert [group.name for group in groups][-1] == "allowlist-cidrs"
+
+    simulator = FirewallSimulator(firewall_policy("10.0.0.0/8", allowlist, 20), home_net=["10.129.0.0/24"])
+    flows = Flows.from_records([
+        (6, "10.129.0.10", "93.184.216.34", 40000, 443, "host7.example.com", True),
+        (6, "10.129.0.10", "93.184.216.34", 40000, 443, "api.github.com", True),
+        (6, "10.129.0.10", "93.184.216.34", 40000, 443, "host50.example.com", True),
+        (17, "10.129.0.10", "203.0.113.9", 40000, 53),
+    ])
+    assert simulator.evaluate(flows).action.tolist() == [PASS, PASS, DROP, PASS]
+
+
+def test_program_creates_the_allowlist_groups(tmp_path):
+    path = tmp_path / "allowlist.txt"
+    path.write_text("".join(f"host{i}.example.com\n" for i in range(50)))
+
+    mocks = mock_runtime.run_main(MAIN, config={
+        "firewall-allowlist": str(path),
+        "firewall-allowlist-capacity": "20",
+    })
+
+    groups = [g for g in mocks.resources_of_type("aws:networkfirewall/ruleGroup:RuleGroup")
+              if g.name.startswith("allowlist-")]
+    assert len(groups) >= 3
+    [policy] = mocks.resources_of_type("aws:networkfirewall/firewallPolicy:FirewallPolicy")
+    references = policy.inputs["firewallPolicy"]["statefulRuleGroupReferences"]
+    assert len(references) == 2 + len(groups)
+
+
+def test_policy_rejects_allowlists_it_cannot_hold():
+    allowlist = read_allowlist(f"host{i}.example.com" for i in range(400))
+
+    # 18 groups at most after the policy's own two, each holding 20 at most:
+    with pytest.raises(CapacityError, match="at most 20"):
+        firewall_policy("10.0.0.0/8", allowlist, 20)
+
+    # Fits in 20 groups, but not in 30,000 between them:
+    with pytest.raises(CapacityError, match="reserve a capacity of"):
+        firewall_policy("10.0.0.0/8", allowlist, MAX_STATEFUL_CAPACITY)
+
+    policy = firewall_policy("10.0.0.0/8", allowlist, 100)
+    assert sum(group.capacity for group in policy.rule_groups[1:]) <= 30_000
+
+
+def test_program_rejects_allowlists_the_policy_cannot_hold(tmp_path):
+    path = tmp_path / "allowlist.txt"
+    path.write_text("".join(f"host{i}.example.com\n" for i in range(50)))
+
+    with pytest.raises(Exception, match="can reserve at most 30000"):
+        mock_runtime.run_main(MAIN, config={
+            "firewall-allowlist": str(path),
+            "firewall-allowlist-capacity": "30000",
+        })
+    # Unless the account's quota has been raised:
+    mock_runtime.run_main(MAIN, config={
+        "firewall-allowlist": str(path),
+        "firewall-allowlist-capacity": "30000",
+        "firewall-policy-capacity": "40000",
+    })
@@ -0,0 +1,121 @@
+import os
+import random
+
+import pytest
+
+import mock_runtime
+from cidr_allocator import CidrAllocationError, CidrAllocator, hub_subnet_cidr_blocks, inspection_cidr_blocks
+from fleet import SpokeSpec, allocate_spoke_cidrs
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def test_reserve_rejects_overlaps():
+    allocator = CidrAllocator("10.0.0.0/8")
+    allocator.reserve("hub", "10.129.0.0/24")
+
+    with pytest.raises(CidrAllocationError, match="overlaps 10.129.0.0/24 \\(hub\\)"):
+        allocator.reserve("spoke1", "10.129.0.0/16")
+    with pytest.raises(CidrAllocationError, match="not within"):
+        allocator.reserve("spoke1", "192.168.0.0/16")
+
+    assert allocator.owner_of("10.129.0.17/32") == "hub"
+    assert allocator.owner_of("10.130.0.0/16") is None
+
+
+def test_allocations_skip_taken_blocks_and_never_overlap():
+    allocator = CidrAllocator("10.0.0.0/16")
+    allocator.reserve("pinned", "10.0.0.0/20")
+
+    blocks = [allocator.allocate(f"spoke{i}", 20) for i in range(15)]
+    assert str(blocks[0]) == "10.0.16.0/20"
+    assert len({str(block) for block in blocks}) == 15
+
+    with pytest.raises(CidrAllocationError, match="No free /20"):
+        allocator.allocate("spoke15", 20)
+
+
+def allocate_fleet(names, previous=None):
+    # As __main__.py does: the hub's /24, then /16 spokes in sorted order.
+    allocator = CidrAllocator("10.0.0.0/8")
+    allocator.allocate_stable("hub", 24)
+    specs = allocate_spoke_cidrs([SpokeSpec(name) for name in names], allocator, 16, previous)
+    return {spec.name: spec.vpc_cidr_block for spec in specs}
+
+
+def test_adding_a_spoke_never_moves_existing_ones():
+    fleet = [f"spoke{i}" for i in range(1, 60)]
+    before = allocate_fleet(fleet)
+
+    # Without the earlier assignments, some of these (e.g. a490) would take
+    # a block an existing spoke had won on a collision:
+    for i in range(500):
+        after = allocate_fleet(fleet + [f"a{i}"], previous=before)
+        assert {name: after[name] for name in fleet} == before
+        assert after[f"a{i}"] not in before.values()
+
+
+def test_removed_spokes_free_their_blocks_and_resized_ones_move():
+    before = allocate_fleet(["spoke1", "spoke2", "spoke3"])
+
+    allocator = CidrAllocator("10.0.0.0/8")
+    specs = allocate_spoke_cidrs(
+        [SpokeSpec("spoke1"), SpokeSpec("spoke3", prefix_length=20)], allocator, 16, previous=before)
+
+    assert specs[0].vpc_cidr_block == before["spoke1"]
+    assert specs[1].vpc_cidr_block.endswith("/20")
+    assert allocator.owner_of(before["spoke2"]) in (None, "spoke3")
+
+
+def test_the_program_keeps_the_blocks_it_exported():
+    spokes = '[{"name": "spoke1"}, {"name": "spoke2"}]'
+    previous = {"spoke1": "10.1.0.0/16", "spoke2": "10.2.0.0/16"}
+    mocks = mock_runtime.run_main(MAIN, config={"spokes": spokes}, mocks=mock_runtime.ProgramMocks(
+        stack_outputs={f"organization/{mock_runtime.PROJECT}/dev": {"spoke-cidrs": previous}}))
+
+    blocks = {vpc.name: vpc.inputs["cidrBlock"] for vpc in mocks.resources_of_type("awsx:ec2:Vpc")}
+    assert blocks["spoke1-vpc"] == "10.1.0.0/16"
+    assert blocks["spoke2-vpc"] == "10.2.0.0/16"
+
+
+def test_allocations_never_overlap_and_released_space_is_reused():
+    allocator = CidrAllocator("10.0.0.0/16")
+    rng = random.Random(7)
+    for i in range(2000):
+        if allocator.allocations and rng.random() < 0.4:
+            allocator.release(rng.choice(sorted(allocator.allocations)))
+        else:
+            try:
+                allocator.allocate_stable(f"spoke{i}", rng.randint(20, 28))
+            except CidrAllocationError:
+                pass
+
+        blocks = sorted(allocator.allocations.values())
+        for a, b in zip(blocks, blocks[1:]):
+            assert not a.overlaps(b)
+
+    for owner in list(allocator.allocations):
+        allocator.release(owner)
+    assert str(allocator.allocate("everything", 16)) == "10.0.0.0/16"
+
+
+def test_release_returns_space():
+    allocator = CidrAllocator("10.0.0.0/24")
+    allocator.allocate("a", 25)
+    allocator.allocate("b", 25)
+    allocator.release("a")
+
+    assert str(allocator.allocate("c", 25)) == "10.0.0.0/25"
+
+
+def test_inspection_blocks_avoid_awsx_subnets():
+    assert inspection_cidr_blocks("10.129.0.0/24", 3) == [
+        "10.129.0.32/28", "10.129.0.96/28", "10.129.0.160/28"]
+
+
+def test_hub_subnets_follow_the_inspection_subnets():
+    assert hub_subnet_cidr_blocks("10.129.0.0/24", 3, ["inspection", "endpoints"]) == {
+        "inspection": ["10.129.0.32/28", "10.129.0.96/28", "10.129.0.160/28"],
+        "endpoints": ["10.129.0.48/28", "10.129.0.112/28", "10.129.0.176/28"],
+    }
+
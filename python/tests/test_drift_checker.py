@@ -0,0 +1,210 @@
+import copy
+import ipaddress
+import json
+import os
+import socket
+
+import pytest
+
+import mock_runtime
+from drift_checker import CHANGED, MISSING, UNEXPECTED, Drift, NetworkState, diff, fetch_state
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+SPOKES = json.dumps([{"name": f"spoke{i}"} for i in range(1, 4)])
+
+
+@pytest.fixture(scope="module")
+def expected():
+    mocks = mock_runtime.run_main(MAIN, config={"spokes": SPOKES, "routing-mode": "firewall"})
+    return NetworkState.from_resources(mocks.registrations)
+
+
+def test_expected_state_covers_the_routing(expected):
+    assert len(expected.attachments) == 4
+    # Each spoke propagates into the spoke and hub TGW route tables:
+    assert len(expected.tgw_propagations) == 3 * 2
+    assert set(expected.tgw_associations.values()) <= expected.tgw_route_table_ids
+    # Every spoke subnet sends the supernet to the TGW:
+    assert sum(1 for (table, destination), target in expected.routes.items()
+               if destination == "0.0.0.0/0" and target == "tgw-id") >= 3 * 3
+    assert diff(expected, expected) == []
+
+
+def test_hand_edits_are_reported(expected):
+    actual = copy.deepcopy(expected)
+    (table, destination), target = next(iter(actual.routes.items()))
+    actual.routes[(table, destination)] = "nat-by-hand"
+    actual.routes[(table, "192.0.2.0/24")] = "pcx-by-hand"
+    subnet = sorted(actual.associations)[0]
+    actual.associations[subnet] = "rtb-by-hand"
+    attachment = sorted(actual.attachments)[0]
+    del actual.attachments[attachment]
+    propagation = sorted(actual.tgw_propagations)[0]
+    actual.tgw_propagations.remove(propagation)
+
+    assert diff(expected, actual) == [
+        Drift("route", f"{table} {destination}", CHANGED, expected=target, actual="nat-by-hand"),
+        Drift("route", f"{table} 192.0.2.0/24", UNEXPECTED, actual="pcx-by-hand"),
+        Drift("route-table-association", subnet, CHANGED, expected=expected.associations[subnet], actual="rtb-by-hand"),
+        Drift("tgw-attachment", attachment, MISSING, expected=expected.attachments[attachment]),
+        Drift("tgw-propagation", " ".join(propagation), MISSING),
+    ]
+
+
+def test_stack_exports_are_read_like_mocks(expected):
+    mocks = mock_runtime.run_main(MAIN, config={"spokes": SPOKES, "routing-mode": "firewall"})
+    deployment = {"deployment": {"resources": [
+        {"type": typ, "urn": f"urn:pulumi:stack::project::{typ}::{name}", "id": resource_id, "outputs": state}
+        for typ, name, resource_id, state in mocks.registrations
+    ]}}
+
+    assert diff(expected, NetworkState.from_stack_exports([deployment])) == []
+
+
+class ManyRoutes:
+    '''An EC2 client with nothing but static TGW routes, more than
+    SearchTransitGatewayRoutes returns at once, and no page token to get
+    the rest with.'''
+    page_size = 1000
+
+    def __init__(self, destinations):
+        self.destinations = [ipaddress.ip_network(destination) for destination in destinations]
+        self.searches = 0
+        self.operation = None
+
+    def get_paginator(self, operation):
+        self.operation = operation
+        return self
+
+    def paginate(self, **kwargs):
+        if self.operation != "search_transit_gateway_routes":
+            return [{}]
+        return [self.search(**kwargs)]
+
+    def search(self, TransitGatewayRouteTableId, Filters):
+        self.searches += 1
+        assert {"Name": "type", "Values": ["static"]} in Filters
+        found = self.destinations
+        for f in Filters:
+            cidr = ipaddress.ip_network(f["Values"][0]) if f["Name"].startswith("route-search.") else None
+            if f["Name"] == "route-search.subnet-of-match":
+                found = [d for d in found if d.subnet_of(cidr)]
+            elif f["Name"] == "route-search.exact-match":
+                found = [d for d in found if d == cidr]
+        return {
+            "Routes": [{"DestinationCidrBlock": str(d), "State": "blackhole"} for d in found[:self.page_size]],
+            "AdditionalRoutesAvailable": len(found) > self.page_size,
+        }
+
+
+def test_static_routes_beyond_one_search_are_read():
+    destinations = [f"10.{i // 256}.{i % 256}.0/24" for i in range(2 * ManyRoutes.page_size + 500)]
+    destinations += ["10.0.0.0/8", "0.0.0.0/0"]
+    ec2 = ManyRoutes(destinations)
+
+    actual = fetch_state(ec2, NetworkState(tgw_route_table_ids={"tgw-rtb"}))
+
+    assert set(actual.tgw_routes) == {("tgw-rtb", destination) for destination in destinations}
+    assert ec2.searches < 100
+
+
+def test_static_routes_that_fit_take_one_search():
+    ec2 = ManyRoutes(["10.1.0.0/16", "0.0.0.0/0"])
+
+    actual = fetch_state(ec2, NetworkState(tgw_route_table_ids={"tgw-rtb"}))
+
+    assert set(actual.tgw_routes) == {("tgw-rtb", "10.1.0.0/16"), ("tgw-rtb", "0.0.0.0/0")}
+    assert ec2.searches == 1
+
+
+@pytest.fixture
+def ec2():
+    boto3 = pytest.importorskip("boto3")
+    server = pytest.importorskip("moto.server")
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    moto = server.ThreadedMotoServer(port=port)
+    moto.start()
+    try:
+        yield boto3.client("ec2", region_name="us-east-1", endpoint_url=f"http://127.0.0.1:{port}",
+                           aws_access_key_id="testing", aws_secret_access_key="testing")
+    finally:
+        moto.stop()
+
+
+def deploy(ec2, subnets):
+    '''Creates a spoke with `subnets` subnets attached to a TGW, and returns
+    the state Pulumi would have recorded for it.'''
+    vpc = ec2.create_vpc(CidrBlock="10.1.0.0/16")["Vpc"]["VpcId"]
+    tgw = ec2.create_transit_gateway()["TransitGateway"]["TransitGatewayId"]
+    tgw_table = ec2.create_transit_gateway_route_table(TransitGatewayId=tgw)["TransitGatewayRouteTable"][
+        "TransitGatewayRouteTableId"]
+    resources = [("aws:ec2transitgateway/routeTable:RouteTable", "spoke-tgw", tgw_table, {})]
+
+    subnet_ids = []
+    for i in range(subnets):
+        subnet = ec2.create_subnet(VpcId=vpc, CidrBlock=f"10.1.{i}.0/24")["Subnet"]["SubnetId"]
+        table = ec2.create_route_table(VpcId=vpc)["RouteTable"]["RouteTableId"]
+        ec2.associate_route_table(RouteTableId=table, SubnetId=subnet)
+        ec2.create_route(RouteTableId=table, DestinationCidrBlock="0.0.0.0/0", TransitGatewayId=tgw)
+        subnet_ids.append(subnet)
+        resources += [
+            ("aws:ec2/routeTable:RouteTable", f"rt-{i}", table, {"vpcId": vpc}),
+            ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"rta-{i}", f"rtbassoc-{i}",
+             {"routeTableId": table, "subnetId": subnet}),
+            ("aws:ec2/route:Route", f"route-{i}", f"r-{i}",
+             {"routeTableId": table, "destinationCidrBlock": "0.0.0.0/0", "transitGatewayId": tgw}),
+        ]
+
+    attachment = ec2.create_transit_gateway_vpc_attachment(
+        TransitGatewayId=tgw, VpcId=vpc, SubnetIds=subnet_ids[:1])["TransitGatewayVpcAttachment"][
+        "TransitGatewayAttachmentId"]
+    ec2.associate_transit_gateway_route_table(TransitGatewayRouteTableId=tgw_table, TransitGatewayAttachmentId=attachment)
+    ec2.enable_transit_gateway_route_table_propagation(
+        TransitGatewayRouteTableId=tgw_table, TransitGatewayAttachmentId=attachment)
+    ec2.create_transit_gateway_route(TransitGatewayRouteTableId=tgw_table, DestinationCidrBlock="0.0.0.0/0",
+                                     TransitGatewayAttachmentId=attachment)
+    resources += [
+        ("aws:ec2transitgateway/vpcAttachment:VpcAttachment", "spoke-attachment", attachment,
+         {"transitGatewayId": tgw, "vpcId": vpc, "subnetIds": subnet_ids[:1]}),
+        ("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation", "spoke-assoc", "a",
+         {"transitGatewayRouteTableId": tgw_table, "transitGatewayAttachmentId": attachment}),
+        ("aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation", "spoke-prop", "p",
+         {"transitGatewayRouteTableId": tgw_table, "transitGatewayAttachmentId": attachment}),
+        ("aws:ec2transitgateway/route:Route", "default", "tgw-r",
+         {"transitGatewayRouteTableId": tgw_table, "destinationCidrBlock": "0.0.0.0/0",
+          "transitGatewayAttachmentId": attachment}),
+    ]
+    return NetworkState.from_resources(resources)
+
+
+def test_moto_deployment_without_drift(ec2):
+    from drift_checker import check_drift, count_calls
+
+    expected = deploy(ec2, subnets=250)
+    calls = count_calls(ec2)
+
+    assert check_drift(ec2, expected) == []
+    # Two DescribeRouteTables calls for 250 tables, rather than 250:
+    assert calls["DescribeRouteTables"] == 2
+    assert sum(calls.values()) <= 8
+
+
+def test_moto_hand_edits_are_reported(ec2):
+    from drift_checker import check_drift
+
+    expected = deploy(ec2, subnets=2)
+    (table, destination) = sorted(expected.routes)[0]
+    ec2.delete_route(RouteTableId=table, DestinationCidrBlock=destination)
+    gateway = ec2.create_internet_gateway()["InternetGateway"]["InternetGatewayId"]
+    vpc = ec2.describe_route_tables(RouteTableIds=[table])["RouteTables"][0]["VpcId"]
+    ec2.attach_internet_gateway(InternetGatewayId=gateway, VpcId=vpc)
+    ec2.create_route(RouteTableId=table, DestinationCidrBlock="192.0.2.0/24", GatewayId=gateway)
+
+    drift = check_drift(ec2, expected)
+
+    assert Drift("route", f"{table} 0.0.0.0/0", MISSING, expected=expected.routes[(table, destination)]) in drift
+    assert [d.change for d in drift if d.key == f"{table} 192.0.2.0/24"] == [UNEXPECTED]
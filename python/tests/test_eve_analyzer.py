@@ -0,0 +1,133 @@
+import collections
+import gzip
+import json
+import random
+
+from eve_analyzer import OTHER, SpokeIndex, TopTalkers, analyze, analyze_file, find_log_files
+
+SPOKE_CIDRS = {"spoke1": "10.129.0.0/20", "spoke2": "10.129.16.0/20"}
+
+
+def alert(sid, action, bytes_toserver=0, bytes_toclient=0, signature="rule"):
+    return {"event_type": "alert", "src_ip": "10.129.0.10", "dest_ip": "203.0.113.1",
+            "alert": {"action": action, "signature_id": sid, "signature": signature},
+            "flow": {"bytes_toserver": bytes_toserver, "bytes_toclient": bytes_toclient}}
+
+
+def netflow(source, size):
+    return {"event_type": "netflow", "src_ip": source, "dest_ip": "203.0.113.1", "netflow": {"bytes": size}}
+
+
+def write_log(path, events, wrapped=True):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wt") as f:
+        for event in events:
+            record = {"firewall_name": "hub-firewall", "event": event} if wrapped else event
+            f.write(json.dumps(record) + "\n")
+    return str(path)
+
+
+def test_alerts_drops_and_rule_bytes_are_counted(tmp_path):
+    path = write_log(tmp_path / "alert.log.gz", [
+        alert(1, "blocked", 100, 50, signature="drop remote"),
+        alert(1, "blocked", 10),
+        alert(2, "allowed", 1, 2),
+        {"event_type": "tls", "tls": {"sni": "example.com"}},
+    ])
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b'{"event": {"event_type": "alert", \n'))
+
+    summary = analyze_file(path, SPOKE_CIDRS)
+
+    assert summary.drops == {1: 2}
+    assert summary.alerts == {2: 1}
+    assert summary.rule_bytes == {1: 160, 2: 3}
+    assert summary.signatures[1] == "drop remote"
+    assert summary.events == 3
+    assert summary.malformed == 1
+
+
+def test_top_talkers_are_grouped_by_spoke(tmp_path):
+    path = write_log(tmp_path / "flow.log", [
+        netflow("10.129.0.10", 500),
+        netflow("10.129.0.10", 500),
+        netflow("10.129.0.11", 300),
+        netflow("10.129.17.1", 70),
+        netflow("192.0.2.1", 5),
+        # Suricata's own flow events:
+        {"event_type": "flow", "src_ip": "10.129.17.1", "flow": {"bytes_toserver": 20, "bytes_toclient": 10}},
+    ], wrapped=False)
+
+    report = analyze_file(path, SPOKE_CIDRS).to_dict(top=1)
+
+    assert report["spokes"]["spoke1"] == {
+        "bytes": 1300, "top_talkers": [{"address": "10.129.0.10", "bytes": 1000, "error": 0}]}
+    assert report["spokes"]["spoke2"]["bytes"] == 100
+    assert report["spokes"][OTHER]["bytes"] == 5
+
+
+def test_workers_give_the_same_summary_as_one_pass(tmp_path):
+    for i in range(4):
+        write_log(tmp_path / f"{i}.log.gz", [
+            *(alert(sid, "blocked" if sid % 2 else "allowed", sid * i) for sid in range(1, 20)),
+            *(netflow(f"10.129.{j % 32}.{i}", j) for j in range(200)),
+        ])
+    paths = find_log_files([str(tmp_path)])
+    assert len(paths) == 4
+
+    assert analyze(paths, SPOKE_CIDRS, workers=2).to_dict() == analyze(paths, SPOKE_CIDRS).to_dict()
+
+
+def test_top_talkers_find_heavy_hitters_in_bounded_memory():
+    talkers = TopTalkers(capacity=10)
+    for i in range(10_000):
+        talkers.add(f"light{i}", 1)
+        if i % 10 == 0:
+            talkers.add("heavy", 50)
+
+    assert len(talkers.counts) == 10
+    [(key, count, error)] = talkers.top(1)
+    assert key == "heavy"
+    assert count - error <= 50_000 <= count
+
+
+def test_merged_top_talkers_bound_the_true_counts(tmp_path):
+    rng = random.Random(1)
+    truth = collections.Counter()
+    for i in range(6):
+        # Each file has its own heavy hitters, and one talker common to all
+        # of them is heavy enough that only some of the sketches keep it:
+        events = []
+        for _ in range(2000):
+            r = rng.random()
+            if r < 0.45:
+                host = 3 * i + rng.randrange(3)
+            elif r < 0.55:
+                host = 250
+            else:
+                host = 20 + rng.randrange(200)
+            source = f"10.129.0.{host}"
+            size = rng.randrange(1, 100)
+            truth[source] += size
+            events.append(netflow(source, size))
+        write_log(tmp_path / f"{i}.log.gz", events)
+    paths = find_log_files([str(tmp_path)])
+
+    talkers = analyze(paths, SPOKE_CIDRS, workers=3, sketch_size=8).talkers["spoke1"]
+
+    assert len(talkers.counts) == 8
+    for source, count, error in talkers.top(8):
+        assert count - error <= truth[source] <= count
+    # And whatever was dropped had no more than the smallest count kept:
+    assert max(truth[s] for s in truth if s not in talkers.counts) <= talkers.floor
+
+
+def test_spoke_index_ignores_other_addresses():
+    spokes = SpokeIndex(SPOKE_CIDRS)
+
+    assert spokes.spoke("10.129.15.255") == "spoke1"
+    assert spokes.spoke("10.129.16.0") == "spoke2"
+    assert spokes.spoke("10.129.32.0") is None
+    assert spokes.spoke("10.128.255.255") is None
+    assert spokes.spoke("2001:db8::1") is None
+    assert spokes.spoke(None) is None
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import mock_runtime
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+LOGGING = "aws:networkfirewall/loggingConfiguration:LoggingConfiguration"
+BUCKET = "aws:s3/bucketV2:BucketV2"
+
+
+def destinations(mocks):
+    [logging] = mocks.resources_of_type(LOGGING)
+    return logging.inputs["loggingConfiguration"]["logDestinationConfigs"]
+
+
+def test_no_logging_by_default():
+    mocks = mock_runtime.run_main(MAIN)
+
+    assert not mocks.resources_of_type(LOGGING)
+    assert not mocks.resources_of_type(BUCKET)
+
+
+def test_logs_go_to_a_created_bucket():
+    mocks = mock_runtime.run_main(MAIN, config={"firewall-logs": '{"prefix": "/fw/", "retention_days": 7}'})
+
+    [bucket] = mocks.resources_of_type(BUCKET)
+    configs = destinations(mocks)
+    assert sorted(c["logType"] for c in configs) == ["ALERT", "FLOW"]
+    assert all(c["logDestinationType"] == "S3" and c["logDestination"]["prefix"] == "fw" for c in configs)
+
+    [lifecycle] = mocks.resources_of_type("aws:s3/bucketLifecycleConfigurationV2:BucketLifecycleConfigurationV2")
+    [rule] = lifecycle.inputs["rules"]
+    assert rule["filter"]["prefix"] == "fw/"
+    assert rule["expiration"]["days"] == 7
+
+
+def test_logs_go_to_an_existing_bucket():
+    mocks = mock_runtime.run_main(MAIN, config={"firewall-logs": '{"bucket": "audit-logs", "types": ["ALERT"]}'})
+
+    assert not mocks.resources_of_type(BUCKET)
+    [config] = destinations(mocks)
+    assert config["logType"] == "ALERT"
+    assert config["logDestination"]["bucketName"] == "audit-logs"
+
+
+@pytest.mark.parametrize("value, message", [
+    ('{"types": ["TLS"]}', "Unknown firewall log types: TLS"),
+    ('{"types": []}', "none given"),
+    ('{"types": ["FLOW", "FLOW"]}', "more than once"),
+])
+def test_invalid_log_settings_are_rejected(value, message):
+    with pytest.raises(Exception, match=message):
+        mock_runtime.run_main(MAIN, config={"firewall-logs": value})
@@ -0,0 +1,107 @@
+import pytest
+
+from firewall_model import (
+    CapacityError,
+    IpSet,
+    PortRange,
+    StatefulRule,
+    StatefulRuleGroup,
+    StatelessRule,
+    StatelessRuleGroup,
+    TlsSniRule,
+    assign_sids,
+)
+
+
+def test_stateless_capacity_is_the_product_of_match_settings():
+    rule = StatelessRule(
+        priority=1,
+        actions=["aws:drop"],
+        protocols=[6, 17],
+        sources=["10.0.0.0/8", "192.168.0.0/16"],
+        destination_ports=[PortRange(22), PortRange(80), PortRange(443)],
+    )
+    assert rule.capacity == 2 * 2 * 3
+    assert StatelessRule(priority=2, actions=["aws:pass"]).capacity == 1
+
+    group = StatelessRuleGroup("g", [rule, StatelessRule(2, ["aws:pass"])])
+    assert group.required_capacity == 13
+
+
+def test_reserved_capacity_must_fit_the_rules():
+    rules = [StatefulRule("pass", "icmp", msg=f"rule {i}") for i in range(3)]
+
+    assert StatefulRuleGroup("g", rules).to_args().capacity == 3
+    assert StatefulRuleGroup("g", rules, capacity=100).to_args().capacity == 100
+    with pytest.raises(CapacityError, match="needs a capacity of 3"):
+        StatefulRuleGroup("g", rules, capacity=2).to_args()
+
+
+def test_rules_render_as_suricata():
+    group = StatefulRuleGroup("g", [
+        StatefulRule("pass", "tcp", msg="Allowing TCP in port 443", direction="<>",
+                     destination="$EXTERNAL_NET", destination_port="443",
+                     options=["flow:not_established"], sid=892123),
+        TlsSniRule(domain=".amazon.com", sid=892125),
+    ])
+    assert group.rules_string() == (
+        'pass tcp any any <> $EXTERNAL_NET 443 (msg:"Allowing TCP in port 443"; flow:not_established; sid:892123; rev:1;)\n'
+        'pass tls any any -> $EXTERNAL_NET 443 (tls.sni; dotprefix; content:".amazon.com"; endswith; '
+        'msg:"Allowing .amazon.com HTTPS requests"; sid:892125; rev:1;)')
+
+
+def test_generated_sids_do_not_depend_on_rule_order():
+    rules = [TlsSniRule(domain=f"example{i}.com") for i in range(50)]
+
+    sids = dict(zip(rules, assign_sids(rules)))
+    reordered = list(reversed(rules))
+    assert dict(zip(reordered, assign_sids(reordered))) == sids
+    assert len(set(sids.values())) == 50
+    assert assign_sids(rules[:10]) == [sids[rule] for rule in rules[:10]]
+
+
+def test_cosmetic_changes_compile_to_the_same_group():
+    group = StatefulRuleGroup("g", [
+        StatefulRule("pass", "tcp", msg="Allowing TCP in port 443", destination="[10.0.0.0/8,192.168.0.0/16]",
+                     destination_port="443", options=["flow:not_established"]),
+        TlsSniRule(domain=".amazon.com"),
+    ], ip_sets=[IpSet("B", ["10.1.0.0/16"]), IpSet("A", ["10.0.0.0/24", "10.0.1.0/24"])])
+    cosmetic = StatefulRuleGroup("g", [
+        TlsSniRule(domain=" .Amazon.com"),
+        StatefulRule("PASS", "tcp", msg="Allowing  TCP in port 443 ", destination="[10.0.0.0/8, 192.168.0.0/16]",
+                     destination_port=" 443", options=[" flow: not_established"]),
+        TlsSniRule(domain=".amazon.com"),
+    ], ip_sets=[IpSet("A", ["10.0.1.0/24", "10.0.0.0/24"]), IpSet("B", ["10.1.0.0/16"])])
+
+    assert cosmetic.rules_string() == group.rules_string()
+    assert cosmetic.content_hash == group.content_hash
+    assert cosmetic.to_args().tags == {"content-hash": group.content_hash}
+    assert [ip_set.definition for ip_set in cosmetic.canonical_ip_sets()] == [["10.0.0.0/23"], ["10.1.0.0/16"]]
+
+    changed = StatefulRuleGroup("g", [*group.rules, TlsSniRule(domain=".example.com")], ip_sets=group.ip_sets)
+    assert changed.content_hash != group.content_hash
+
+
+def test_ip_sets_can_mix_ip_versions():
+    group = StatefulRuleGroup("g", [StatefulRule("pass", "ip", source="$HOME", msg="home")], ip_sets=[
+        IpSet("HOME", ["2001:db8:0:1::/64", "10.0.1.0/24", "2001:db8::/64", "10.0.0.0/24"])])
+
+    assert group.canonical_ip_sets() == [IpSet("HOME", ["10.0.0.0/23", "2001:db8::/63"])]
+    assert group.to_args().rule_group["rule_variables"]["ip_sets"][0]["ip_set"]["definition"] == [
+        "10.0.0.0/23", "2001:db8::/63"]
+
+
+def test_rule_order_is_kept_where_it_can_change_a_verdict():
+    rules = [
+        StatefulRule("drop", "tcp", msg="b", destination_port="22"),
+        StatefulRule("pass", "tcp", msg="a"),
+    ]
+    assert [rule.msg for rule in StatefulRuleGroup("g", rules).canonical_rules()] == ["b", "a"]
+
+    same_action = [StatefulRule("pass", "udp", msg="b"), StatefulRule("pass", "tcp", msg="a")]
+    assert [rule.msg for rule in StatefulRuleGroup("g", same_action).canonical_rules()] == ["a", "b"]
+
+
+def test_stateless_rules_are_ordered_by_priority():
+    rules = [StatelessRule(2, ["aws:pass"]), StatelessRule(1, ["aws:drop"], protocols=[6])]
+    assert StatelessRuleGroup("g", rules).content_hash == StatelessRuleGroup("g", rules[::-1]).content_hash
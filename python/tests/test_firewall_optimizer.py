@@ -0,0 +1,110 @@
+import ipaddress
+import random
+
+from firewall_model import PortRange, StatelessRule
+from firewall_optimizer import optimize_rules
+
+
+def verdict(rules, packet):
+    protocol, source, destination, source_port, destination_port = packet
+    for rule in sorted(rules, key=lambda rule: rule.priority):
+        if ((not rule.protocols or protocol in rule.protocols)
+                and (not rule.sources or any(source in ipaddress.ip_network(s) for s in rule.sources))
+                and (not rule.destinations or any(destination in ipaddress.ip_network(d) for d in rule.destinations))
+                and (not rule.source_ports or any(p.from_port <= source_port <= p.end for p in rule.source_ports))
+                and (not rule.destination_ports or any(p.from_port <= destination_port <= p.end for p in rule.destination_ports))):
+            return tuple(rule.actions)
+    return ("default",)
+
+
+def test_adjacent_ranges_merge_and_shadowed_rules_go():
+    rules = [
+        StatelessRule(1, ["aws:drop"], protocols=[6], sources=["10.0.0.0/25"],
+                      destination_ports=[PortRange(20, 22)]),
+        StatelessRule(2, ["aws:drop"], protocols=[6], sources=["10.0.0.128/25"],
+                      destination_ports=[PortRange(20, 22)]),
+        StatelessRule(3, ["aws:drop"], protocols=[6], sources=["10.0.0.0/24"],
+                      destination_ports=[PortRange(23, 25)]),
+        # Shadowed by the merged rules above:
+        StatelessRule(4, ["aws:pass"], protocols=[6], sources=["10.0.0.64/26"],
+                      destination_ports=[PortRange(21)]),
+    ]
+
+    optimized, report = optimize_rules(rules)
+
+    assert [rule.to_args() for rule in optimized] == [StatelessRule(
+        1, ["aws:drop"], protocols=[6], sources=["10.0.0.0/24"],
+        destination_ports=[PortRange(20, 25)]).to_args()]
+    assert (report.capacity_before, report.capacity_after) == (4, 1)
+    assert report.shadowed == 1
+
+
+def test_rules_do_not_merge_across_a_conflicting_rule():
+    rules = [
+        StatelessRule(1, ["aws:drop"], sources=["10.0.0.0/24"]),
+        StatelessRule(2, ["aws:pass"], sources=["10.0.1.0/25"]),
+        StatelessRule(3, ["aws:drop"], sources=["10.0.1.0/24"]),
+    ]
+
+    optimized, _ = optimize_rules(rules)
+
+    assert len(optimized) == 3
+
+
+def test_all_of_one_ip_version_is_not_any():
+    rules = [
+        StatelessRule(1, ["aws:drop"], sources=["0.0.0.0/0"]),
+        StatelessRule(2, ["aws:pass"], sources=["2001:db8::/32", "10.0.0.0/8"]),
+        StatelessRule(3, ["aws:drop"], sources=["::/0", "0.0.0.0/1", "128.0.0.0/1"]),
+    ]
+
+    optimized, _ = optimize_rules(rules)
+
+    assert verdict(optimized, (6, ipaddress.ip_address("2001:db8::1"), None, 0, 0)) == ("aws:pass",)
+    assert [rule.sources for rule in optimized] == [["0.0.0.0/0"], ["10.0.0.0/8", "2001:db8::/32"], []]
+
+
+def test_optimized_rules_give_the_same_verdicts():
+    generator = random.Random(7)
+
+    # Dual-stack: the same shape of ranges in IPv4 and IPv6, and now and
+    # then everything in one of them (which isn't "any"):
+    bases = [ipaddress.ip_address("10.0.0.0"), ipaddress.ip_address("2001:db8::")]
+
+    def cidr():
+        if generator.random() < 0.02:
+            return generator.choice(["0.0.0.0/0", "::/0"])
+        base = generator.choice(bases)
+        prefix = generator.choice([22, 23, 24, 25, 26]) + base.max_prefixlen - 32
+        address = base + generator.randrange(0, 2**12)
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+    def ports():
+        start = generator.randrange(0, 40)
+        return [PortRange(start, start + generator.randrange(0, 10))]
+
+    rules = [
+        StatelessRule(
+            priority=i + 1,
+            actions=[generator.choice(["aws:drop", "aws:pass", "aws:forward_to_sfe"])],
+            protocols=generator.choice([[], [6], [17], [6, 17]]),
+            sources=[cidr() for _ in range(generator.randrange(0, 3))],
+            destinations=[cidr() for _ in range(generator.randrange(0, 2))],
+            destination_ports=generator.choice([[], ports()]),
+        )
+        for i in range(150)
+    ]
+
+    optimized, report = optimize_rules(rules)
+    assert report.capacity_after <= report.capacity_before
+
+    for _ in range(5000):
+        base = generator.choice(bases)
+        packet = (
+            generator.choice([1, 6, 17]),
+            base + generator.randrange(0, 2**12 + 256),
+            base + generator.randrange(0, 2**12 + 256),
+            generator.randrange(0, 60),
+            generator.randrange(0, 60),
+        )
+        assert verdict(optimized, packet) == verdict(rules, packet)
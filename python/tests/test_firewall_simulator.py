@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from firewall_model import FirewallPolicy, RuleGroupReference, StatefulRule, StatefulRuleGroup
+from firewall_rules import firewall_policy
+from firewall_simulator import DROP, PASS, FirewallSimulator, Flows
+
+HUB = "10.129.0.0/24"
+
+
+def test_verdicts_for_the_program_policy():
+    simulator = FirewallSimulator(firewall_policy("10.0.0.0/8"), home_net=[HUB])
+    flows = Flows.from_records([
+        (6, "10.0.0.10", "10.1.0.10", 22, 22),                         # ssh from port 22
+        (1, "10.0.0.10", "10.1.0.10", 0, 0),                           # icmp within the supernet
+        (1, "10.0.0.10", "8.8.8.8", 0, 0),                             # icmp to the internet
+        (6, "10.129.0.10", "52.94.236.248", 40000, 443),               # handshake
+        (6, "10.129.0.10", "52.94.236.248", 40000, 443, "www.amazon.com", True),
+        (6, "10.129.0.10", "52.94.236.248", 40000, 443, "amazon.com", True),
+        (6, "10.129.0.10", "93.184.216.34", 40000, 443, "example.com", True),
+        (6, "10.129.0.10", "93.184.216.34", 40000, 443, "notamazon.com", True),
+        (17, "10.129.0.10", "8.8.8.8", 40000, 53),
+    ])
+
+    verdicts = simulator.evaluate(flows)
+
+    assert verdicts.action.tolist() == [DROP, PASS, DROP, PASS, PASS, PASS, DROP, DROP, DROP]
+    assert [simulator.rules[i] if i >= 0 else None for i in verdicts.rule] == [
+        "drop-remote/1", "allow-icmp/sid:2", None, "allow-amazon/sid:892123",
+        "allow-amazon/sid:892125", "allow-amazon/sid:892125", None, None, None,
+    ]
+    # aws:alert_strict alerts on everything the default action decides:
+    assert verdicts.alert.tolist() == [False, False, True, False, False, False, True, True, True]
+
+
+def test_alert_rules_flag_without_deciding():
+    policy = FirewallPolicy(
+        stateful_rule_groups=[RuleGroupReference(1, StatefulRuleGroup("g", [
+            StatefulRule("alert", "udp", msg="dns", destination_port="53"),
+            StatefulRule("pass", "udp", msg="udp", destination="[10.0.0.0/8, !10.1.0.0/16]"),
+        ]))],
+    )
+    simulator = FirewallSimulator(policy, home_net=[HUB])
+
+    verdicts = simulator.evaluate(Flows.from_records([
+        (17, "10.129.0.10", "10.0.0.2", 40000, 53),
+        (17, "10.129.0.10", "10.1.0.2", 40000, 53),
+    ]))
+
+    assert verdicts.action.tolist() == [PASS, DROP]
+    assert verdicts.alert.tolist() == [True, True]
+
+
+def test_unsupported_keywords_are_rejected():
+    policy = FirewallPolicy(stateful_rule_groups=[RuleGroupReference(1, StatefulRuleGroup("g", [
+        StatefulRule("pass", "tcp", msg="m", options=['content:"GET"']),
+    ]))])
+    with pytest.raises(ValueError, match="Unsupported rule option"):
+        FirewallSimulator(policy, home_net=[HUB])
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import mock_runtime
+from tests.test_hub_reference import HUB_OUTPUTS, run_spokes
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+SPOKES = '[{"name": "spoke1"}, {"name": "spoke2"}]'
+
+FLOW_LOG = "aws:ec2/flowLog:FlowLog"
+BUCKET = "aws:s3/bucketV2:BucketV2"
+
+
+def test_no_flow_logs_by_default():
+    mocks = mock_runtime.run_main(MAIN, config={"spokes": SPOKES})
+
+    assert not mocks.resources_of_type(FLOW_LOG)
+
+
+def test_every_vpc_logs_parquet_to_a_created_bucket():
+    mocks = mock_runtime.run_main(MAIN, config={"spokes": SPOKES, "vpc-flow-logs": "{}"})
+
+    [bucket] = mocks.resources_of_type(BUCKET)
+    assert bucket.name == "flow-logs"
+    flow_logs = mocks.resources_of_type(FLOW_LOG)
+    assert sorted(f.name for f in flow_logs) == ["hub-flow-log", "spoke1-flow-log", "spoke2-flow-log"]
+    for flow_log in flow_logs:
+        assert flow_log.inputs["logDestinationType"] == "s3"
+        assert flow_log.inputs["maxAggregationInterval"] == 60
+        assert flow_log.inputs["destinationOptions"] == {
+            "fileFormat": "parquet", "hiveCompatiblePartitions": True, "perHourPartition": True}
+        assert "${pkt-srcaddr}" in flow_log.inputs["logFormat"]
+        assert "${flow-direction}" in flow_log.inputs["logFormat"]
+
+
+def test_flow_logs_go_to_an_existing_bucket():
+    mocks = mock_runtime.run_main(MAIN, config={
+        "spokes": SPOKES,
+        "vpc-flow-logs": '{"bucket": "network-logs", "prefix": "/flows/", "traffic_type": "REJECT"}',
+    })
+
+    assert not mocks.resources_of_type(BUCKET)
+    for flow_log in mocks.resources_of_type(FLOW_LOG):
+        assert flow_log.inputs["logDestination"] == "arn:aws:s3:::network-logs/flows/"
+        assert flow_log.inputs["trafficType"] == "REJECT"
+
+
+def test_spoke_stacks_log_to_the_hub_stacks_bucket():
+    mocks = run_spokes({**HUB_OUTPUTS, "flow-log-bucket": "hub-flow-logs"}, **{"vpc-flow-logs": "{}"})
+
+    assert not mocks.resources_of_type(BUCKET)
+    flow_logs = mocks.resources_of_type(FLOW_LOG)
+    assert sorted(f.name for f in flow_logs) == ["spoke1-flow-log", "spoke2-flow-log"]
+    assert {f.inputs["logDestination"] for f in flow_logs} == {"arn:aws:s3:::hub-flow-logs/vpc-flow-logs/"}
+
+
+@pytest.mark.parametrize("value, message", [
+    ('{"traffic_type": "SOME"}', "Unknown flow log traffic type"),
+    ('{"aggregation_interval": 300}', "aggregation interval must be one of"),
+])
+def test_invalid_flow_log_settings_are_rejected(value, message):
+    with pytest.raises(Exception, match=message):
+        mock_runtime.run_main(MAIN, config={"vpc-flow-logs": value})
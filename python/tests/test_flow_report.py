@@ -0,0 +1,119 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from flow_report import Batch, FlowReport, Topology, ipv4_addresses  # noqa: E402
+
+TOPOLOGY = Topology(
+    cidrs={"hub": "10.0.0.0/24", "spoke1": "10.1.0.0/16", "spoke2": "10.2.0.0/16"},
+    vpc_ids={"hub": "vpc-hub", "spoke1": "vpc-1", "spoke2": "vpc-2"},
+)
+
+A, B, REMOTE, NAT = "10.1.0.10", "10.2.0.20", "8.8.8.8", "10.0.0.5"
+
+# (vpc, az, pkt-srcaddr, pkt-dstaddr, bytes, start, end, direction)
+RECORDS = [
+    # A to the internet, logged by A, both TGW attachments and the NAT
+    # Gateway's two legs:
+    ("vpc-1", "az1", A, REMOTE, 1000, 0, 30, "egress"),
+    ("vpc-1", "az1", A, REMOTE, 1000, 0, 30, "ingress"),
+    ("vpc-hub", "az1", A, REMOTE, 1000, 0, 30, "egress"),
+    ("vpc-hub", "az1", A, REMOTE, 1000, 0, 30, "ingress"),
+    ("vpc-hub", "az1", NAT, REMOTE, 1000, 0, 30, "egress"),
+    # ...and the replies:
+    ("vpc-hub", "az1", REMOTE, NAT, 4000, 0, 30, "ingress"),
+    ("vpc-hub", "az1", REMOTE, A, 4000, 0, 30, "egress"),
+    ("vpc-1", "az1", REMOTE, A, 4000, 0, 30, "egress"),
+    ("vpc-1", "az1", REMOTE, A, 4000, 0, 30, "ingress"),
+    # A to B, across AZs, logged in both spokes:
+    ("vpc-1", "az1", A, B, 500, 60, 70, "egress"),
+    ("vpc-2", "az2", A, B, 500, 60, 70, "egress"),
+    ("vpc-2", "az2", A, B, 500, 60, 70, "ingress"),
+    ("vpc-2", "az2", B, A, 200, 60, 70, "egress"),
+    ("vpc-1", "az1", B, A, 200, 60, 70, "ingress"),
+]
+
+
+def columns(records, action="ACCEPT"):
+    vpc, az, source, destination, size, start, end, direction = (np.array(c, dtype=object) for c in zip(*records))
+    return {
+        "vpc_id": vpc, "az_id": az, "pkt_srcaddr": source, "pkt_dstaddr": destination,
+        "bytes": size.astype(np.int64), "packets": np.ones(len(records), dtype=np.int64),
+        "start": start.astype(np.int64), "end": end.astype(np.int64),
+        "action": np.array([action] * len(records), dtype=object), "flow_direction": direction,
+    }
+
+
+def report(*batches, window=60):
+    report = FlowReport(TOPOLOGY, window)
+    decoded = [Batch.decode(batch, TOPOLOGY) for batch in batches]
+    for batch in decoded:
+        report.learn_zones(batch)
+    for batch in decoded:
+        report.add(batch)
+    return report.to_dict()
+
+
+def test_each_flow_is_counted_once():
+    paths = {(row["source"], row["destination"]): row for row in report(columns(RECORDS))["paths"]}
+
+    assert {path: row["bytes"] for path, row in paths.items()} == {
+        ("spoke1", "internet"): 1000,
+        ("internet", "spoke1"): 4000,
+        ("spoke1", "spoke2"): 500,
+        ("spoke2", "spoke1"): 200,
+    }
+    assert paths[("spoke1", "spoke2")]["cross_az_share"] == 1.0
+    # The internet's AZ is unknown:
+    assert paths[("spoke1", "internet")]["cross_az_share"] == 0.0
+
+
+def test_per_vpc_totals_and_durations():
+    vpcs = report(columns(RECORDS))["vpcs"]
+
+    assert vpcs["spoke1"]["bytes_sent"] == 1500
+    assert vpcs["spoke1"]["bytes_received"] == 4200
+    assert vpcs["spoke2"]["bytes_sent"] == 200
+    assert (vpcs["spoke1"]["p50_duration"], vpcs["spoke1"]["p99_duration"]) == (30, 30)
+    assert vpcs["spoke2"]["p50_duration"] == 10
+    assert vpcs["hub"]["bytes_sent"] == 0
+
+
+def test_capacity_peaks_by_window():
+    capacity = report(columns(RECORDS), window=60)["capacity"]
+
+    # 5000 bytes to or from the internet in the first minute:
+    assert capacity["internet"]["peak_gbps"] == round(5000 * 8 / 60 / 1e9, 3)
+    assert capacity["transit_gateway"]["windows"] == 2
+
+
+def test_batches_add_up_to_one_batch():
+    whole = report(columns(RECORDS))
+    split = report(columns(RECORDS[:6]), columns(RECORDS[6:]))
+
+    assert whole == split
+
+
+def test_rejected_traffic_is_not_counted():
+    assert report(columns(RECORDS, action="REJECT"))["paths"] == []
+
+
+def test_addresses_are_parsed_once_per_value():
+    addresses = ipv4_addresses(np.array(["10.0.0.1", "-", "10.0.0.1", "2001:db8::1", "255.255.255.255"], dtype=object))
+
+    assert addresses.tolist() == [167772161, -1, 167772161, -1, 2**32 - 1]
+
+
+def test_parquet_files_are_read_in_batches(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    from flow_report import flow_report
+
+    partition = tmp_path / "AWSLogs" / "aws-account-id=123456789012" / "year=2024" / "month=01"
+    partition.mkdir(parents=True)
+    data = columns(RECORDS)
+    pq.write_table(pa.table({name: pa.array(values.tolist()) for name, values in data.items()}),
+                   partition / "part-0.parquet")
+
+    assert flow_report(str(tmp_path), TOPOLOGY, batch_size=4).to_dict() == report(data)
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+import mock_runtime
+from route_analyzer import RouteGraph
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def hub_routes(mocks):
+    return {
+        route.name: route.inputs
+        for route in mocks.resources_of_type("aws:ec2/route:Route")
+        if route.name.startswith(("hub-public-", "hub-tgw-"))
+    }
+
+
+def test_routing_modes_register_the_same_routes():
+    direct = mock_runtime.run_main(MAIN, config={"routing-mode": "direct"})
+    firewall = mock_runtime.run_main(MAIN, config={"routing-mode": "firewall"})
+
+    # Same names and route tables, so switching modes updates each route in
+    # place instead of creating a second route for the same destination:
+    assert hub_routes(direct).keys() == hub_routes(firewall).keys()
+    for name, route in hub_routes(direct).items():
+        assert hub_routes(firewall)[name]["routeTableId"] == route["routeTableId"]
+
+    # The AZ lookup is the program's only invoke:
+    assert direct.invokes == firewall.invokes == {
+        "aws:index/getAvailabilityZones:getAvailabilityZones": 1}
+
+
+def test_firewall_mode_routes_to_the_endpoint_in_the_same_az():
+    mocks = mock_runtime.run_main(MAIN, config={"routing-mode": "firewall"})
+    routes = hub_routes(mocks)
+
+    for i in range(3):
+        assert routes[f"hub-public-{i+1}-supernet"]["vpcEndpointId"] == f"vpce-hub-firewall-{i+1}"
+        assert routes[f"hub-tgw-{i+1}-default"]["vpcEndpointId"] == f"vpce-hub-firewall-{i+1}"
+
+    path = RouteGraph.from_mocks(mocks).path("hub-vpc-tgw-2", "8.8.8.8")
+    assert [(hop.kind, hop.zone) for hop in path.hops][:3] == [
+        ("subnet", "us-east-1b"),
+        ("firewall-endpoint", "us-east-1b"),
+        ("subnet", "us-east-1b"),
+    ]
+
+
+def test_unknown_routing_mode_is_rejected():
+    with pytest.raises(Exception, match="Unknown routing mode 'inspect'"):
+        mock_runtime.run_main(MAIN, config={"routing-mode": "inspect"})
+
+
+def zone_of_route_targets(mocks):
+    '''Returns (route table AZ, target AZ) for every hub route to a NAT
+    Gateway or firewall endpoint.'''
+    registrations = mocks.registrations
+    subnet_zones = {r.id: r.state["availabilityZone"]
+                    for r in registrations if r.typ == "aws:ec2/subnet:Subnet"}
+    route_table_zones = {r.state["routeTableId"]: subnet_zones[r.state["subnetId"]]
+                         for r in registrations
+                         if r.typ == "aws:ec2/routeTableAssociation:RouteTableAssociation"}
+    target_zones = {r.id: subnet_zones[r.state["subnetId"]]
+                    for r in registrations if r.typ == "aws:ec2/natGateway:NatGateway"}
+    for firewall in mocks.resources_of_type("aws:networkfirewall/firewall:Firewall"):
+        for i, mapping in enumerate(firewall.inputs["subnetMappings"]):
+            target_zones[f"vpce-{firewall.name}-{i+1}"] = subnet_zones[mapping["subnetId"]]
+
+    return [
+        (route.name, route_table_zones[route.inputs["routeTableId"]],
+         target_zones[route.inputs.get("natGatewayId") or route.inputs.get("vpcEndpointId")])
+        for route in mocks.resources_of_type("aws:ec2/route:Route")
+        if route.inputs.get("natGatewayId") or route.inputs.get("vpcEndpointId")
+    ]
+
+
+@pytest.mark.parametrize("routing_mode", ["direct", "firewall"])
+def test_one_nat_gateway_per_az_keeps_routes_in_their_az(routing_mode):
+    mocks = mock_runtime.run_main(MAIN, config={
+        "routing-mode": routing_mode,
+        "nat-gateway-strategy": "one-per-az",
+        "spokes": '[{"name": "spoke1"}, {"name": "spoke2"}]',
+    })
+
+    assert len(mocks.resources_of_type("aws:ec2/natGateway:NatGateway")) == 3
+    assert len(mocks.resources_of_type("aws:ec2/eip:Eip")) == 3
+
+    routes = zone_of_route_targets(mocks)
+    # The inspection subnets' default routes, plus the TGW subnets' in
+    # direct mode or the public and TGW subnets' in firewall mode:
+    assert len(routes) == (6 if routing_mode == "direct" else 9)
+    assert [route for route in routes if route[1] != route[2]] == []
+
+    graph = RouteGraph.from_mocks(mocks)
+    assert graph.check_egress(graph.subnets_named("private")).ok
+
+
+def test_a_single_nat_gateway_makes_firewall_egress_asymmetric():
+    # Replies return through the NAT Gateway's AZ, so they reach a different
+    # firewall endpoint from the one requests went through; that's what
+    # one-per-az is for.
+    mocks = mock_runtime.run_main(MAIN, config={
+        "routing-mode": "firewall",
+        "spokes": '[{"name": "spoke1"}]',
+    })
+    graph = RouteGraph.from_mocks(mocks)
+
+    findings = graph.check_egress(graph.subnets_named("private"))
+    assert sorted(there.source for there, _ in findings.asymmetric) == [
+        "spoke1-vpc-private-2", "spoke1-vpc-private-3"]
+
+
+def test_the_layout_follows_the_available_azs():
+    # One more AZ than we used to hardcode:
+    mocks = mock_runtime.run_main(MAIN, mocks=mock_runtime.ProgramMocks(availability_zones=4), config={
+        "routing-mode": "firewall",
+        "nat-gateway-strategy": "one-per-az",
+        "availability-zone-count": "4",
+        "spokes": '[{"name": "spoke1"}]',
+    })
+
+    [firewall] = mocks.resources_of_type("aws:networkfirewall/firewall:Firewall")
+    assert len(firewall.inputs["subnetMappings"]) == 4
+    inspection_zones = [subnet.inputs["availabilityZone"]
+                        for subnet in mocks.resources_of_type("aws:ec2/subnet:Subnet")]
+    assert inspection_zones == [f"us-east-1{letter}" for letter in "abcd"]
+
+    routes = zone_of_route_targets(mocks)
+    assert len(routes) == 12
+    assert [route for route in routes if route[1] != route[2]] == []
+
+    graph = RouteGraph.from_mocks(mocks)
+    assert len(graph.subnets_named("private")) == 4
+    assert graph.check_egress(graph.subnets_named("private")).ok
+
+
+def test_availability_zones_from_config_skip_the_lookup():
+    mocks = mock_runtime.run_main(MAIN, config={
+        "availability-zones": '["us-east-1b", "us-east-1c"]',
+        "spokes": '[{"name": "spoke1"}]',
+    })
+
+    assert sum(mocks.invokes.values()) == 0
+    zones = {r.state["availabilityZone"] for r in mocks.registrations
+             if r.typ == "aws:ec2/subnet:Subnet"}
+    assert zones == {"us-east-1b", "us-east-1c"}
+
+
+def test_asking_for_more_azs_than_are_available_fails():
+    with pytest.raises(Exception, match="only 3 are available"):
+        mock_runtime.run_main(MAIN, config={"availability-zone-count": "4"})
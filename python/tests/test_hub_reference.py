@@ -0,0 +1,122 @@
+import ipaddress
+import json
+import os
+
+import pytest
+
+import mock_runtime
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+SPOKES = '[{"name": "spoke1"}, {"name": "spoke2", "cidr": "10.1.0.0/16"}]'
+
+HUB_OUTPUTS = {
+    "tgw-id": "tgw-id",
+    "spoke-tgw-route-table-id": "spoke-tgw-route-table-id",
+    "hub-tgw-route-table-id": "hub-tgw-route-table-id",
+    "hub-and-spoke-supernet": "10.0.0.0/8",
+    "hub-cidr": "10.157.75.0/24",
+    "availability-zones": ["us-east-1a", "us-east-1b", "us-east-1c"],
+}
+
+
+def run_spokes(hub_outputs=HUB_OUTPUTS, **config):
+    return mock_runtime.run_main(
+        MAIN,
+        mocks=mock_runtime.ProgramMocks(stack_outputs={"org/project/hub": hub_outputs}),
+        config={"stack-role": "spokes", "hub-stack": "org/project/hub", "spokes": SPOKES, **config},
+    )
+
+
+def names(mocks):
+    return {(resource.typ, resource.name) for resource in mocks.resources}
+
+
+def test_hub_allocation_matches_what_spoke_stacks_expect():
+    mocks = mock_runtime.run_main(MAIN, config={"stack-role": "hub"})
+
+    [hub_vpc] = mocks.resources_of_type("awsx:ec2:Vpc")
+    assert hub_vpc.inputs["cidrBlock"] == HUB_OUTPUTS["hub-cidr"]
+
+
+def test_sharded_stacks_manage_what_one_stack_would():
+    everything = mock_runtime.run_main(MAIN, config={"spokes": SPOKES})
+    hub = mock_runtime.run_main(MAIN, config={"stack-role": "hub", "spokes": SPOKES})
+    spokes = run_spokes()
+
+    assert not {name for typ, name in names(hub) if name.startswith(("spoke1", "spoke2"))}
+    assert not spokes.resources_of_type("aws:ec2transitgateway/transitGateway:TransitGateway")
+    spoke_resources = names(spokes) - {("pulumi:pulumi:StackReference", "org/project/hub")}
+    assert names(hub) | spoke_resources == names(everything)
+    assert not names(hub) & spoke_resources
+
+
+def test_spoke_stacks_attach_to_the_hub_stack():
+    mocks = run_spokes()
+
+    for attachment in mocks.resources_of_type("aws:ec2transitgateway/vpcAttachment:VpcAttachment"):
+        assert attachment.inputs["transitGatewayId"] == "tgw-id"
+    propagations = [p for p in mocks.resources_of_type("aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation")
+                    if p.name.startswith("hub-to-")]
+    assert sorted(p.name for p in propagations) == ["hub-to-spoke1", "hub-to-spoke2"]
+    assert {p.inputs["transitGatewayRouteTableId"] for p in propagations} == {"hub-tgw-route-table-id"}
+    # Only what the spokes themselves need; the hub's AZ lookup is repeated
+    # so it can be checked against the hub stack:
+    assert sum(mocks.invokes.values()) == 1
+
+
+@pytest.mark.parametrize("key, value", [
+    ("hub-cidr", "10.200.0.0/24"),
+    ("availability-zones", ["us-east-1a", "us-east-1b"]),
+])
+def test_spoke_stacks_reject_a_hub_that_disagrees(key, value):
+    with pytest.raises(Exception, match=f"has {key}"):
+        run_spokes({**HUB_OUTPUTS, key: value})
+
+
+def test_unknown_stack_roles_are_rejected():
+    with pytest.raises(Exception, match="Unknown stack role"):
+        mock_runtime.run_main(MAIN, config={"stack-role": "edge"})
+
+
+def spoke_blocks(mocks):
+    return {vpc.name[:-len("-vpc")]: vpc.inputs["cidrBlock"] for vpc in mocks.resources_of_type("awsx:ec2:Vpc")}
+
+
+def run_spoke_stack(spokes, other_stacks=None, **config):
+    return mock_runtime.run_main(
+        MAIN,
+        mocks=mock_runtime.ProgramMocks(stack_outputs={
+            "org/project/hub": HUB_OUTPUTS,
+            **{name: {"spoke-cidrs": cidrs} for name, cidrs in (other_stacks or {}).items()},
+        }),
+        config={"stack-role": "spokes", "hub-stack": "org/project/hub", "spokes": json.dumps(spokes), **config},
+    )
+
+
+def test_spoke_stacks_avoid_the_blocks_of_the_stacks_they_list():
+    team_a = spoke_blocks(run_spoke_stack([{"name": "team-a-8"}]))
+    # On its own, team-b-4 would take the same block:
+    assert team_a == {"team-a-8": "10.186.0.0/16"}
+    assert spoke_blocks(run_spoke_stack([{"name": "team-b-4"}])) == {"team-b-4": "10.186.0.0/16"}
+
+    team_b = spoke_blocks(run_spoke_stack(
+        [{"name": "team-b-4"}], {"org/project/team-a": team_a}, **{"spoke-stacks": '["org/project/team-a"]'}))
+    assert team_b["team-b-4"] != "10.186.0.0/16"
+
+    with pytest.raises(Exception, match=r"overlaps 10.186.0.0/16 \(org/project/team-a: team-a-8\)"):
+        run_spoke_stack([{"name": "team-b-4", "cidr": "10.186.0.0/16"}], {"org/project/team-a": team_a},
+                        **{"spoke-stacks": '["org/project/team-a"]'})
+
+
+def test_spoke_stacks_allocate_from_their_own_range():
+    blocks = spoke_blocks(run_spoke_stack(
+        [{"name": f"team-a-{i}"} for i in range(8)], **{"spokes-cidr": "10.64.0.0/13"}))
+
+    assert len(set(blocks.values())) == 8
+    assert all(ipaddress.ip_network(block).subnet_of(ipaddress.ip_network("10.64.0.0/13")) for block in blocks.values())
+
+    with pytest.raises(Exception, match="is not within 10.64.0.0/13"):
+        run_spoke_stack([{"name": "team-a-1", "cidr": "10.1.0.0/16"}], **{"spokes-cidr": "10.64.0.0/13"})
+    with pytest.raises(Exception, match="overlaps 10.157.75.0/24 \\(hub\\)"):
+        run_spoke_stack([{"name": "team-a-1"}], **{"spokes-cidr": "10.156.0.0/14"})
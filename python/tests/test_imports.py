@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BENCHMARK = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "import_time.py")
+
+
+def measure(scenario):
+    # In a fresh interpreter, since this one has loaded everything already:
+    child = subprocess.run([sys.executable, BENCHMARK, "--child", scenario],
+                           check=True, capture_output=True, text=True)
+    return json.loads(child.stdout)
+
+
+def test_importing_the_program_loads_no_provider_modules():
+    assert measure("import")["aws_modules"] == []
+
+
+@pytest.mark.parametrize("scenario, modules", [
+    ("program", ["ec2", "ec2transitgateway", "networkfirewall"]),
+    ("program_with_workloads", ["ec2", "ec2transitgateway", "iam", "networkfirewall"]),
+    # One of the spokes runs a workload; spokes stacks have no firewall:
+    ("spokes", ["ec2", "ec2transitgateway", "iam"]),
+])
+def test_program_loads_only_the_provider_modules_it_uses(scenario, modules):
+    assert measure(scenario)["aws_modules"] == modules
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+import types
+
+import pytest
+
+import invoke_cache
+import mock_runtime
+from invoke_cache import InvokeCache, InvokeCacheMiss, _cache_key, _to_plain
+
+
+def get_thing(id, filters=None):
+    get_thing.calls += 1
+    return types.SimpleNamespace(id=id, tags={"Name": f"thing-{id}"})
+
+
+get_thing.calls = 0
+
+
+def test_memoizes_and_replays_from_disk(tmp_path):
+    path = str(tmp_path / "dev.json")
+    get_thing.calls = 0
+
+    cache = InvokeCache(path)
+    assert cache.invoke(get_thing, id="a").id == "a"
+    assert cache.invoke(get_thing, id="a").id == "a"
+    assert get_thing.calls == 1
+    assert cache.stats["memory_hits"] == 1
+    cache.save()
+
+    replay = InvokeCache(path, mode="replay")
+    result = replay.invoke(get_thing, id="a")
+    assert (result.id, result.tags["Name"]) == ("a", "thing-a")
+    assert get_thing.calls == 1
+    assert replay.stats["disk_hits"] == 1
+
+    with pytest.raises(InvokeCacheMiss):
+        replay.invoke(get_thing, id="b")
+
+
+def test_expired_results_are_fetched_again_and_evicted(tmp_path):
+    path = tmp_path / "dev.json"
+    get_thing.calls = 0
+    an_hour_ago = time.time() - 3600
+    path.write_text(json.dumps({
+        _cache_key(get_thing, {"id": key}): {
+            "recorded_at": recorded_at,
+            "result": _to_plain(types.SimpleNamespace(id=key)),
+        }
+        for key, recorded_at in (("a", an_hour_ago), ("b", an_hour_ago), ("c", time.time()))
+    }))
+
+    cache = InvokeCache(str(path), ttl=60)
+    assert cache.invoke(get_thing, id="a").tags == {"Name": "thing-a"}
+    assert cache.invoke(get_thing, id="c").id == "c"
+    assert get_thing.calls == 1
+    assert cache.stats["expired"] == 1
+    assert cache.stats["disk_hits"] == 1
+    cache.save()
+
+    recorded = json.loads(path.read_text())
+    assert sorted(recorded) == [_cache_key(get_thing, {"id": key}) for key in ("a", "c")]
+    assert recorded[_cache_key(get_thing, {"id": "a"})]["recorded_at"] > an_hour_ago
+
+
+def test_a_ttl_of_zero_is_not_the_default():
+    mock_runtime.run(lambda: invoke_cache.get_cache(), config={"invoke-cache": "cache", "invoke-cache-ttl": "0"})
+
+    assert invoke_cache.get_cache().ttl == 0
+    invoke_cache.reset()
+
+
+def test_invokes_for_other_keys_dont_wait_on_a_slow_one(tmp_path):
+    cache = InvokeCache(str(tmp_path / "dev.json"))
+    started, release = threading.Event(), threading.Event()
+
+    def get_slow_thing(id):
+        started.set()
+        release.wait(5)
+        return types.SimpleNamespace(id=id)
+
+    slow = threading.Thread(target=cache.invoke, args=(get_slow_thing,), kwargs={"id": "slow"})
+    slow.start()
+    started.wait(5)
+    try:
+        assert cache.invoke(get_thing, id="fast").id == "fast"
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join()
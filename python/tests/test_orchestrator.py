@@ -0,0 +1,93 @@
+import shutil
+import time
+
+import pytest
+
+from orchestrator import StackResult, StackTask, format_results, orchestrate, run_stack, with_retries
+
+
+def fake_run(task):
+    '''Stands in for run_stack: "fails" stacks named fail-*.'''
+    started = time.time()
+    time.sleep(0.2)
+    status = "failed" if task.stack_name.startswith("fail") else "succeeded"
+    return StackResult(task.stack_name, task.operation, status, attempts=1,
+                       started=started, finished=time.time(), changes={"create": 1})
+
+
+def test_hub_runs_before_the_spokes_and_spokes_are_bounded():
+    spokes = [StackTask(f"spoke{i}", "up") for i in range(6)]
+    results = orchestrate(StackTask("hub", "up"), spokes, workers=2, run=fake_run)
+
+    hub, *spoke_results = results
+    assert hub.stack_name == "hub"
+    assert sorted(result.stack_name for result in spoke_results) == [task.stack_name for task in spokes]
+    assert all(result.started >= hub.finished for result in spoke_results)
+
+    # At most two spokes overlap at any moment:
+    for result in spoke_results:
+        overlapping = [other for other in spoke_results
+                       if other.started <= result.started < other.finished]
+        assert len(overlapping) <= 2
+
+    summary = format_results(results)
+    assert "7/7 stacks succeeded" in summary
+    assert "create=1" in summary
+
+
+def test_spokes_are_skipped_when_the_hub_update_fails():
+    results = orchestrate(StackTask("fail-hub", "up"), [StackTask("spoke1", "up")],
+                          workers=2, run=fake_run)
+
+    assert [(result.stack_name, result.status) for result in results] == [
+        ("fail-hub", "failed"), ("spoke1", "skipped")]
+
+
+def test_throttling_errors_are_retried_with_backoff():
+    calls, delays = [], []
+
+    def operation():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Exception("error: Throttling: Rate exceeded\n\tstatus code: 400")
+        return "done"
+
+    assert with_retries(operation, retries=5, base_delay=1, sleep=delays.append) == "done"
+    assert len(calls) == 3
+    assert delays[0] <= 1 and delays[1] <= 2
+
+
+def test_other_errors_and_exhausted_retries_are_not_retried():
+    calls = []
+
+    def fails(message):
+        def operation():
+            calls.append(message)
+            raise Exception(message)
+        return operation
+
+    with pytest.raises(Exception, match="AccessDenied"):
+        with_retries(fails("AccessDenied"), retries=5, sleep=lambda _: None)
+    assert calls == ["AccessDenied"]
+
+    with pytest.raises(Exception, match="Throttling"):
+        with_retries(fails("Throttling"), retries=2, sleep=lambda _: None)
+    assert calls.count("Throttling") == 3
+
+
+def exports_only():
+    import pulumi
+    pulumi.export("stack", pulumi.get_stack())
+
+
+@pytest.mark.skipif(shutil.which("pulumi") is None, reason="needs the pulumi CLI")
+def test_runs_programs_against_a_local_backend(tmp_path):
+    env = {"PULUMI_BACKEND_URL": f"file://{tmp_path}", "PULUMI_CONFIG_PASSPHRASE": ""}
+
+    def task(name):
+        return StackTask(name, "up", program=exports_only, project_name="orchestrator-test", env=env)
+
+    results = orchestrate(task("hub"), [task("spoke1"), task("spoke2")], workers=2, run=run_stack)
+
+    assert [result.status for result in results] == ["succeeded"] * 3
+    assert all(result.attempts == 1 for result in results)
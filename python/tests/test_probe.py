@@ -0,0 +1,94 @@
+import os
+import subprocess
+
+import pytest
+
+import mock_runtime
+from probe import ProbeSettings, place_probes, probe_schedule, probe_user_data
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def test_probes_fill_every_az_before_doubling_up():
+    assert place_probes(2, 3) == [0, 1]
+    assert place_probes(5, 3) == [0, 1, 2, 0, 1]
+
+
+def test_probes_take_turns_measuring_different_peers():
+    spokes = ["spoke1", "spoke2", "spoke3", "spoke4"]
+    schedules = {(spoke, index): probe_schedule(spokes, spoke, index)
+                 for spoke in spokes for index in (1, 2, 3)}
+
+    for (spoke, index), schedule in schedules.items():
+        # One peer in every other spoke:
+        assert sorted(peer for peer, _ in schedule) == sorted(set(spokes) - {spoke})
+    for spoke in spokes:
+        # The probes of a spoke never measure the same peer:
+        peers = [peer for index in (1, 2, 3) for peer in schedules[spoke, index]]
+        assert len(peers) == len(set(peers))
+    for r in range(len(spokes) - 1):
+        # Each probe is measured by one probe per round:
+        targets = [schedule[r] for schedule in schedules.values()]
+        assert len(targets) == len(set(targets))
+
+
+def run_probe_script(user_data):
+    '''Returns the run-probe script the user data installs.'''
+    return user_data.split("<<'PROBE'\n", 1)[1].split("\nPROBE\n", 1)[0]
+
+
+@pytest.mark.parametrize("results_bucket", [None, "probe-results"])
+def test_user_data_is_valid_bash(results_bucket):
+    user_data = probe_user_data(
+        ProbeSettings(urls=["https://aws.amazon.com/", "https://example.com/?a=1&b=2"],
+                      results_bucket=results_bucket),
+        group="project-dev", spoke="spoke1", probe="spoke1-probe-1", expected_peers=6,
+        schedule=[("spoke2", 1), ("spoke3", 1)])
+
+    for script in [user_data, run_probe_script(user_data)]:
+        subprocess.run(["bash", "-n"], input=script, text=True, check=True)
+
+
+def test_user_data_carries_the_settings():
+    script = run_probe_script(probe_user_data(
+        ProbeSettings(duration=30, parallel=8, results_bucket="probe-results"),
+        group="project-dev", spoke="spoke1", probe="spoke1-probe-2", expected_peers=6))
+
+    assert "expected_peers=6" in script
+    assert "--time 30 --parallel 8" in script
+    assert "s3://probe-results/project-dev/spoke1-probe-2/" in script
+    assert "/var/log/probe/latest" in script
+
+
+def test_probe_mode_spreads_probes_across_azs():
+    mocks = mock_runtime.run_main(MAIN, config={
+        "spokes": '[{"name": "spoke1", "workload": true}, {"name": "spoke2", "workload": true}]',
+        "probe": '{"instances": 4}',
+    })
+
+    instances = mocks.resources_of_type("aws:ec2/instance:Instance")
+    assert sorted(instance.inputs["subnetId"] for instance in instances
+                  if instance.inputs["tags"]["probe-spoke"] == "spoke1") == [
+        "spoke1-vpc-private-1-id", "spoke1-vpc-private-1-id",
+        "spoke1-vpc-private-2-id", "spoke1-vpc-private-3-id"]
+    assert all("expected_peers=8" in instance.inputs["userData"] for instance in instances)
+    assert len(instances) == 8
+
+    # Each probe measures the probe with the same index in the other spoke:
+    by_name = {instance.name: instance for instance in instances}
+    for i in (1, 2, 3, 4):
+        assert by_name[f"spoke1-probe-{i}"].inputs["tags"]["probe-index"] == str(i)
+        assert f"<<'SCHEDULE'\nspoke2 {i}\nSCHEDULE" in by_name[f"spoke1-probe-{i}"].inputs["userData"]
+
+    # Every probe shares one AMI lookup:
+    assert mocks.invokes["aws:ec2/getAmi:getAmi"] == 1
+
+
+def test_without_probe_settings_workloads_keep_a_single_instance():
+    mocks = mock_runtime.run_main(MAIN, config={
+        "spokes": '[{"name": "spoke1", "workload": true}]',
+    })
+
+    [instance] = mocks.resources_of_type("aws:ec2/instance:Instance")
+    assert instance.name == "spoke1-instance"
+    assert "userData" not in instance.inputs
@@ -0,0 +1,45 @@
+import json
+import os
+
+import mock_runtime
+import profiling
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def test_profiling_is_off_by_default():
+    mock_runtime.run_main(MAIN)
+
+    assert profiling.stop() is None
+
+
+def test_profile_records_components_applies_invokes_and_resources(tmp_path):
+    trace_path = tmp_path / "trace.json"
+    mocks = mock_runtime.run_main(MAIN, config={
+        "profile": str(trace_path),
+        "spokes": '[{"name": "spoke1", "workload": true}, {"name": "spoke2"}]',
+    })
+    profiler = profiling.stop()
+
+    rows = {row["component"]: row for row in profiler.summary()}
+    assert rows["SpokeVpc"]["count"] == 2
+    assert rows["HubVpc"]["count"] == rows["SpokeWorkload"]["count"] == 1
+    assert rows["create_firewall_policy"]["count"] == 1
+    assert rows["HubVpc"]["applies"] > 0
+    # The AZ lookup runs before the hub; the AMI lookup is the fleet's:
+    assert rows["program"]["invokes"] == sum(mocks.invokes.values()) == 2
+    assert sum(row["resources"] for row in rows.values()) == len(mocks.resources)
+
+    trace = json.loads(trace_path.read_text())
+    assert {event["cat"] for event in trace["traceEvents"]} == {"construct", "apply", "invoke"}
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace["traceEvents"])
+
+    assert "SpokeVpc" in profiler.format_summary()
+
+
+def test_applies_run_normally_once_profiling_stops(tmp_path):
+    mock_runtime.run_main(MAIN, config={"profile": str(tmp_path / "trace.json")})
+    profiling.stop()
+
+    import pulumi
+    assert pulumi.Output.apply is profiling._original_apply
@@ -0,0 +1,202 @@
+import ipaddress
+import json
+import os
+import random
+
+import mock_runtime
+from route_analyzer import BLACKHOLE, DELIVERED, INTERNET, RadixTrie, RouteGraph
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def run_program(spokes, drop=()):
+    mocks = mock_runtime.run_main(MAIN, config={
+        "spokes": json.dumps([{"name": name} for name in spokes]),
+        "spoke-prefix-length": "20",
+    })
+    return RouteGraph(r for r in mocks.registrations if r.name not in drop)
+
+
+def test_longest_prefix_match():
+    generator = random.Random(3)
+    networks = [ipaddress.ip_network((generator.getrandbits(32), length), strict=False)
+                for length in (0, 8, 12, 16, 20, 24, 28, 32) for _ in range(20)]
+    trie = RadixTrie()
+    for network in networks:
+        trie.insert(network, str(network))
+
+    for _ in range(1000):
+        address = ipaddress.ip_address(generator.getrandbits(32))
+        expected = max((n for n in networks if address in n), key=lambda n: n.prefixlen)
+        assert trie.longest_match(int(address)).target == str(expected)
+
+
+def test_program_routes_have_no_findings():
+    graph = run_program(["spoke1", "spoke2", "spoke3"])
+    private = graph.subnets_named("private")
+    assert len(private) == 9
+
+    findings = graph.check_pairs(private)
+    assert findings.ok
+    # 3 pairs of spokes x 3 x 3 pairs of AZs, both ways:
+    assert findings.paths_checked == 54
+
+    egress = graph.check_egress(private)
+    assert egress.ok
+
+    path = graph.path("spoke1-vpc-private-2", "8.8.8.8")
+    assert path.outcome == INTERNET
+    assert [(hop.kind, hop.zone) for hop in path.hops] == [
+        ("subnet", "us-east-1b"),
+        ("tgw-route-table", "us-east-1b"),
+        ("subnet", "us-east-1b"),
+        ("nat-gateway", "us-east-1a"),
+    ]
+
+
+def inspected_topology(appliance_mode):
+    # Two spokes and an inspection VPC, each with a subnet in two AZs. The
+    # spokes' traffic to each other goes through the firewall endpoint in
+    # the AZ it reaches the inspection VPC in.
+    resources = [("awsx:ec2:Vpc", "hub", "hub", {"vpcId": "vpc-hub", "cidrBlock": "10.9.0.0/16"})]
+    for vpc, cidr in (("a", "10.1"), ("b", "10.2")):
+        resources += [
+            ("awsx:ec2:Vpc", vpc, vpc, {"vpcId": f"vpc-{vpc}", "cidrBlock": f"{cidr}.0.0/16"}),
+            ("aws:ec2/route:Route", f"{vpc}-default", f"{vpc}-default", {
+                "routeTableId": f"{vpc}-rtb", "destinationCidrBlock": "0.0.0.0/0", "transitGatewayId": "tgw"}),
+            ("aws:ec2transitgateway/vpcAttachment:VpcAttachment", f"{vpc}-att", f"{vpc}-att", {
+                "vpcId": f"vpc-{vpc}", "subnetIds": [f"{vpc}-1", f"{vpc}-2"]}),
+            ("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation", f"{vpc}-assoc", f"{vpc}-assoc", {
+                "transitGatewayAttachmentId": f"{vpc}-att", "transitGatewayRouteTableId": "spokes"}),
+            ("aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation", f"{vpc}-prop", f"{vpc}-prop", {
+                "transitGatewayAttachmentId": f"{vpc}-att", "transitGatewayRouteTableId": "hub"}),
+        ]
+        for i in (1, 2):
+            resources += [
+                ("aws:ec2/subnet:Subnet", f"{vpc}-private-{i}", f"{vpc}-{i}", {
+                    "vpcId": f"vpc-{vpc}", "availabilityZone": f"az{i}", "cidrBlock": f"{cidr}.{i}.0/24"}),
+                ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"{vpc}-{i}", f"{vpc}-{i}-assoc", {
+                    "subnetId": f"{vpc}-{i}", "routeTableId": f"{vpc}-rtb"}),
+            ]
+    resources += [
+        ("aws:ec2transitgateway/vpcAttachment:VpcAttachment", "hub-att", "hub-att", {
+            "vpcId": "vpc-hub", "subnetIds": ["hub-tgw-1", "hub-tgw-2"],
+            **({"applianceModeSupport": "enable"} if appliance_mode else {})}),
+        ("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation", "hub-assoc", "hub-assoc", {
+            "transitGatewayAttachmentId": "hub-att", "transitGatewayRouteTableId": "hub"}),
+        ("aws:ec2transitgateway/route:Route", "to-hub", "to-hub", {
+            "transitGatewayRouteTableId": "spokes", "destinationCidrBlock": "0.0.0.0/0",
+            "transitGatewayAttachmentId": "hub-att"}),
+    ]
+    for i in (1, 2):
+        resources += [
+            ("aws:ec2/subnet:Subnet", f"hub-tgw-{i}", f"hub-tgw-{i}", {
+                "vpcId": "vpc-hub", "availabilityZone": f"az{i}", "cidrBlock": f"10.9.{i}.0/28"}),
+            ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"hub-tgw-{i}", f"hub-tgw-{i}-assoc", {
+                "subnetId": f"hub-tgw-{i}", "routeTableId": f"hub-tgw-{i}-rtb"}),
+            ("aws:ec2/route:Route", f"hub-tgw-{i}", f"hub-tgw-{i}", {
+                "routeTableId": f"hub-tgw-{i}-rtb", "destinationCidrBlock": "10.0.0.0/8", "vpcEndpointId": f"vpce-{i}"}),
+            ("aws:ec2/subnet:Subnet", f"hub-inspection-{i}", f"insp-{i}", {
+                "vpcId": "vpc-hub", "availabilityZone": f"az{i}", "cidrBlock": f"10.9.{i}.16/28"}),
+            ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"insp-{i}", f"insp-{i}-assoc", {
+                "subnetId": f"insp-{i}", "routeTableId": f"insp-{i}-rtb"}),
+            ("aws:ec2/route:Route", f"insp-{i}", f"insp-{i}", {
+                "routeTableId": f"insp-{i}-rtb", "destinationCidrBlock": "10.0.0.0/8", "transitGatewayId": "tgw"}),
+        ]
+    resources.append(("aws:networkfirewall/firewall:Firewall", "fw", "fw", {"firewallStatuses": [{"syncStates": [
+        {"availabilityZone": f"az{i}", "attachments": [{"subnetId": f"insp-{i}", "endpointId": f"vpce-{i}"}]}
+        for i in (1, 2)
+    ]}]}))
+    return RouteGraph(resources)
+
+
+def test_cross_az_pairs_are_checked_and_symmetric_in_appliance_mode():
+    subnets = ["a-private-1", "a-private-2", "b-private-1", "b-private-2"]
+
+    findings = inspected_topology(appliance_mode=True).check_pairs(subnets)
+    assert findings.ok
+    assert findings.paths_checked == 8
+
+    # Without it, each direction is inspected in the AZ it entered the TGW
+    # from, so only traffic within an AZ is symmetric:
+    findings = inspected_topology(appliance_mode=False).check_pairs(subnets)
+    assert not findings.blackholes
+    assert {(there.source, there.destination) for there, back in findings.asymmetric} == {
+        ("a-private-1", "b-private-2"), ("a-private-2", "b-private-1")}
+    there, back = findings.asymmetric[0]
+    assert [hop.id for hop in there.stateful_hops] != [hop.id for hop in back.stateful_hops]
+
+
+def test_missing_propagation_is_a_blackhole():
+    graph = run_program(["spoke1", "spoke2"], drop={"spoke2-tgw-route-table-propagation"})
+
+    findings = graph.check_pairs(graph.subnets_named("private"))
+
+    # spoke1 -> spoke2 falls through to the default route and out the NAT:
+    assert {(p.source, p.outcome) for p in findings.blackholes} == {
+        (f"spoke1-vpc-private-{i+1}", BLACKHOLE) for i in range(3)}
+    assert "private address" in findings.blackholes[0].reason
+
+
+def test_traffic_crossing_different_firewall_endpoints_is_asymmetric():
+    # Two VPCs and an inspection VPC whose firewall endpoints return traffic
+    # through the wrong AZ:
+    resources = [
+        ("awsx:ec2:Vpc", "a", "a", {"vpcId": "vpc-a", "cidrBlock": "10.1.0.0/16"}),
+        ("awsx:ec2:Vpc", "b", "b", {"vpcId": "vpc-b", "cidrBlock": "10.2.0.0/16"}),
+        ("awsx:ec2:Vpc", "hub", "hub", {"vpcId": "vpc-hub", "cidrBlock": "10.9.0.0/16"}),
+    ]
+    for vpc, cidr in (("a", "10.1"), ("b", "10.2")):
+        resources += [
+            ("aws:ec2/subnet:Subnet", f"{vpc}-private-1", f"{vpc}-1", {
+                "vpcId": f"vpc-{vpc}", "availabilityZone": "az1", "cidrBlock": f"{cidr}.0.0/24"}),
+            ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"{vpc}-1", f"{vpc}-1-assoc", {
+                "subnetId": f"{vpc}-1", "routeTableId": f"{vpc}-rtb"}),
+            ("aws:ec2/route:Route", f"{vpc}-default", f"{vpc}-default", {
+                "routeTableId": f"{vpc}-rtb", "destinationCidrBlock": "0.0.0.0/0", "transitGatewayId": "tgw"}),
+            ("aws:ec2transitgateway/vpcAttachment:VpcAttachment", f"{vpc}-att", f"{vpc}-att", {
+                "vpcId": f"vpc-{vpc}", "subnetIds": [f"{vpc}-1"]}),
+            ("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation", f"{vpc}-assoc", f"{vpc}-assoc", {
+                "transitGatewayAttachmentId": f"{vpc}-att", "transitGatewayRouteTableId": "spokes"}),
+            ("aws:ec2transitgateway/routeTablePropagation:RouteTablePropagation", f"{vpc}-prop", f"{vpc}-prop", {
+                "transitGatewayAttachmentId": f"{vpc}-att", "transitGatewayRouteTableId": "hub"}),
+        ]
+    resources += [
+        ("aws:ec2transitgateway/vpcAttachment:VpcAttachment", "hub-att", "hub-att", {
+            "vpcId": "vpc-hub", "subnetIds": ["hub-tgw-1"]}),
+        ("aws:ec2transitgateway/routeTableAssociation:RouteTableAssociation", "hub-assoc", "hub-assoc", {
+            "transitGatewayAttachmentId": "hub-att", "transitGatewayRouteTableId": "hub"}),
+        ("aws:ec2transitgateway/route:Route", "to-hub", "to-hub", {
+            "transitGatewayRouteTableId": "spokes", "destinationCidrBlock": "0.0.0.0/0",
+            "transitGatewayAttachmentId": "hub-att"}),
+        ("aws:ec2/subnet:Subnet", "hub-tgw-1", "hub-tgw-1", {
+            "vpcId": "vpc-hub", "availabilityZone": "az1", "cidrBlock": "10.9.0.0/24"}),
+        ("aws:ec2/routeTableAssociation:RouteTableAssociation", "hub-tgw-1", "hub-tgw-1-assoc", {
+            "subnetId": "hub-tgw-1", "routeTableId": "hub-tgw-rtb"}),
+        # Traffic to b is inspected in az1, but traffic to a in az2:
+        ("aws:ec2/route:Route", "to-b", "to-b", {
+            "routeTableId": "hub-tgw-rtb", "destinationCidrBlock": "10.2.0.0/16", "vpcEndpointId": "vpce-1"}),
+        ("aws:ec2/route:Route", "to-a", "to-a", {
+            "routeTableId": "hub-tgw-rtb", "destinationCidrBlock": "10.1.0.0/16", "vpcEndpointId": "vpce-2"}),
+    ]
+    for i in (1, 2):
+        resources += [
+            ("aws:ec2/subnet:Subnet", f"hub-inspection-{i}", f"insp-{i}", {
+                "vpcId": "vpc-hub", "availabilityZone": f"az{i}", "cidrBlock": f"10.9.{i}.0/24"}),
+            ("aws:ec2/routeTableAssociation:RouteTableAssociation", f"insp-{i}", f"insp-{i}-assoc", {
+                "subnetId": f"insp-{i}", "routeTableId": f"insp-{i}-rtb"}),
+            ("aws:ec2/route:Route", f"insp-{i}", f"insp-{i}", {
+                "routeTableId": f"insp-{i}-rtb", "destinationCidrBlock": "10.0.0.0/8", "transitGatewayId": "tgw"}),
+        ]
+    resources.append(("aws:networkfirewall/firewall:Firewall", "fw", "fw", {"firewallStatuses": [{"syncStates": [
+        {"availabilityZone": f"az{i}", "attachments": [{"subnetId": f"insp-{i}", "endpointId": f"vpce-{i}"}]}
+        for i in (1, 2)
+    ]}]}))
+
+    findings = RouteGraph(resources).check_pairs(["a-private-1", "b-private-1"])
+
+    assert not findings.blackholes
+    [(there, back)] = findings.asymmetric
+    assert [hop.id for hop in there.stateful_hops] == ["vpce-1"]
+    assert [hop.id for hop in back.stateful_hops] == ["vpce-2"]
+    assert there.outcome == back.outcome == DELIVERED
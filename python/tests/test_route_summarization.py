@@ -0,0 +1,94 @@
+import ipaddress
+import json
+import os
+import random
+
+import mock_runtime
+from route_analyzer import RadixTrie, RouteGraph
+from route_summarization import summarize_routes
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+
+def lookup(routes, address):
+    '''Longest-prefix match by brute force; None if nothing matches.'''
+    matches = [ipaddress.ip_network(prefix) for prefix in routes
+               if address in ipaddress.ip_network(prefix)]
+    if not matches:
+        return None
+    return routes[str(max(matches, key=lambda network: network.prefixlen))]
+
+
+def test_covers_a_more_specific_route_to_another_target():
+    routes = {
+        "10.0.0.0/24": "a",
+        "10.0.1.0/24": "b",
+        "10.0.2.0/24": "a",
+        "10.0.3.0/24": "a",
+    }
+    assert summarize_routes(routes) == {"10.0.0.0/22": "a", "10.0.1.0/24": "b"}
+
+
+def test_collapses_adjacent_prefixes():
+    routes = {f"10.0.{i}.0/24": "a" for i in range(4)}
+    assert summarize_routes(routes) == {"10.0.0.0/22": "a"}
+
+
+def test_does_not_cover_unrouted_addresses():
+    routes = {"10.0.0.0/24": "a", "10.0.2.0/24": "a", "10.0.3.0/24": "a"}
+    # 10.0.1.0/24 has no route, so 10.0.0.0/22 would capture it:
+    assert summarize_routes(routes) == {"10.0.0.0/24": "a", "10.0.2.0/23": "a"}
+
+
+def test_does_not_cover_protected_ranges():
+    routes = {"10.0.0.0/24": "a", "10.0.2.0/24": "a", "10.0.3.0/24": "a"}
+    assert summarize_routes(routes) == {"10.0.0.0/24": "a", "10.0.2.0/23": "a"}
+    assert summarize_routes(routes, protected=["10.0.1.0/24"]) == {
+        "10.0.0.0/24": "a", "10.0.2.0/23": "a"}
+
+
+def test_protected_ranges_keep_their_routes():
+    # A route inside a protected range still forwards it:
+    routes = {"10.0.0.0/24": "a", "10.0.1.0/24": "a"}
+    assert summarize_routes(routes, protected=["10.0.0.0/25"]) == {"10.0.0.0/23": "a"}
+    # And so does a route covering it:
+    routes = {"0.0.0.0/0": "hub", "10.1.0.0/16": "s1"}
+    assert summarize_routes(routes, protected=["10.157.75.0/24"]) == routes
+
+
+def test_forwards_every_address_as_before():
+    generator = random.Random(7)
+    for _ in range(50):
+        routes = {}
+        for _ in range(generator.randint(1, 12)):
+            network = ipaddress.ip_network(
+                (0x0A000000 | generator.getrandbits(12) << 8, generator.randint(16, 26)), strict=False)
+            routes[str(network)] = generator.choice("abc")
+        protected = [str(ipaddress.ip_network((0x0A000000 | generator.getrandbits(12) << 8, 24), strict=False))]
+
+        summarized = summarize_routes(routes, protected)
+        assert len(summarized) <= len(routes)
+
+        trie = RadixTrie()
+        for prefix, target in summarized.items():
+            trie.insert(ipaddress.ip_network(prefix), target)
+        for _ in range(200):
+            address = ipaddress.ip_address(0x0A000000 | generator.getrandbits(24))
+            expected = lookup(routes, address)
+            match = trie.longest_match(int(address))
+            assert (match.target if match else None) == expected
+
+
+def test_program_tgw_route_tables_cannot_be_summarized():
+    mocks = mock_runtime.run_main(MAIN, config={
+        "spokes": json.dumps([{"name": f"spoke{i}"} for i in range(1, 5)]),
+        "spoke-prefix-length": "20",
+    })
+    graph = RouteGraph.from_mocks(mocks)
+
+    # Each spoke is behind its own attachment, so no two of its routes can
+    # be merged:
+    counts = graph.tgw_route_counts()
+    summarized = graph.summarized_tgw_routes()
+    assert {table_id: len(routes) for table_id, routes in summarized.items()} == counts
+    assert counts["hub-tgw-route-table-id"] == 4
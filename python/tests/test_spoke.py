@@ -0,0 +1,41 @@
+import mock_runtime
+from spoke import SpokeVpc, SpokeVpcArgs
+
+
+def build_spokes(count):
+    def program():
+        for i in range(count):
+            SpokeVpc(
+                f"spoke{i+1}",
+                SpokeVpcArgs(
+                    vpc_cidr_block=f"10.{i}.0.0/16",
+                    tgw_id="tgw-id",
+                    tgw_route_table_id="spoke-tgw-route-table-id",
+                ),
+            )
+    return mock_runtime.run(program)
+
+
+def test_spokes_need_no_invokes():
+    mocks = build_spokes(5)
+
+    assert sum(mocks.invokes.values()) == 0
+    assert len(mocks.resources_of_type(
+        "aws:ec2transitgateway/vpcAttachment:VpcAttachment")) == 5
+
+
+def test_spoke_wiring_comes_from_vpc_outputs():
+    mocks = build_spokes(1)
+
+    [attachment] = mocks.resources_of_type(
+        "aws:ec2transitgateway/vpcAttachment:VpcAttachment")
+    assert attachment.inputs["subnetIds"] == [
+        f"spoke1-vpc-tgw-{i+1}-id" for i in range(3)]
+
+    routes = mocks.resources_of_type("aws:ec2/route:Route")
+    assert sorted(route.inputs["routeTableId"] for route in routes) == [
+        f"spoke1-vpc-private-{i+1}-rtb-id" for i in range(3)]
+
+    for endpoint in mocks.resources_of_type("aws:ec2/vpcEndpoint:VpcEndpoint"):
+        assert endpoint.inputs["subnetIds"] == [
+            f"spoke1-vpc-private-{i+1}-id" for i in range(3)]
@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+import mock_runtime
+from route_analyzer import DELIVERED, RouteGraph
+from tests.test_hub_reference import HUB_OUTPUTS, run_spokes
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "__main__.py")
+
+SPOKES = json.dumps([{"name": f"spoke{i}"} for i in range(1, 5)])
+
+ENDPOINT = "aws:ec2/vpcEndpoint:VpcEndpoint"
+SECURITY_GROUP = "aws:ec2/securityGroup:SecurityGroup"
+ZONE_ASSOCIATION = "aws:route53/zoneAssociation:ZoneAssociation"
+
+
+def run_program(**config):
+    return mock_runtime.run_main(MAIN, config={"spokes": SPOKES, "spoke-prefix-length": "20", **config})
+
+
+def test_each_spoke_has_its_own_endpoints_by_default():
+    mocks = run_program(**{"vpc-endpoint-services": '["ssm", "logs"]'})
+
+    endpoints = mocks.resources_of_type(ENDPOINT)
+    assert len(endpoints) == 4 * 2
+    assert {e.inputs["serviceName"] for e in endpoints} == {
+        "com.amazonaws.us-east-1.ssm", "com.amazonaws.us-east-1.logs"}
+    assert all(e.inputs["privateDnsEnabled"] for e in endpoints)
+    assert not mocks.resources_of_type(ZONE_ASSOCIATION)
+
+
+def test_centralized_endpoints_are_created_once_in_the_hub():
+    per_spoke = run_program()
+    centralized = run_program(**{"vpc-endpoint-mode": "centralized"})
+
+    endpoints = centralized.resources_of_type(ENDPOINT)
+    assert sorted(e.name for e in endpoints) == ["hub-endpoint-ec2messages", "hub-endpoint-ssm", "hub-endpoint-ssmmessages"]
+    assert not any(e.inputs["privateDnsEnabled"] for e in endpoints)
+    assert not [sg.name for sg in centralized.resources_of_type(SECURITY_GROUP) if sg.name.startswith("spoke")]
+
+    zones = {zone.inputs["name"]: f"Z{zone.name}" for zone in centralized.resources_of_type("aws:route53/zone:Zone")}
+    assert sorted(zones) == ["ec2messages.us-east-1.amazonaws.com", "ssm.us-east-1.amazonaws.com",
+                             "ssmmessages.us-east-1.amazonaws.com"]
+    associations = centralized.resources_of_type(ZONE_ASSOCIATION)
+    assert len(associations) == 4 * 3
+    assert {a.inputs["zoneId"] for a in associations} == set(zones.values())
+
+    # Each spoke trades a security group and an endpoint per service for a
+    # zone association per service:
+    assert len(per_spoke.resources_of_type(ENDPOINT)) == 4 * 3
+
+    def spoke_resources(mocks):
+        return len([r for r in mocks.resources if r.name.startswith("spoke")])
+
+    assert spoke_resources(centralized) == spoke_resources(per_spoke) - 4
+
+
+@pytest.mark.parametrize("routing_mode", ["direct", "firewall"])
+def test_spokes_reach_the_hub_endpoints(routing_mode):
+    mocks = run_program(**{"vpc-endpoint-mode": "centralized", "routing-mode": routing_mode})
+    graph = RouteGraph.from_mocks(mocks)
+
+    # An address in each AZ's endpoint subnet, both ways:
+    for i in range(3):
+        endpoint_subnet = f"hub-endpoints-{i+1}"
+        address = str(graph.subnets[f"{endpoint_subnet}-id"].cidr[4])
+        path = graph.path(f"spoke1-vpc-private-{i+1}", address)
+        assert path.outcome == DELIVERED, path
+        back = graph.path(endpoint_subnet, str(graph.subnets[f"spoke1-vpc-private-{i+1}-id"].cidr[4]))
+        assert back.outcome == DELIVERED, back
+
+
+def test_spoke_stacks_use_the_hub_stacks_zones():
+    zone_ids = {"ec2messages": "Z1", "ssmmessages": "Z2", "ssm": "Z3"}
+    mocks = run_spokes({**HUB_OUTPUTS, "endpoint-zone-ids": zone_ids}, **{"vpc-endpoint-mode": "centralized"})
+
+    assert not mocks.resources_of_type(ENDPOINT)
+    assert {a.inputs["zoneId"] for a in mocks.resources_of_type(ZONE_ASSOCIATION)} == set(zone_ids.values())
+
+    with pytest.raises(Exception, match="no VPC endpoint for 'ssm'"):
+        run_spokes({**HUB_OUTPUTS, "endpoint-zone-ids": {"ec2messages": "Z1", "ssmmessages": "Z2"}},
+                   **{"vpc-endpoint-mode": "centralized"})
+
+
+@pytest.mark.parametrize("config, message", [
+    ({"vpc-endpoint-mode": "shared"}, "Unknown VPC endpoint mode"),
+    ({"vpc-endpoint-mode": "centralized", "vpc-endpoint-services": '["ssm", "s3"]'}, "Cannot centralize"),
+    ({"vpc-endpoint-services": '["ssm", "ssm"]'}, "more than once"),
+])
+def test_invalid_endpoint_config_is_rejected(config, message):
+    with pytest.raises(Exception, match=message):
+        run_program(**config)
@@ -0,0 +1,66 @@
+'''Interface VPC endpoints for the spokes: by default the SSM services that
+Session Manager needs to reach the workloads.
+
+The `vpc-endpoint-mode` config value selects where the endpoints live:
+
+- `per-spoke` (the default): each spoke gets a security group and one
+  endpoint per service, with private DNS, in its own VPC.
+- `centralized`: each endpoint is created once, in the hub VPC, together
+  with a private hosted zone for the service's DNS name that resolves to it.
+  Each spoke only associates its VPC with those zones and reaches the
+  endpoints over the TGW. There are no endpoints (or endpoint hours) per
+  spoke, and no security group.
+
+`vpc-endpoint-services` lists the services, e.g.
+`[ssm, ssmmessages, ec2messages, logs, kms]`. Centralizing relies on a
+service's private DNS name being `<service>.<region>.amazonaws.com`. That's
+true of most interface endpoint services, but not of S3 or of services with
+a dotted name like `ecr.dkr`, which keep needing per-spoke endpoints.'''
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+import pulumi
+
+ENDPOINT_MODES = ("per-spoke", "centralized")
+DEFAULT_ENDPOINT_SERVICES = ("ec2messages", "ssmmessages", "ssm")
+
+
+@dataclass
+class EndpointSettings:
+    mode: str = "per-spoke"
+    services: Sequence[str] = field(default_factory=lambda: list(DEFAULT_ENDPOINT_SERVICES))
+
+    @property
+    def centralized(self) -> bool:
+        return self.mode == "centralized"
+
+
+def load_endpoint_settings(config: pulumi.Config) -> EndpointSettings:
+    mode = config.get("vpc-endpoint-mode") or "per-spoke"
+    if mode not in ENDPOINT_MODES:
+        raise Exception(
+            f"Unknown VPC endpoint mode '{mode}'. Expected one of: {', '.join(ENDPOINT_MODES)}.")
+
+    services: List[str] = config.get_object("vpc-endpoint-services") or list(DEFAULT_ENDPOINT_SERVICES)
+    duplicates = sorted({service for service in services if services.count(service) > 1})
+    if duplicates:
+        raise Exception(
+            f"VPC endpoint services are listed more than once: {', '.join(duplicates)}.")
+    if mode == "centralized":
+        dotted = [service for service in services if "." in service or service == "s3"]
+        if dotted:
+            raise Exception(
+                f"Cannot centralize the endpoints for {', '.join(dotted)}: their private DNS names "
+                f"aren't <service>.<region>.amazonaws.com. Use vpc-endpoint-mode per-spoke.")
+
+    return EndpointSettings(mode=mode, services=services)
+
+
+def service_name(service: str, region: str) -> str:
+    return f"com.amazonaws.{region}.{service}"
+
+
+def private_dns_name(service: str, region: str) -> str:
+    '''The name the AWS SDKs and agents resolve for `service`, which the
+    centralized endpoint's private hosted zone answers for.'''
+    return f"{service}.{region}.amazonaws.com"
@@ -0,0 +1,53 @@
+from typing import List, Sequence
+
+import pulumi
+import pulumi_awsx as awsx
+
+
+def subnet_ids_by_name(vpc: awsx.ec2.Vpc, vpc_name: str, subnet_name: str) -> pulumi.Output[List[str]]:
+    '''Returns the IDs of the subnets awsx created for the subnet spec called
+    `subnet_name`, ordered by AZ index.
+
+    awsx tags each subnet it creates with a Name of the form
+    `{vpc_name}-{subnet_name}-{az_index}`, so we read the subnets straight from
+    the Vpc's typed outputs instead of querying AWS with `get_subnets`.'''
+    prefix = f"{vpc_name}-{subnet_name}-"
+
+    def select(subnets: Sequence[dict]) -> List[str]:
+        matches = []
+        for subnet in subnets:
+            tag = (subnet["tags"] or {}).get("Name", "")
+            if tag.startswith(prefix) and tag[len(prefix):].isdigit():
+                matches.append((int(tag[len(prefix):]), subnet["id"]))
+        return [subnet_id for _, subnet_id in sorted(matches)]
+
+    return vpc.subnets.apply(
+        lambda subnets: pulumi.Output.all(*[
+            pulumi.Output.all(id=subnet.id, tags=subnet.tags) for subnet in subnets
+        ])
+    ).apply(select)
+
+
+def route_table_ids(vpc: awsx.ec2.Vpc, subnet_ids: pulumi.Input[Sequence[str]]) -> pulumi.Output[List[str]]:
+    '''Returns the IDs of the route tables associated with `subnet_ids`, in the
+    same order, using the route table associations awsx creates alongside each
+    subnet rather than a `get_route_table` call per subnet.'''
+    def select(args) -> List[str]:
+        subnet_ids, associations = args
+        route_tables = dict(associations)
+        return [route_tables[subnet_id] for subnet_id in subnet_ids]
+
+    associations = vpc.route_table_associations.apply(
+        lambda associations: pulumi.Output.all(*[
+            pulumi.Output.all(association.subnet_id, association.route_table_id)
+            for association in associations
+        ])
+    )
+
+    return pulumi.Output.all(subnet_ids, associations).apply(select)
+
+
+def at_index(values: pulumi.Output[Sequence[str]], index: int) -> pulumi.Output[str]:
+    '''Returns the element of `values` at `index` as its own Output so that a
+    resource can be registered for it without waiting on the whole list.'''
+    return values.apply(lambda values: values[index])